@@ -15,43 +15,392 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import os
+import signal
 import sys
 import logging
 import time
 import datetime
 
 sys.path.append("../bookinfo")
+from budget import FileLimits
+from duplicates import DuplicateFinder
+from journal import JournalMerge, ResultJournal, in_shard, read_journals
+from lookup import LookupScheduler, RetryQueue
+from manifest import Manifest
+from metacache import MetaCache
+from metalookup import get_providers
 from metasearch import BookMeta
+from metrics import Metrics, Progress
+from pipeline import RenamePipeline
+from resolver import IsbnResolver
+from tikaserver import Tika
+from watcher import DropFolderWatcher
 
 logger = logging.getLogger('metasearch')
-IGNORE_PREFIX = ['EMANER_', 'DELIAF_', 'NRAW_', 'TSIXE-NUM', 'RORREPTTH_', 'YNAMOOT_']
+IGNORE_PREFIX = ['EMANER_', 'DELIAF_', 'NRAW_', 'TSIXE-NUM', 'RORREPTTH_', 'YNAMOOT_', 'TIMIL_']
+ISBNDB = 'goob'
+PATTERN = 'Publisher:Author:Year:Title:Language:ISBN-13'
+# PATTERN as BookMeta checks it and the manifest records it
+MANIFEST_PATTERN = ':'.join(BookMeta.check_pattern(PATTERN))
+
+
+def setup_logging(suffix=''):
+    # logging.basicConfig(level=logging.DEBUG)
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    console = logging.StreamHandler()
+    console.setLevel(logging.DEBUG)
+    console.setFormatter(formatter)
+    # handlers go on the root logger so that every bookinfo module is logged
+    root_logger = logging.getLogger()
+    root_logger.addHandler(console)
+    root_logger.setLevel(logging.DEBUG)
+    t = time.time()
+    # the suffix tells apart the logs of several processes started in the same second
+    logname = datetime.datetime.fromtimestamp(t).strftime('%Y_%m_%d_%H_%M_%S') + suffix
+    fh = logging.FileHandler(logname + '.log')
+    fh.setLevel(logging.DEBUG)
+    root_logger.addHandler(fh)
+    logging.debug('filesystemencoding = ' + sys.getfilesystemencoding())
+    return logname
+
+
+def open_isbns(filename):
+    """Open the list of ISBNs, one per line, of filename ('-' for stdin)."""
+    return sys.stdin if filename == '-' else open(filename)
+
+
+def warm_cache(cache, scheduler, filename, providers=ISBNDB):
+    f = open_isbns(filename)
+    try:
+        for record in IsbnResolver(scheduler, providers, cache).iter_records(f):
+            if record['outcome'] == IsbnResolver.OUTCOME_INVALID:
+                logger.error('Not a valid ISBN: ' + record['input'])
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def parse_limit(value):
+    """PROVIDER=RATE[:CONCURRENCY] -> (provider, (rate, concurrency))"""
+    try:
+        (provider, limit) = value.split('=', 1)
+        if ':' in limit:
+            (rate, concurrency) = limit.split(':', 1)
+        else:
+            (rate, concurrency) = (limit, LookupScheduler.DEFAULT_CONCURRENCY)
+        return provider, (float(rate), int(concurrency))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected PROVIDER=RATE[:CONCURRENCY], got ' + value)
+
+
+def parse_providers(value):
+    """P1,P2 -> 'P1,P2', at least one provider"""
+    try:
+        return ','.join(get_providers(value))
+    except ValueError as ex:
+        raise argparse.ArgumentTypeError(str(ex))
+
+
+def parse_shard(value):
+    """I/N -> (i, n), the shards being numbered from 0"""
+    try:
+        (index, count) = [int(n) for n in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected I/N, got ' + value)
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError('expected 0 <= I < N, got ' + value)
+    return index, count
+
+
+def inspect_cache(cache, isbns):
+    print('%-8s %-10s %10s %10s' % ('provider', 'outcome', 'entries', 'expired'))
+    for (provider, outcome, entries, expired) in cache.stats():
+        print('%-8s %-10s %10d %10d' % (provider, outcome, entries, expired))
+    for isbn in isbns:
+        for (provider, outcome, meta, stored) in cache.entries(isbn):
+            stored = datetime.datetime.fromtimestamp(stored).strftime('%Y-%m-%d %H:%M:%S')
+            print(isbn + ' ' + provider + ' ' + outcome + ' ' + stored)
+            for (key, value) in sorted(meta.items()):
+                print('    ' + key + ' : ' + (' '.join(value) if isinstance(value, list) else value))
+
+
+def get_ignore_prefix(retry_limited=False):
+    if retry_limited:
+        return tuple(prefix for prefix in IGNORE_PREFIX if prefix != BookMeta.RESULT_LIMITED + '_')
+    return tuple(IGNORE_PREFIX)
+
+
+def is_wanted(filename, manifest=None, retry_limited=False):
+    # the books of the manifest are skipped without opening them, unless they were renamed with
+    # another pattern or exceeded a limit which is retried; the others are skipped by their prefix
+    entry = manifest.get_unchanged(filename) if manifest is not None else None
+    if entry is not None:
+        if retry_limited and entry['result'] == BookMeta.RESULT_LIMITED:
+            return True
+        return not manifest.is_done(entry, MANIFEST_PATTERN)
+    return not os.path.basename(filename).startswith(get_ignore_prefix(retry_limited))
+
+
+def is_new_book(filename):
+    # the books renamed by the program are not watched
+    return filename.endswith(('.pdf', '.epub')) and not os.path.basename(filename).startswith(tuple(IGNORE_PREFIX))
+
+
+def iter_books(path, manifest=None, shard=None, retry_limited=False):
+    for root, dirs, files in os.walk(path):
+        for f in files:
+            if not f.endswith(('.pdf', '.epub')):
+                continue
+            filename = os.path.join(root, f)
+            if shard is not None and not in_shard(os.path.relpath(filename, path), shard):
+                continue
+            if is_wanted(filename, manifest, retry_limited):
+                yield filename
+
+
+def find_copies(books, report=None):
+    """Return the books without their byte-identical copies, and the copies of each book. With
+    report, the copies are listed in that file instead and left as they are."""
+    finder = DuplicateFinder()
+    (books, copies) = finder.split(list(books))
+    if report is not None:
+        finder.write_report(report)
+        copies = {}
+    return books, copies
+
+
+def rename_books(books, recorder, tika, cache, scheduler, providers=ISBNDB, manifest=None, metrics=None,
+                 retry_queue=None, copies=None, journal=None, limits=None):
+    # books whose provider is unavailable wait in the retry queue while the walk goes on; the
+    # caller of a given retry queue retries them
+    waiting = retry_queue is None
+    if waiting:
+        retry_queue = RetryQueue(scheduler)
+    for filename in books:
+        logger.debug('====== ====== ====== ====== ====== ======')
+        logger.debug('Processing ' + filename)
+        bookmata = BookMeta(filename, recorder, providers, PATTERN, tika, cache, scheduler, manifest, metrics,
+                            journal, limits)
+        if copies is not None:
+            bookmata.copies = copies.get(filename, [])
+        if not bookmata.rename(final=False):
+            retry_queue.add(bookmata)
+        retry_queue.drain()
+    if waiting:
+        retry_queue.finish()
+
+
+def watch_books(path, recorder, tika, cache, scheduler, providers=ISBNDB, manifest=None, metrics=None,
+                debounce=DropFolderWatcher.DEBOUNCE, poll_interval=DropFolderWatcher.POLL_INTERVAL, use_inotify=True,
+                limits=None):
+    """Rename the books of path, then the books written into it, until interrupted. Tika, the
+    scheduler, the cache and the manifest stay open between the books."""
+    retry_queue = RetryQueue(scheduler)
+    # watching first, so that the books written during the first walk are not missed
+    watcher = DropFolderWatcher(path, is_new_book, debounce, poll_interval, use_inotify)
+    try:
+        rename_books(iter_books(path, manifest), recorder, tika, cache, scheduler, providers, manifest, metrics,
+                     retry_queue, limits=limits)
+        logger.info('Watching ' + path)
+        for filenames in watcher.iter_batches():
+            books = [filename for filename in filenames if is_wanted(filename, manifest)]
+            rename_books(books, recorder, tika, cache, scheduler, providers, manifest, metrics, retry_queue,
+                         limits=limits)
+            # without an end of the run, a book is renamed for good after its last retry
+            retry_queue.drain(final=True)
+            recorder.flush()
+    finally:
+        watcher.close()
+
+
+def apply_journals(journals, recorder, manifest=None, dry_run=False):
+    """Rename the books planned in the journals of all shards, once the name collisions between
+    them are resolved."""
+    merge = JournalMerge(read_journals(journals))
+    plan = merge.make_plan()
+    for (entry, new_filename, result) in plan:
+        print(('[' + result + '] ' if result is not None else '') + entry['file'] + ' -> ' + new_filename)
+    print('%d renames, %d collisions, %d missing files' % (len(plan), len(merge.collisions), len(merge.missing)))
+    if not dry_run:
+        print('%d renamed' % merge.apply(recorder, manifest))
+
+
+def stop(signum, frame):
+    # the finally clauses close Tika and write the report
+    raise SystemExit(0)
+
+
+def rename_books_in_parallel(books, recorder, cache, scheduler, providers, jobs, manifest=None, metrics=None,
+                             copies=None, journal=None, limits=None):
+    pipeline = RenamePipeline(jobs, recorder, providers, PATTERN, cache, scheduler, manifest, metrics=metrics,
+                              journal=journal, limits=limits)
+    try:
+        pipeline.run(books, copies)
+    finally:
+        pipeline.close()
+
 
 if __name__ == '__main__':
-    # print("argv number = " + str(len(sys.argv)))
-    if len(sys.argv) > 1:
-        # logging.basicConfig(level=logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        console = logging.StreamHandler()
-        console.setLevel(logging.DEBUG)
-        console.setFormatter(formatter)
-        logger.addHandler(console)
-        logger.setLevel(logging.DEBUG)
-        t = time.time()
-        logname = datetime.datetime.fromtimestamp(t).strftime('%Y_%m_%d_%H_%M_%S')
-        fh = logging.FileHandler(logname + '.log')
-        fh.setLevel(logging.DEBUG)
-        logger.addHandler(fh)
-        recorder = open(logname + '_Rename.log', 'w')
-        logging.debug('filesystemencoding = ' + sys.getfilesystemencoding())
-        for root, dirs, files in os.walk(unicode(sys.argv[1], sys.getfilesystemencoding())):
-            for f in files:
-                if f.endswith(('.pdf', '.epub')) and not f.startswith('EMANER_') and not f.startswith(
-                        'DELIAF_') and not f.startswith('NRAW_') and not f.startswith('TSIXE-NUM') and not f.startswith(
-                        'RORREPTTH_') and not f.startswith('YNAMOOT_'):
-                    filename = os.path.join(root, f)
-                    logger.debug('====== ====== ====== ====== ====== ======')
-                    logger.debug('Processing ' + filename)
-                    bookmata = BookMeta(filename, recorder, 'goob', 'Publisher:Author:Year:Title:Language:ISBN-13')
-                    bookmata.rename()
-        recorder.close()
+    parser = argparse.ArgumentParser(description='Rename eBooks with the metadata found by their ISBN')
+    parser.add_argument('path', nargs='?', help='the PATH of eBook')
+    parser.add_argument('--cache', default='isbn_cache.sqlite', metavar='FILE',
+                        help='metadata cache file (default: isbn_cache.sqlite)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the metadata cache')
+    parser.add_argument('--cache-warm', metavar='FILE',
+                        help='look up the ISBNs listed in FILE (one per line, - for stdin) into the cache')
+    parser.add_argument('--cache-inspect', nargs='*', metavar='ISBN',
+                        help='print the cache statistics and the cached entries of the given ISBNs')
+    parser.add_argument('--cache-purge', choices=['expired'] + MetaCache.OUTCOMES + ['all'],
+                        help='delete the expired entries, all entries of one outcome, or all entries')
+    parser.add_argument('--providers', type=parse_providers, default=ISBNDB, metavar='P1,P2',
+                        help='metadata providers of isbnlib in order of preference (default: %(default)s)')
+    parser.add_argument('--manifest', default='isbn_manifest.sqlite', metavar='FILE',
+                        help='record of the processed eBooks, to skip them on the next run (default: %(default)s)')
+    parser.add_argument('--no-manifest', action='store_true', help='do not use the manifest')
+    parser.add_argument('--jobs', type=int, default=0, metavar='N',
+                        help='extract and scan the eBooks in N processes while looking up and renaming others')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='process the byte-identical copies of an eBook one by one')
+    parser.add_argument('--duplicates-report', metavar='FILE',
+                        help='list the byte-identical copies in FILE (JSON) and leave them as they are')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and rename the eBooks written into PATH as they arrive')
+    parser.add_argument('--watch-debounce', type=float, default=DropFolderWatcher.DEBOUNCE, metavar='SECONDS',
+                        help='wait until an eBook was not written for SECONDS seconds (default: %(default)s)')
+    parser.add_argument('--poll-interval', type=float, default=DropFolderWatcher.POLL_INTERVAL, metavar='SECONDS',
+                        help='seconds between two scans of PATH where inotify is not available (default: %(default)s)')
+    parser.add_argument('--no-inotify', action='store_true', help='scan PATH every --poll-interval seconds')
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help='process only the I-th of N parts of PATH (I from 0) and write a --journal; '
+                             '--rate and --limit are shared by the N parts')
+    parser.add_argument('--journal', metavar='FILE',
+                        help='append the planned renames to FILE instead of renaming the eBooks')
+    parser.add_argument('--apply', nargs='+', metavar='JOURNAL',
+                        help='rename the eBooks planned in the journals, resolving the name collisions first')
+    parser.add_argument('--dry-run', action='store_true', help='with --apply, print the plan without renaming')
+    parser.add_argument('--max-seconds', type=float, default=FileLimits.SECONDS, metavar='SECONDS',
+                        help='seconds of extraction and scanning per eBook, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--max-text-mb', type=float, default=FileLimits.TEXT_BYTES / 1024 / 1024, metavar='MB',
+                        help='MB of texts extracted per eBook, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--max-text-lines', type=int, default=FileLimits.TEXT_LINES, metavar='LINES',
+                        help='lines of texts scanned per eBook, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--max-zip-mb', type=float, default=FileLimits.ZIP_BYTES / 1024 / 1024, metavar='MB',
+                        help='MB decompressed from an EPUB, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--max-rss-mb', type=float, default=FileLimits.RSS / 1024 / 1024, metavar='MB',
+                        help='MB of resident memory added while reading an eBook, 0 for no limit '
+                             '(default: %(default)s)')
+    parser.add_argument('--retry-limited', action='store_true',
+                        help='process again the eBooks renamed with TIMIL_ for exceeding a limit')
+    parser.add_argument('--progress', type=float, default=0, metavar='SECONDS',
+                        help='log the eBooks done, the throughput and the ETA every SECONDS seconds')
+    parser.add_argument('--rate', type=float, default=LookupScheduler.DEFAULT_RATE,
+                        help='metadata requests per second to each provider (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=LookupScheduler.DEFAULT_CONCURRENCY,
+                        help='metadata requests in flight to each provider (default: %(default)s)')
+    parser.add_argument('--limit', type=parse_limit, action='append', default=[], metavar='PROVIDER=RATE[:N]',
+                        help='rate and concurrency of one provider, overriding --rate and --concurrency')
+    args = parser.parse_args()
+    cache_command = args.cache_warm is not None or args.cache_inspect is not None or args.cache_purge is not None
+    if args.apply is not None and (args.path is not None or cache_command or args.journal is not None):
+        parser.error('--apply can not be used with PATH, --journal or the cache commands')
+    if args.path is None and not cache_command and args.apply is None:
+        parser.error('the PATH of eBook is required')
+    if args.dry_run and args.apply is None:
+        parser.error('--dry-run needs --apply')
+    if args.shard is not None and args.journal is None:
+        parser.error('--shard needs --journal')
+    if args.journal is not None and (args.path is None or args.watch):
+        parser.error('--journal needs PATH and can not be used with --watch')
+    if args.shard is not None:
+        # every shard sends its requests to the same providers, --rate is the rate of them all
+        args.rate /= args.shard[1]
+        args.limit = [(provider, (rate / args.shard[1], concurrency)) for (provider, (rate, concurrency)) in args.limit]
+    if args.no_cache and cache_command:
+        parser.error('--no-cache can not be used with the cache commands')
+    if args.watch and (args.path is None or args.jobs > 0 or args.progress > 0):
+        parser.error('--watch needs PATH and can not be used with --jobs or --progress')
+    if args.duplicates_report is not None and (args.no_dedup or args.watch):
+        parser.error('--duplicates-report can not be used with --no-dedup or --watch')
+    if args.watch:
+        signal.signal(signal.SIGTERM, stop)
+
+    cache = None if args.no_cache else MetaCache(args.cache)
+    try:
+        if args.cache_purge is not None:
+            if args.cache_purge == 'expired':
+                count = cache.purge()
+            elif args.cache_purge == 'all':
+                count = cache.purge(expired_only=False)
+            else:
+                count = cache.purge(args.cache_purge, expired_only=False)
+            print(str(count) + ' entries purged')
+        if args.cache_warm is not None or args.path is not None:
+            logname = setup_logging('_%d_%d' % args.shard if args.shard is not None else '')
+            scheduler = LookupScheduler(args.rate, args.concurrency, dict(args.limit))
+            try:
+                if args.cache_warm is not None:
+                    warm_cache(cache, scheduler, args.cache_warm, args.providers)
+                if args.path is not None:
+                    manifest = None if args.no_manifest else Manifest(args.manifest)
+                    recorder = open(logname + '_Rename.log', 'w')
+                    tika = Tika() if args.jobs == 0 else None
+                    metrics = Metrics(logname + '_Report.csv')
+                    progress = None
+                    journal = ResultJournal(args.journal, args.shard) if args.journal is not None else None
+                    limits = FileLimits(args.max_seconds, int(args.max_text_mb * 1024 * 1024),
+                                        int(args.max_zip_mb * 1024 * 1024), int(args.max_rss_mb * 1024 * 1024),
+                                        args.max_text_lines)
+                    try:
+                        path = unicode(args.path, sys.getfilesystemencoding())
+                        books = iter_books(path, manifest, args.shard, args.retry_limited)
+                        copies = None
+                        if not args.no_dedup and not args.watch:
+                            (books, copies) = find_copies(books, args.duplicates_report)
+                        if args.progress > 0:
+                            # the ETA needs the number of eBooks before the first is done; every copy
+                            # is renamed, and counted as done, after its book
+                            books = list(books)
+                            total = len(books) + sum(len(same) for same in (copies or {}).values())
+                            progress = Progress(metrics, total, args.progress).start()
+                        if args.watch:
+                            watch_books(path, recorder, tika, cache, scheduler, args.providers, manifest, metrics,
+                                        args.watch_debounce, args.poll_interval, not args.no_inotify, limits)
+                        elif args.jobs > 0:
+                            rename_books_in_parallel(books, recorder, cache, scheduler, args.providers, args.jobs,
+                                                     manifest, metrics, copies, journal, limits)
+                        else:
+                            rename_books(books, recorder, tika, cache, scheduler, args.providers, manifest, metrics,
+                                         copies=copies, journal=journal, limits=limits)
+                    finally:
+                        if progress is not None:
+                            progress.stop()
+                        report = metrics.report()
+                        metrics.write_json(logname + '_Report.json', report)
+                        metrics.close()
+                        metrics.log_summary(report)
+                        if tika is not None:
+                            tika.close()
+                        recorder.close()
+                        if journal is not None:
+                            journal.close()
+                        if manifest is not None:
+                            manifest.close()
+            finally:
+                scheduler.close()
+        if args.apply is not None:
+            logname = setup_logging('_Apply')
+            manifest = None if args.no_manifest or args.dry_run else Manifest(args.manifest)
+            recorder = open(logname + '_Rename.log', 'w')
+            try:
+                apply_journals(args.apply, recorder, manifest, args.dry_run)
+            finally:
+                recorder.close()
+                if manifest is not None:
+                    manifest.close()
+        if args.cache_inspect is not None:
+            inspect_cache(cache, args.cache_inspect)
+    finally:
+        if cache is not None:
+            cache.close()
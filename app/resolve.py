@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import json
+import logging
+import sys
+
+sys.path.append("../bookinfo")
+from lookup import LookupScheduler
+from metacache import MetaCache
+from rename import ISBNDB, open_isbns, parse_limit, parse_providers
+from resolver import IsbnResolver
+
+logger = logging.getLogger('resolve')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Look up the metadata of a list of ISBNs and print it as JSON lines')
+    parser.add_argument('isbns', nargs='?', default='-', metavar='FILE',
+                        help='one ISBN per line, - for stdin (default: %(default)s)')
+    parser.add_argument('--output', metavar='FILE', help='write the JSON lines to FILE instead of stdout')
+    parser.add_argument('--cache', default='isbn_cache.sqlite', metavar='FILE',
+                        help='metadata cache file (default: isbn_cache.sqlite)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use the metadata cache')
+    parser.add_argument('--providers', type=parse_providers, default=ISBNDB, metavar='P1,P2',
+                        help='metadata providers of isbnlib in order of preference (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=IsbnResolver.BATCH_SIZE, metavar='N',
+                        help='ISBNs looked up together (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=LookupScheduler.DEFAULT_RATE,
+                        help='metadata requests per second to each provider (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=LookupScheduler.DEFAULT_CONCURRENCY,
+                        help='metadata requests in flight to each provider (default: %(default)s)')
+    parser.add_argument('--limit', type=parse_limit, action='append', default=[], metavar='PROVIDER=RATE[:N]',
+                        help='rate and concurrency of one provider, overriding --rate and --concurrency')
+    parser.add_argument('--verbose', action='store_true', help='log the lookups to stderr')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    cache = None if args.no_cache else MetaCache(args.cache)
+    scheduler = LookupScheduler(args.rate, args.concurrency, dict(args.limit))
+    f = open_isbns(args.isbns)
+    output = sys.stdout if args.output is None else open(args.output, 'w')
+    counts = {}
+    try:
+        resolver = IsbnResolver(scheduler, args.providers, cache, args.batch_size)
+        for record in resolver.iter_records(f):
+            counts[record['outcome']] = counts.get(record['outcome'], 0) + 1
+            output.write(json.dumps(record, sort_keys=True) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        if f is not sys.stdin:
+            f.close()
+        scheduler.close()
+        if cache is not None:
+            cache.close()
+    sys.stderr.write(', '.join('%s %d' % (outcome, count) for (outcome, count) in sorted(counts.items())) + '\n')
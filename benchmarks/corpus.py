@@ -0,0 +1,215 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Synthetic corpus of EPUBs and simple PDFs for the benchmarks. The same seed gives the same
+books, byte for byte.
+
+An EPUB has its ISBN in the dc:identifier of the OPF ('opf'), on a copyright page ('copyright'),
+in its first, middle or last part, or nowhere ('none'). A PDF has it on a front page, a back page
+or in the middle of the book, where only Tika finds it. Noise numbers which are not ISBNs are
+mixed into the texts.
+
+python corpus.py DIRECTORY [--books 50] [--epub-ratio 0.5] [--parts 12] [--pages 120] [--seed 1]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import zlib
+import zipfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bookinfo'))
+from metasearch import BookMeta
+from isbnscan_bench import WORDS, check_digit13, random_noise
+
+EPUB_PLACEMENTS = ['opf', 'copyright', 'first', 'middle', 'last', 'none']
+PDF_PLACEMENTS = ['front', 'back', 'middle']
+LINES_PER_PART = 200
+LINES_PER_PAGE = 40
+
+CONTAINER = '''<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+'''
+
+OPF = '''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="bookid">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>%(title)s</dc:title>
+    <dc:creator>%(author)s</dc:creator>
+    <dc:language>en</dc:language>
+    <dc:publisher>Benchmark Press</dc:publisher>
+    <dc:identifier id="bookid">%(identifier)s</dc:identifier>
+  </metadata>
+  <manifest>
+%(items)s
+  </manifest>
+  <spine>
+%(itemrefs)s
+  </spine>
+</package>
+'''
+
+XHTML = '''<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml"><head><title>%(title)s</title></head>
+<body>
+%(paragraphs)s
+</body></html>
+'''
+
+
+def random_isbn13(rnd):
+    body = '978' + ''.join(rnd.choice('0123456789') for _ in range(9))
+    return body + check_digit13(body)
+
+
+def format_isbn(rnd, isbn):
+    if rnd.randint(0, 1):
+        return 'ISBN ' + isbn
+    return 'ISBN ' + '-'.join([isbn[:3], isbn[3], isbn[4:7], isbn[7:12], isbn[12]])
+
+
+def make_lines(rnd, count, noise):
+    lines = []
+    for _ in range(count):
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(4, 14))]
+        if rnd.random() < noise:
+            words.insert(rnd.randint(0, len(words)), random_noise(rnd, BookMeta.SCANNER))
+        lines.append(' '.join(words))
+    return lines
+
+
+def vary(rnd, size):
+    # between half and one and a half of the given size
+    return max(1, rnd.randint(size // 2, size + size // 2))
+
+
+def make_epub(filename, rnd, isbn, placement, parts, noise):
+    count = vary(rnd, parts)
+    texts = [make_lines(rnd, LINES_PER_PART, noise) for _ in range(count)]
+    names = ['part%d.xhtml' % (i + 1) for i in range(count)]
+    if placement in ('first', 'middle', 'last'):
+        index = {'first': 0, 'middle': count // 2, 'last': count - 1}[placement]
+        texts[index].insert(rnd.randint(0, 10), format_isbn(rnd, isbn))
+    if placement == 'copyright':
+        names.insert(1, 'copyright.xhtml')
+        texts.insert(1, ['Copyright 2015 Benchmark Press', 'All rights reserved', format_isbn(rnd, isbn)])
+    title = ' '.join(rnd.choice(WORDS) for _ in range(3))
+    zf = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+    try:
+        zf.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip')
+        zf.writestr('META-INF/container.xml', CONTAINER)
+        zf.writestr('OEBPS/content.opf', OPF % {
+            'title': title,
+            'author': 'Author ' + str(rnd.randint(1, 999)),
+            'identifier': isbn if placement == 'opf' else 'urn:uuid:%032x' % rnd.getrandbits(128),
+            'items': '\n'.join('    <item id="p%d" href="%s" media-type="application/xhtml+xml"/>' % (i, name)
+                               for (i, name) in enumerate(names)),
+            'itemrefs': '\n'.join('    <itemref idref="p%d"/>' % i for i in range(len(names)))})
+        for (name, lines) in zip(names, texts):
+            paragraphs = '\n'.join('<p>' + line + '</p>' for line in lines)
+            zf.writestr('OEBPS/' + name, XHTML % {'title': title, 'paragraphs': paragraphs})
+    finally:
+        zf.close()
+
+
+def pdf_string(line):
+    return '(' + line.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def make_pdf(filename, rnd, isbn, placement, pages, noise):
+    # a classic xref table, Flate content streams, a Helvetica font and a page tree of kids of 8
+    count = vary(rnd, pages)
+    texts = [make_lines(rnd, LINES_PER_PAGE, noise) for _ in range(count)]
+    index = {'front': min(2, count - 1), 'back': count - 1, 'middle': count // 2}[placement]
+    texts[index][rnd.randint(0, LINES_PER_PAGE - 1)] = format_isbn(rnd, isbn)
+    objects = {1: '<< /Type /Catalog /Pages 2 0 R >>', 3: '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'}
+    number = 3
+    kids = []
+    for first in range(0, count, 8):
+        number += 1
+        node = number
+        kids.append(node)
+        leaves = []
+        for lines in texts[first:first + 8]:
+            (page, contents) = (number + 1, number + 2)
+            number += 2
+            leaves.append(page)
+            data = zlib.compress('BT /F1 10 Tf 72 760 Td\n' + '\n'.join(
+                pdf_string(line) + ' Tj 0 -18 Td' for line in lines) + '\nET')
+            objects[contents] = '<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(data), data)
+            objects[page] = '<< /Type /Page /Parent %d 0 R /Contents %d 0 R /MediaBox [0 0 612 792] >>' % (
+                node, contents)
+        objects[node] = '<< /Type /Pages /Parent 2 0 R /Kids [%s] /Count %d >>' % (
+            ' '.join('%d 0 R' % leaf for leaf in leaves), len(leaves))
+    objects[2] = '<< /Type /Pages /Kids [%s] /Count %d /Resources << /Font << /F1 3 0 R >> >> >>' % (
+        ' '.join('%d 0 R' % kid for kid in kids), count)
+    out = ['%PDF-1.4\n%\xe2\xe3\xcf\xd3\n']
+    size = len(out[0])
+    offsets = {}
+    for num in sorted(objects):
+        offsets[num] = size
+        out.append('%d 0 obj\n%s\nendobj\n' % (num, objects[num]))
+        size += len(out[-1])
+    out.append('xref\n0 %d\n0000000000 65535 f \n' % (number + 1))
+    out.extend('%010d 00000 n \n' % offsets[num] for num in range(1, number + 1))
+    out.append('trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (number + 1, size))
+    with open(filename, 'wb') as f:
+        f.write(''.join(out))
+
+
+def make_corpus(directory, books=50, epub_ratio=0.5, parts=12, pages=120, noise=0.05, seed=1,
+                epub_placements=EPUB_PLACEMENTS, pdf_placements=PDF_PLACEMENTS):
+    """Write the books into directory and return, for each, its name, ISBN and placement. A book
+    placed 'none' has an ISBN nobody can find."""
+    rnd = random.Random(seed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    books_made = []
+    for i in range(books):
+        isbn = random_isbn13(rnd)
+        if rnd.random() < epub_ratio:
+            placement = rnd.choice(epub_placements)
+            name = 'book%04d.epub' % i
+            make_epub(os.path.join(directory, name), rnd, isbn, placement, parts, noise)
+        else:
+            placement = rnd.choice(pdf_placements)
+            name = 'book%04d.pdf' % i
+            make_pdf(os.path.join(directory, name), rnd, isbn, placement, pages, noise)
+        books_made.append({'name': name, 'isbn': isbn, 'placement': placement})
+    return books_made
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic corpus of EPUBs and PDFs')
+    parser.add_argument('directory')
+    parser.add_argument('--books', type=int, default=50)
+    parser.add_argument('--epub-ratio', type=float, default=0.5, help='share of EPUBs among the books')
+    parser.add_argument('--parts', type=int, default=12, help='mean number of html parts of an EPUB')
+    parser.add_argument('--pages', type=int, default=120, help='mean number of pages of a PDF')
+    parser.add_argument('--noise', type=float, default=0.05, help='share of lines with a number that is no ISBN')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    books = make_corpus(args.directory, args.books, args.epub_ratio, args.parts, args.pages, args.noise, args.seed)
+    print(json.dumps(books, indent=2))
+
+
+if __name__ == '__main__':
+    main()
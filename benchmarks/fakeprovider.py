@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process metadata provider for isbnlib.meta, with a configurable latency and rates of
+HTTP errors and of ISBNs it does not know. Nothing goes to the network."""
+
+import random
+import threading
+import time
+
+from isbnlib.dev._exceptions import DataNotFoundAtServiceError, ISBNLibHTTPError
+from isbnlib.registry import add_service, set_cache
+
+
+class FakeProvider:
+    NAME = 'fake'
+
+    def __init__(self, latency=0.05, jitter=0.5, error_rate=0.0, notfound_rate=0.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter  # the latency varies by this fraction either way
+        self.error_rate = error_rate
+        self.notfound_rate = notfound_rate
+        self.lock = threading.Lock()
+        self.rnd = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+
+    def __call__(self, isbn):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency * (1 + self.jitter * (2 * self.rnd.random() - 1))
+            failing = self.rnd.random() < self.error_rate
+            if failing:
+                self.errors += 1
+            # an unknown ISBN stays unknown whatever the order of the requests
+            unknown = random.Random(isbn).random() < self.notfound_rate
+        time.sleep(delay)
+        if failing:
+            raise ISBNLibHTTPError('fake provider')
+        if unknown:
+            raise DataNotFoundAtServiceError(isbn)
+        return {'ISBN-13': isbn, 'Title': u'Book ' + isbn, 'Authors': [u'Author ' + isbn[-4:]],
+                'Publisher': u'Benchmark Press', 'Year': u'20' + isbn[-2:], 'Language': u'en'}
+
+    def register(self, name=NAME):
+        """Make the provider available to isbnlib.meta as name. The cache of isbnlib is turned
+        off, so that every lookup reaches the provider."""
+        set_cache(None)
+        add_service(name, self)
+        return name
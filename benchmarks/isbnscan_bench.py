@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmark of BookMeta.get_isbns (ISBNScanner) against the former per-line loop over
+BookMeta.get_canonical_isbn, on large synthetic texts. It also checks that both find the same
+ISBNs on every line.
+
+python isbnscan_bench.py [--lines 200000] [--repeat 3] [--seed 1]
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bookinfo'))
+from metasearch import BookMeta
+
+WORDS = ['the', 'of', 'and', 'mountain', 'echoed', 'chapter', 'page', 'river', 'copyright', 'edition',
+         'press', 'printed', 'library', 'catalog', 'data', 'reserved', 'rights', 'all', 'London', 'York']
+
+
+def check_digit10(digits):
+    val = sum((i + 2) * int(x) for i, x in enumerate(reversed(digits)))
+    check = (11 - val % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+
+def check_digit13(digits):
+    val = sum((i % 2 * 2 + 1) * int(x) for i, x in enumerate(digits))
+    return str((10 - val % 10) % 10)
+
+
+def random_isbn(rnd):
+    body = ''.join(rnd.choice('0123456789') for _ in range(9))
+    isbn10 = body + check_digit10(body)
+    isbn13 = '978' + body + check_digit13('978' + body)
+    layout = rnd.randint(0, 7)
+    if layout == 0:
+        return 'ISBN ' + isbn13
+    if layout == 1:
+        return 'ISBN 978-' + body[0] + '-' + body[1:4] + '-' + body[4:9] + '-' + isbn13[-1]
+    if layout == 2:
+        return 'ISBN-10: ' + isbn10
+    if layout == 3:
+        return body[0] + '-' + body[1:4] + '-' + body[4:9] + '-' + isbn10[-1]
+    if layout == 4:
+        return 'ISBN ' + body[0] + ' ' + body[1:4] + ' ' + body[4:9] + ' ' + isbn10[-1]
+    if layout == 5:
+        return '978 ' + body[0] + ' ' + body[1:4] + ' ' + body[4:9] + ' ' + isbn13[-1]
+    if layout == 6:
+        return 'isbn ' + isbn10.lower()
+    # a wrong check digit
+    return 'ISBN ' + isbn13[:-1] + str((int(isbn13[-1]) + 1) % 10)
+
+
+def random_noise(rnd, scanner):
+    # numbers which are not ISBNs, otherwise the countdown would end every scan early
+    while True:
+        noise = random_number(rnd)
+        if len(scanner.scan_line(noise)) == 0:
+            return noise
+
+
+def random_number(rnd):
+    kind = rnd.randint(0, 5)
+    if kind == 0:
+        return 'Tel. +44 (0)20 7631 ' + str(rnd.randint(1000, 9999))
+    if kind == 1:
+        return str(rnd.randint(1900, 2015))
+    if kind == 2:
+        return ''.join(rnd.choice('0123456789') for _ in range(rnd.randint(10, 18)))
+    if kind == 3:
+        return ' '.join(str(rnd.randint(0, 99)) for _ in range(8))
+    if kind == 4:
+        return '$' + str(rnd.randint(1, 99)) + '.' + str(rnd.randint(10, 99))
+    return str(rnd.randint(1, 999))
+
+
+def make_texts(rnd, scanner, lines, isbn_lines):
+    out = []
+    for i in range(lines):
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(0, 14))]
+        if rnd.random() < 0.05:
+            words.insert(rnd.randint(0, len(words)), random_noise(rnd, scanner))
+        if i in isbn_lines:
+            words.insert(rnd.randint(0, len(words)), random_isbn(rnd))
+        out.append(' '.join(words))
+    return '\n'.join(out) + '\n'
+
+
+def legacy_get_isbns(bookmeta, texts):
+    # BookMeta.get_isbns before ISBNScanner
+    lines = texts.splitlines()
+    countdown = 100
+    found = False
+    isbns = []
+    for line in lines:
+        for isbn in bookmeta.get_canonical_isbn(line):
+            if isbn not in bookmeta.SPECIAL_ISBN and not any(isbn in s for s in isbns):
+                isbns.append(isbn)
+                found = True
+        if found:
+            countdown -= 1
+        if countdown < 1:
+            break
+    return isbns
+
+
+def best_of(repeat, func, *args):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t = time.time()
+        result = func(*args)
+        elapsed = time.time() - t
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the ISBN scanner of BookMeta.get_isbns')
+    parser.add_argument('--lines', type=int, default=200000, help='lines of each synthetic text')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best is kept')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    rnd = random.Random(args.seed)
+    bookmeta = BookMeta('benchmark.pdf', None)
+    cases = [
+        ('isbn at the end', make_texts(rnd, bookmeta.SCANNER, args.lines, set([args.lines - 5]))),
+        ('isbn on page 3', make_texts(rnd, bookmeta.SCANNER, args.lines, set([120, 130]))),
+        ('no isbn', make_texts(rnd, bookmeta.SCANNER, args.lines, set())),
+        ('isbn-dense', make_texts(rnd, bookmeta.SCANNER, args.lines // 10, set(range(0, args.lines // 10, 7)))),
+    ]
+
+    mismatches = 0
+    checked = 0
+    for (name, texts) in cases:
+        for line in texts.splitlines()[:20000]:
+            checked += 1
+            if bookmeta.get_canonical_isbn(line) != bookmeta.SCANNER.scan_line(line):
+                mismatches += 1
+                print('MISMATCH: ' + repr(line))
+    print('%d lines checked line by line, %d mismatches' % (checked, mismatches))
+
+    print('%-16s %10s %12s %12s %9s %s' % ('case', 'MB', 'legacy (s)', 'scanner (s)', 'speedup', 'same'))
+    for (name, texts) in cases:
+        (legacy_time, legacy) = best_of(args.repeat, legacy_get_isbns, bookmeta, texts)
+        (scanner_time, isbns) = best_of(args.repeat, bookmeta.get_isbns, texts)
+        same = sorted(set(legacy)) == sorted(set(isbns))
+        if not same:
+            mismatches += 1
+        print('%-16s %10.1f %12.3f %12.3f %8.1fx %s' % (name, len(texts) / 1048576.0, legacy_time, scanner_time,
+                                                       legacy_time / max(scanner_time, 1e-9), same))
+    (scan_time, _) = best_of(args.repeat, bookmeta.SCANNER.scan, cases[2][1])
+    print('ISBNScanner.scan over the whole "no isbn" buffer: %.3f s' % scan_time)
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end benchmark of the app/rename.py flow on a synthetic corpus (see corpus.py), with
+the metadata looked up on an in-process fake provider (see fakeprovider.py) instead of the
+network. Tika is not started: PDFs are read natively, so the default corpus places their ISBNs
+on the front or back pages.
+
+Each run renames a fresh copy of the corpus; the run with the best files/s is kept. The result
+has the files/s, the count of each result prefix, the share of the ISBNs found and the time of
+each stage per book, and can be saved as a baseline. Compared with a baseline, a drop of the
+files/s or a rise of the mean time of a stage beyond the tolerance is a regression, as is any
+change of the results; the exit status is then 1.
+
+python rename_bench.py [--books 40] [--jobs 0] [--latency 0.05] [--error-rate 0]
+                       [--save result.json] [--baseline baseline.json] [--tolerance 0.2]
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bookinfo'))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app'))
+import rename
+from corpus import EPUB_PLACEMENTS, PDF_PLACEMENTS, make_corpus
+from fakeprovider import FakeProvider
+from lookup import CircuitBreaker, LookupScheduler
+from metrics import Metrics
+
+MIN_DELTA = 0.002  # seconds, a stage changing less than this per book is noise
+
+
+def run_once(corpus, workdir, provider, args):
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    shutil.copytree(corpus, workdir)
+    metrics = Metrics()
+    scheduler = LookupScheduler(args.rate, args.concurrency)
+    # an outage of the fake provider lasts seconds, not the RESET_TIMEOUT of a real one
+    scheduler.breakers[provider] = CircuitBreaker(provider, reset_timeout=args.reset_timeout)
+    recorder = open(os.devnull, 'w')
+    try:
+        books = list(rename.iter_books(workdir))
+        if args.jobs > 0:
+            rename.rename_books_in_parallel(books, recorder, None, scheduler, provider, args.jobs, None, metrics)
+        else:
+            rename.rename_books(books, recorder, None, None, scheduler, provider, None, metrics)
+    finally:
+        recorder.close()
+        scheduler.close()
+    return metrics.report()
+
+
+def count_found(workdir, books):
+    # the fake provider puts the ISBN into the title, the pattern of rename.py into the file name
+    names = ' '.join(os.listdir(workdir))
+    return len([book for book in books if book['isbn'] in names])
+
+
+def summarize(report, found, expected, args):
+    stages = {}
+    for (stage, summary) in report['stages'].items():
+        stages[stage] = dict((key, summary[key]) for key in ['mean', 'p50', 'p90', 'total', 'calls'])
+    return {
+        'config': dict((key, value) for (key, value) in vars(args).items()
+                       if key not in ('save', 'baseline', 'tolerance', 'keep')),
+        'files': report['files'],
+        'elapsed': report['elapsed'],
+        'files_per_second': report['files_per_second'],
+        'results': report['results'],
+        'isbn_found': found,
+        'isbn_expected': expected,
+        'bytes_extracted': sum(report['bytes_extracted'].values()),
+        'requests': report['counters'].get('requests', 0),
+        'stages': stages,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Print the changes against the baseline and return the number of regressions."""
+    regressions = 0
+    if result['config'] != baseline['config']:
+        print('WARNING: the configuration differs from the baseline')
+    print('%-30s %12s %12s %9s' % ('', 'baseline', 'now', 'change'))
+    (old, new) = (baseline['files_per_second'], result['files_per_second'])
+    change = (new - old) / old if old > 0 else 0.0
+    flag = ''
+    if change < -tolerance:
+        flag = '  REGRESSION'
+        regressions += 1
+    print('%-30s %12.2f %12.2f %+8.0f%%%s' % ('files/s', old, new, change * 100, flag))
+    for stage in Metrics.STAGES:
+        if stage not in result['stages'] and stage not in baseline['stages']:
+            continue
+        old = baseline['stages'].get(stage, {}).get('mean', 0.0)
+        new = result['stages'].get(stage, {}).get('mean', 0.0)
+        change = (new - old) / old if old > 0 else 0.0
+        flag = ''
+        if new - old > MIN_DELTA and (old == 0 or change > tolerance):
+            flag = '  REGRESSION'
+            regressions += 1
+        print('%-30s %11.4fs %11.4fs %+8.0f%%%s' % (stage + ' (mean)', old, new, change * 100, flag))
+    for key in ['results', 'isbn_found']:
+        if result[key] != baseline[key]:
+            print('REGRESSION: %s %s, baseline %s' % (key, json.dumps(result[key]), json.dumps(baseline[key])))
+            regressions += 1
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the renaming of a synthetic corpus')
+    parser.add_argument('--books', type=int, default=40)
+    parser.add_argument('--epub-ratio', type=float, default=0.5, help='share of EPUBs among the books')
+    parser.add_argument('--parts', type=int, default=12, help='mean number of html parts of an EPUB')
+    parser.add_argument('--pages', type=int, default=120, help='mean number of pages of a PDF')
+    parser.add_argument('--noise', type=float, default=0.05, help='share of lines with a number that is no ISBN')
+    parser.add_argument('--epub-placements', default=','.join(EPUB_PLACEMENTS),
+                        help='where the ISBN of an EPUB may be (default: %(default)s)')
+    parser.add_argument('--pdf-placements', default='front,back',
+                        help='where the ISBN of a PDF may be, among ' + ','.join(PDF_PLACEMENTS) +
+                             ' (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request of the fake provider')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests failing with HTTP errors')
+    parser.add_argument('--notfound-rate', type=float, default=0.0, help='share of ISBNs the provider does not know')
+    parser.add_argument('--rate', type=float, default=50.0, help='requests per second to the provider')
+    parser.add_argument('--concurrency', type=int, default=4, help='requests in flight to the provider')
+    parser.add_argument('--reset-timeout', type=float, default=1.0,
+                        help='seconds the circuit breaker stays open after HTTP errors')
+    parser.add_argument('--jobs', type=int, default=0, help='processes of rename.py --jobs, 0 renames serially')
+    parser.add_argument('--repeat', type=int, default=3, help='runs, the best is kept')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', metavar='FILE', help='write the result as JSON, e.g. to make a baseline')
+    parser.add_argument('--baseline', metavar='FILE', help='compare with the result saved in FILE')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change taken as a regression')
+    parser.add_argument('--keep', action='store_true', help='keep the corpus and the renamed copy')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    provider = FakeProvider(args.latency, error_rate=args.error_rate, notfound_rate=args.notfound_rate,
+                            seed=args.seed).register()
+    tmp = tempfile.mkdtemp(prefix='rename_bench_')
+    try:
+        corpus = os.path.join(tmp, 'corpus')
+        books = make_corpus(corpus, args.books, args.epub_ratio, args.parts, args.pages, args.noise, args.seed,
+                            args.epub_placements.split(','), args.pdf_placements.split(','))
+        # the ISBNs rename.py can find without Tika
+        expected = len([book for book in books if book['placement'] != 'none' and not (
+            book['name'].endswith('.pdf') and book['placement'] == 'middle')])
+        best = None
+        for i in range(args.repeat):
+            workdir = os.path.join(tmp, 'run')
+            report = run_once(corpus, workdir, provider, args)
+            result = summarize(report, count_found(workdir, books), expected, args)
+            print('run %d: %d files in %.2f s, %.2f files/s' % (i + 1, result['files'], result['elapsed'],
+                                                                result['files_per_second']))
+            if best is None or result['files_per_second'] > best['files_per_second']:
+                best = result
+    finally:
+        if args.keep:
+            print('corpus kept in ' + tmp)
+        else:
+            shutil.rmtree(tmp)
+
+    print('results: ' + json.dumps(best['results'], sort_keys=True))
+    print('ISBNs found: %d of %d, %d requests, %.1f MB of texts' % (
+        best['isbn_found'], best['isbn_expected'], best['requests'], best['bytes_extracted'] / 1048576.0))
+    for stage in Metrics.STAGES:
+        if stage in best['stages']:
+            summary = best['stages'][stage]
+            print('%-24s mean %8.4f s  p50 %8.4f s  p90 %8.4f s  total %8.2f s' % (
+                stage, summary['mean'], summary['p50'], summary['p90'], summary['total']))
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(best, f, indent=2, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(best, baseline, args.tolerance) > 0:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import select
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LimitExceeded(Exception):
+    def __init__(self, limit, message):
+        Exception.__init__(self, message)
+        self.limit = limit  # one of FileLimits.LIMITS
+
+
+class FileLimits:
+    """The limits of the work spent on one book, 0 meaning no limit: the seconds of extraction
+    and scanning, the bytes of texts extracted, the bytes decompressed from an EPUB, the
+    growth of the resident memory of the process while the book is read and the lines of texts
+    scanned."""
+    SECONDS = 600
+    TEXT_BYTES = 64 * 1024 * 1024
+    ZIP_BYTES = 256 * 1024 * 1024
+    RSS = 0
+    TEXT_LINES = 0
+    LIMITS = ['seconds', 'text_bytes', 'zip_bytes', 'rss', 'text_lines']
+
+    def __init__(self, seconds=SECONDS, text_bytes=TEXT_BYTES, zip_bytes=ZIP_BYTES, rss=RSS, text_lines=TEXT_LINES):
+        self.seconds = seconds
+        self.text_bytes = text_bytes
+        self.zip_bytes = zip_bytes
+        self.rss = rss
+        self.text_lines = text_lines
+
+    def start(self, filename):
+        return FileBudget(self, filename)
+
+
+def get_rss():
+    """Return the resident memory of the process in bytes, or None where it is not known."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class FileBudget:
+    """What is left of the FileLimits of one book. The readers of the book report the bytes
+    they get and call check() between blocks, which raise LimitExceeded once a limit is passed;
+    their generators then kill the processes they read from when they are closed. The memory
+    is counted from the start of the budget: a worker which kept the memory of a previous book
+    does not fail the next ones."""
+
+    def __init__(self, limits, filename):
+        self.limits = limits
+        self.filename = filename
+        self.deadline = time.time() + limits.seconds if limits.seconds else None
+        self.text_bytes = 0
+        self.zip_bytes = 0
+        self.text_lines = 0
+        self.rss = get_rss() if limits.rss else None
+
+    def get_remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.time(), 0)
+
+    def check(self):
+        if self.deadline is not None and time.time() >= self.deadline:
+            raise LimitExceeded('seconds', 'more than ' + str(self.limits.seconds) + ' s')
+        if self.limits.rss:
+            rss = get_rss()
+            if rss is not None and self.rss is not None and rss - self.rss > self.limits.rss:
+                raise LimitExceeded('rss', str(rss - self.rss) + ' more bytes resident')
+
+    def add_text_bytes(self, size):
+        self.text_bytes += size
+        if self.limits.text_bytes and self.text_bytes > self.limits.text_bytes:
+            raise LimitExceeded('text_bytes', 'more than ' + str(self.limits.text_bytes) + ' bytes of texts')
+        self.check()
+
+    def add_text_lines(self, count):
+        self.text_lines += count
+        if self.limits.text_lines and self.text_lines > self.limits.text_lines:
+            raise LimitExceeded('text_lines', 'more than ' + str(self.limits.text_lines) + ' lines of texts')
+
+    def add_zip_bytes(self, size):
+        self.zip_bytes += size
+        if self.limits.zip_bytes and self.zip_bytes > self.limits.zip_bytes:
+            raise LimitExceeded('zip_bytes', 'more than ' + str(self.limits.zip_bytes) + ' bytes decompressed')
+        self.check()
+
+    def read(self, fd, size):
+        """os.read(fd, size), waiting no longer than the time left."""
+        remaining = self.get_remaining()
+        if remaining is not None:
+            (readable, writable, errors) = select.select([fd], [], [], remaining)
+            if len(readable) == 0:
+                raise LimitExceeded('seconds', 'more than ' + str(self.limits.seconds) + ' s')
+        return os.read(fd, size)
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicateFinder:
+    """Finds the byte-identical books among a list of files.
+
+    Files are grouped by size first; only the files sharing a size are read, first the
+    PARTIAL_SIZE bytes at their start and at their end, then in full for those still alike.
+    """
+    PARTIAL_SIZE = 64 * 1024
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self):
+        self.groups = []
+
+    def get_partial_digest(self, filename, size):
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            sha1.update(f.read(self.PARTIAL_SIZE))
+            if size > self.PARTIAL_SIZE:
+                f.seek(max(size - self.PARTIAL_SIZE, self.PARTIAL_SIZE))
+                sha1.update(f.read(self.PARTIAL_SIZE))
+        return sha1.hexdigest()
+
+    def get_digest(self, filename):
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            while True:
+                data = f.read(self.CHUNK_SIZE)
+                if not data:
+                    break
+                sha1.update(data)
+        return sha1.hexdigest()
+
+    def group_by(self, filenames, key):
+        groups = {}
+        for filename in filenames:
+            try:
+                value = key(filename)
+            except (IOError, OSError) as ex:
+                logger.error('Can not read "' + filename + '": ' + str(ex))
+                continue
+            groups.setdefault(value, []).append(filename)
+        return [(value, group) for (value, group) in groups.items() if len(group) > 1]
+
+    def find(self, filenames):
+        """Return the groups of identical files as (digest, size, files), the files of a group
+        and the groups in the order of filenames."""
+        order = dict((filename, i) for (i, filename) in enumerate(filenames))
+        self.groups = []
+        for (size, same_size) in self.group_by(filenames, os.path.getsize):
+            for (partial, same_partial) in self.group_by(same_size,
+                                                         lambda filename: self.get_partial_digest(filename, size)):
+                if size <= 2 * self.PARTIAL_SIZE:
+                    # the partial digest read the whole file in order, it is its digest
+                    same_files = [(partial, same_partial)]
+                else:
+                    same_files = self.group_by(same_partial, self.get_digest)
+                for (digest, files) in same_files:
+                    files.sort(key=order.get)
+                    self.groups.append((digest, size, files))
+        self.groups.sort(key=lambda group: order[group[2][0]])
+        return self.groups
+
+    def split(self, filenames):
+        """Return the files to process, the first of each group of identical files, and the
+        copies of each of them."""
+        self.find(filenames)
+        copies = dict((files[0], files[1:]) for (digest, size, files) in self.groups)
+        skipped = set(filename for files in copies.values() for filename in files)
+        if len(skipped) > 0:
+            logger.info(str(len(skipped)) + ' copies of ' + str(len(copies)) + ' books found')
+        return [filename for filename in filenames if filename not in skipped], copies
+
+    def write_report(self, filename):
+        groups = [{'hash': digest, 'size': size, 'files': files} for (digest, size, files) in self.groups]
+        report = {'groups': groups,
+                  'copies': sum(len(files) - 1 for (digest, size, files) in self.groups),
+                  'wasted_bytes': sum(size * (len(files) - 1) for (digest, size, files) in self.groups)}
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
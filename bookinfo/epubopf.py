@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import posixpath
+import re
+import urllib
+from xml.etree import ElementTree
+
+import isbnlib
+
+from budget import LimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+def local_name(tag):
+    # '{http://purl.org/dc/elements/1.1/}title' -> 'title'
+    return tag.rsplit('}', 1)[-1]
+
+
+class EpubPackage:
+    """Reads META-INF/container.xml and the OPF package document of an opened EPUB zip file.
+    With a FileBudget, the declared sizes of the documents count against its zip bytes before
+    they are read."""
+    CONTAINER = 'META-INF/container.xml'
+    OPF_MEDIA_TYPE = 'application/oebps-package+xml'
+    DC_FIELDS = ['title', 'creator', 'language', 'publisher', 'identifier', 'date']
+    ISBN_LIKE = re.compile(r'^[-\x200-9Xx]{10,17}$')
+
+    def __init__(self, zf, budget=None):
+        self.zf = zf
+        self.budget = budget
+        self.opf_path = None
+        self.metadata = {}
+        self.identifiers = []
+        self.manifest = {}
+        self.spine = []
+        self.guide = []
+
+    def read(self, name):
+        # zipfile decompresses no more than the declared size of a member
+        info = self.zf.getinfo(name)
+        if self.budget is not None:
+            self.budget.add_zip_bytes(info.file_size)
+        return self.zf.read(info)
+
+    def find_opf_path(self):
+        try:
+            root = ElementTree.fromstring(self.read(self.CONTAINER))
+        except LimitExceeded:
+            raise
+        except:
+            logger.debug('No valid ' + self.CONTAINER)
+        else:
+            for element in root.iter():
+                if local_name(element.tag) == 'rootfile':
+                    media_type = element.get('media-type')
+                    if element.get('full-path') and (media_type is None or media_type == self.OPF_MEDIA_TYPE):
+                        return element.get('full-path')
+        # some EPUBs have no container.xml but still have one package document
+        for info in self.zf.filelist:
+            if info.filename.lower().endswith('.opf'):
+                return info.filename
+        return None
+
+    def parse(self):
+        """Return True if a package document was found and parsed."""
+        self.opf_path = self.find_opf_path()
+        if self.opf_path is None:
+            return False
+        try:
+            root = ElementTree.fromstring(self.read(self.opf_path))
+        except LimitExceeded:
+            raise
+        except:
+            logger.debug('Can not parse ' + self.opf_path)
+            return False
+        base = posixpath.dirname(self.opf_path)
+        for element in root:
+            name = local_name(element.tag)
+            if name == 'metadata':
+                self.parse_metadata(element)
+            elif name == 'manifest':
+                for item in element:
+                    if local_name(item.tag) == 'item' and item.get('id') and item.get('href'):
+                        self.manifest[item.get('id')] = (self.get_path(base, item.get('href')),
+                                                         item.get('media-type', ''))
+            elif name == 'spine':
+                for itemref in element:
+                    if local_name(itemref.tag) == 'itemref' and itemref.get('idref') in self.manifest:
+                        self.spine.append(self.manifest[itemref.get('idref')][0])
+            elif name == 'guide':
+                for reference in element:
+                    if local_name(reference.tag) == 'reference' and reference.get('href'):
+                        self.guide.append((reference.get('type', ''), self.get_path(base, reference.get('href'))))
+        return True
+
+    def get_path(self, base, href):
+        # href is relative to the package document, URL-encoded and may carry a fragment
+        href = urllib.unquote(href.split('#', 1)[0])
+        return posixpath.normpath(posixpath.join(base, href))
+
+    def parse_metadata(self, metadata):
+        for element in metadata.iter():
+            name = local_name(element.tag)
+            if name not in self.DC_FIELDS or element.text is None:
+                continue
+            value = element.text.strip()
+            if len(value) == 0:
+                continue
+            if name == 'identifier':
+                scheme = ''
+                for (key, attr) in element.attrib.items():
+                    if local_name(key) == 'scheme':
+                        scheme = attr
+                self.identifiers.append((scheme, value))
+            self.metadata.setdefault(name, []).append(value)
+
+    def get_meta(self):
+        """Return the metadata with the same keys as the output of "tika-app -m"."""
+        meta = {}
+        for name in self.metadata:
+            meta['dc:' + name] = self.metadata[name][0]
+        if 'creator' in self.metadata:
+            meta['meta:author'] = self.metadata['creator'][0]
+        return meta
+
+    def get_isbns(self):
+        """Return the valid ISBNs of the dc:identifier elements."""
+        isbns = []
+        for (scheme, value) in self.identifiers:
+            if value.lower().startswith('urn:isbn:'):
+                value = value[len('urn:isbn:'):]
+            elif value.lower().startswith('isbn'):
+                value = value[len('isbn'):].lstrip(':\x20')
+            elif scheme.upper() != 'ISBN' and not self.ISBN_LIKE.match(value):
+                continue
+            isbn = isbnlib.canonical(value)
+            if (len(isbn) == 10 and isbnlib.is_isbn10(isbn)) or (len(isbn) == 13 and isbnlib.is_isbn13(isbn)):
+                if isbn not in isbns:
+                    isbns.append(isbn)
+        return isbns
@@ -0,0 +1,131 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import re
+
+
+class ISBNScanner:
+    """Finds the same ISBNs as BookMeta.get_canonical_isbn without running its four patterns on
+    every line and without calling isbnlib.
+
+    Every string those patterns can turn into a valid ISBN contains ten digits (or X) separated
+    only by spaces or hyphens, so one CANDIDATE search over a whole buffer tells which lines are
+    worth looking at. Only those lines go through the original patterns, and the checksum of
+    isbnlib.get_canonical_isbn is computed inline.
+    """
+    CANDIDATE = re.compile(r'[0-9Xx](?:[-\x20]*[0-9Xx]){9}')
+    # RE_NORMAL of isbnlib, used by isbnlib.get_canonical_isbn
+    NORMAL = re.compile(r'97[89]{1}(?:-?\d){10}|\d{9}[0-9X]{1}|[-0-9X]{10,16}', re.I | re.M | re.S)
+    DIGITS = '0123456789Xx'
+
+    def __init__(self, patterns, special_isbns):
+        self.patterns = patterns
+        self.special_isbns = special_isbns
+
+    def has_candidate(self, texts):
+        return self.CANDIDATE.search(texts) is not None
+
+    def get_check_digit10(self, firstninedigits):
+        if not firstninedigits.isdigit():
+            return None
+        val = sum((i + 2) * int(x) for i, x in enumerate(reversed(firstninedigits)))
+        remainder = val % 11
+        if remainder == 0:
+            return '0'
+        if remainder == 1:
+            return 'X'
+        return str(11 - remainder)
+
+    def get_check_digit13(self, firsttwelvedigits):
+        if len(firsttwelvedigits) != 12 or not firsttwelvedigits.isdigit():
+            return None
+        val = sum((i % 2 * 2 + 1) * int(x) for i, x in enumerate(firsttwelvedigits))
+        return str((10 - val % 10) % 10)
+
+    def get_canonical_isbn(self, isbnlike):
+        """Same result as isbnlib.get_canonical_isbn(isbnlike)."""
+        match = self.NORMAL.search(isbnlike)
+        if not match:
+            return None
+        chars = [c for c in match.group() if c in self.DIGITS]
+        if len(chars) == 0:
+            return None
+        if chars[-1] == 'x':
+            chars[-1] = 'X'
+        last = chars.pop()
+        buf = ''.join(chars)
+        if len(chars) == 9:
+            check = self.get_check_digit10(buf)
+        else:
+            check = self.get_check_digit13(buf)
+        if check == last:
+            return buf + last
+        return None
+
+    def scan_line(self, line):
+        """Same result as BookMeta.get_canonical_isbn(line)."""
+        isbns = []
+        if not self.CANDIDATE.search(line):
+            return isbns
+        for regex in self.patterns:
+            for match in regex.findall(line):
+                match = match.strip()
+                match = match.replace('i', 'I')
+                match = match.replace('s', 'S')
+                match = match.replace('b', 'B')
+                match = match.replace('n', 'N')
+                match = match.replace('\x20', '')
+                match = match.replace('ISBN', 'ISBN\x20')
+                if match not in self.special_isbns:
+                    isbn = self.get_canonical_isbn(match)
+                    if isbn:
+                        isbns.append(isbn)
+        return isbns
+
+    def is_new(self, isbn, isbns, seen):
+        """Whether isbn is neither one of the ISBNs accepted so far nor a part of one of them,
+        like an ISBN-10 cut out of the digits of an ISBN-13 by the looser patterns."""
+        return isbn not in seen and not any(isbn in accepted for accepted in isbns)
+
+    def iter_lines(self, texts):
+        """Yield (line number, line) for every line of texts a CANDIDATE match falls in. Lines are
+        numbered by '\n' from 0."""
+        lineno = 0
+        pos = 0
+        end = -1
+        for match in self.CANDIDATE.finditer(texts):
+            if match.start() < end:
+                continue
+            start = texts.rfind('\n', 0, match.start()) + 1
+            lineno += texts.count('\n', pos, start)
+            pos = start
+            end = texts.find('\n', match.end())
+            if end < 0:
+                end = len(texts)
+            for line in texts[start:end].splitlines():
+                yield lineno, line
+
+    def scan(self, texts):
+        """Return the distinct ISBNs of a whole buffer in order of appearance."""
+        isbns = []
+        seen = set()
+        for (lineno, line) in self.iter_lines(texts):
+            for isbn in self.scan_line(line):
+                if isbn not in self.special_isbns and self.is_new(isbn, isbns, seen):
+                    seen.add(isbn)
+                    isbns.append(isbn)
+        return isbns
@@ -0,0 +1,191 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+
+from manifest import Manifest
+
+logger = logging.getLogger(__name__)
+
+
+def in_shard(relpath, shard):
+    """Whether the book at relpath, relative to the walked PATH, belongs to shard (index, count).
+    The same path always falls into the same shard, whichever node walks it."""
+    (index, count) = shard
+    if isinstance(relpath, unicode):
+        relpath = relpath.encode('utf-8')
+    return (zlib.crc32(relpath) & 0xffffffff) % count == index
+
+
+class ResultJournal:
+    """Append-only JSON lines of the renames planned by one node, one line per book: the file,
+    its hash, ISBNs and detected state, the metadata, the result prefix and the new name. Each
+    line is flushed when written, so that the journal of a killed node is good up to its last
+    book."""
+
+    def __init__(self, path, shard=None):
+        self.path = path
+        self.shard = '%d/%d' % shard if shard is not None else None
+        self.lock = threading.Lock()
+        self.f = open(path, 'a')
+
+    def write(self, entry):
+        entry = dict(entry, time=time.time(), shard=self.shard)
+        line = json.dumps(entry, sort_keys=True)
+        with self.lock:
+            self.f.write(line + '\n')
+            self.f.flush()
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+def read_journals(paths):
+    """Return the entries of the journals, the last one of each file, in the order the files
+    were first written."""
+    entries = collections.OrderedDict()
+    for path in paths:
+        with open(path) as f:
+            for (number, line) in enumerate(f, 1):
+                if len(line.strip()) == 0:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # the last line of a node killed while writing
+                    logger.error('Bad journal line ' + path + ':' + str(number))
+                    continue
+                entries[entry['file']] = entry
+    return list(entries.values())
+
+
+class JournalMerge:
+    """Plans the renames of the journals of all shards before any of them is done.
+
+    Two books planned to the same name, or a book planned to the name of a file that already
+    exists and stays, are a collision. The first book of a name, in the order of the source
+    paths, keeps it; the others get a TSIXE-NUM name of their own, as rename_to gives them on a
+    single node. A book planned to the name of another book which is renamed too waits for that
+    rename; in a cycle of such renames, one book gets a TSIXE-NUM name.
+    """
+    RESULT_EXISTED = 'TSIXE-NUM'
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.plan = []
+        self.collisions = []
+        self.missing = []
+
+    def get_exist_filename(self, filename, taken):
+        dirname = os.path.dirname(filename)
+        number = 1
+        while True:
+            exfilename = os.path.join(dirname, self.RESULT_EXISTED + str(number) + '_' + os.path.basename(filename))
+            if exfilename not in taken and not os.path.lexists(exfilename):
+                return exfilename
+            number += 1
+
+    def set_collision(self, step, taken):
+        # step is [entry, new filename, result]
+        exfilename = self.get_exist_filename(step[0]['file'], taken)
+        taken.add(exfilename)
+        logger.error('!!!!!! [Existed File]: ' + step[1] + ' for "' + step[0]['file'] + '" !!!!!!')
+        self.collisions.append((step[0], step[1]))
+        step[1] = exfilename
+        step[2] = self.RESULT_EXISTED
+
+    def get_steps(self):
+        # the renames in the order of the journals, without the ordering of the chains
+        targets = {}
+        for entry in self.entries:
+            if not os.path.exists(entry['file']):
+                logger.error('!!!!!! [Missing File]: ' + entry['file'] + ' !!!!!!')
+                self.missing.append(entry)
+            elif entry['new_name'] != entry['file']:
+                targets.setdefault(entry['new_name'], []).append(entry)
+        moving = set(entry['file'] for group in targets.values() for entry in group)
+        taken = set(targets)
+        steps = []
+        for new_filename in sorted(targets):
+            group = sorted(targets[new_filename], key=lambda entry: entry['file'])
+            if not os.path.lexists(new_filename) or new_filename in moving:
+                steps.append([group.pop(0), new_filename, None])
+            for entry in group:
+                step = [entry, new_filename, None]
+                self.set_collision(step, taken)
+                steps.append(step)
+        order = dict((entry['file'], i) for (i, entry) in enumerate(self.entries))
+        steps.sort(key=lambda step: order[step[0]['file']])
+        return steps, taken
+
+    def make_plan(self):
+        """Return the (entry, new filename, result) of the books to rename, in an order where
+        every name is free when a book is renamed to it. result is None for the result of the
+        journal."""
+        self.collisions = []
+        self.missing = []
+        (steps, taken) = self.get_steps()
+        by_source = dict((step[0]['file'], step) for step in steps)
+        done = set()
+        plan = []
+        for step in steps:
+            # follow the books holding the name wanted by the previous one
+            chain = []
+            current = step
+            while current is not None and id(current) not in done and current not in chain:
+                chain.append(current)
+                current = by_source.get(current[1])
+            if current is not None and current in chain:
+                # a cycle: the last book gives up the name of the first one of the cycle
+                self.set_collision(chain[-1], taken)
+            for current in reversed(chain):
+                done.add(id(current))
+                plan.append(tuple(current))
+        self.plan = plan
+        return self.plan
+
+    def apply(self, recorder, manifest=None):
+        """Rename the books as planned; return the number of books renamed."""
+        renamed = 0
+        for (entry, new_filename, result) in self.plan:
+            result = result or entry['result']
+            log = 'Rename "' + entry['file'] + '" to "' + new_filename + '"'
+            try:
+                if os.path.lexists(new_filename):
+                    # written since the plan was made, or a rename of the chain failed
+                    raise OSError('File exists')
+                os.rename(entry['file'], new_filename)
+            except OSError:
+                logger.error('!!!!!! [Renaming Fail]: ' + log + ' !!!!!!')
+                continue
+            renamed += 1
+            logger.debug(log)
+            # the rename log has the books renamed after their metadata, as rename_to writes it
+            if result == Manifest.RESULT_RENAMED:
+                recorder.write(log + '\r\n')
+            if manifest is not None:
+                digest = entry['hash'] if entry['hash'] is not None else manifest.get_digest(new_filename)
+                manifest.put(new_filename, digest, entry['state'], entry['meta'], result, entry['pattern'],
+                             entry['file'])
+        return renamed
@@ -0,0 +1,413 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import Queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Lets through at most rate requests per second on average and burst requests at once."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent and return the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(float(self.burst), self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class CircuitBreaker:
+    """Stops the requests to a provider after FAILURE_THRESHOLD errors in a row.
+
+    The breaker is closed while the provider answers. Once open, no request is allowed until
+    reset_timeout seconds have passed; then it is half-open and lets one trial request through.
+    A successful trial closes it, a failed one opens it again for twice as long, up to
+    MAX_RESET_TIMEOUT.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    FAILURE_THRESHOLD = 2
+    RESET_TIMEOUT = 300  # as MetaLookup.LONG_SLEEP
+    MAX_RESET_TIMEOUT = 3600
+
+    def __init__(self, provider, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.provider = provider
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def get_state_locked(self):
+        if self.opened is None:
+            return self.CLOSED
+        if time.time() - self.opened >= self.timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def get_state(self):
+        with self.lock:
+            return self.get_state_locked()
+
+    def retry_in(self):
+        """Seconds until the breaker half-opens, 0 if it is not open."""
+        with self.lock:
+            if self.get_state_locked() != self.OPEN:
+                return 0
+            return self.opened + self.timeout - time.time()
+
+    def allow(self):
+        """Whether a request may be sent now. Every allowed request must be followed by
+        record_success or record_failure."""
+        with self.lock:
+            state = self.get_state_locked()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            if self.opened is not None:
+                logger.debug('Circuit of ' + self.provider + ' closed')
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+            self.timeout = self.reset_timeout
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial:
+                self.trial = False
+                self.timeout = min(self.timeout * 2, self.MAX_RESET_TIMEOUT)
+                self.opened = time.time()
+            elif self.opened is None and self.failures >= self.threshold:
+                self.opened = time.time()
+            else:
+                return
+        logger.debug('Circuit of ' + self.provider + ' open for ' + str(self.timeout) + ' s')
+
+
+class PendingLookup:
+    """A lookup submitted to the LookupScheduler. wait() returns what the function returned or
+    raises what it raised. When done_queue is given, the lookup is put into it once done; a
+    cancelled lookup is not run. started is the time its request was let through the rate limit,
+    None before."""
+
+    def __init__(self, provider, func, args, done_queue=None, key=None):
+        self.provider = provider
+        self.func = func
+        self.args = args
+        self.done_queue = done_queue
+        self.key = key
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.started = None
+        self.event = threading.Event()
+
+    def run(self):
+        if not self.cancelled:
+            try:
+                self.result = self.func(*self.args)
+            except Exception as ex:
+                logger.exception('Lookup on ' + self.provider + ' failed')
+                self.error = ex
+        self.set_done()
+
+    def set_done(self):
+        self.event.set()
+        if self.done_queue is not None:
+            self.done_queue.put(self)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        self.event.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class LookupScheduler:
+    """Runs the metadata lookups of all books on worker threads, concurrency threads per provider,
+    and never sends more than rate requests per second to one provider.
+
+    limits maps a provider to its own (rate, concurrency); the other providers get the defaults.
+    """
+    DEFAULT_RATE = 0.2  # one request every 5 seconds, as BookMeta.SHORT_SLEEP
+    DEFAULT_CONCURRENCY = 2
+
+    def __init__(self, rate=DEFAULT_RATE, concurrency=DEFAULT_CONCURRENCY, limits=None):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.limits = limits or {}
+        self.queues = {}
+        self.buckets = {}
+        self.threads = {}
+        self.breakers = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()  # the PendingLookup run by a worker thread
+
+    def get_queue(self, provider):
+        with self.lock:
+            if provider not in self.queues:
+                (rate, concurrency) = self.limits.get(provider, (self.rate, self.concurrency))
+                logger.debug('Lookups on ' + provider + ': ' + str(rate) + ' requests per second, ' + str(
+                    concurrency) + ' at a time')
+                self.queues[provider] = Queue.Queue()
+                self.buckets[provider] = TokenBucket(rate)
+                self.threads[provider] = []
+                for i in range(concurrency):
+                    thread = threading.Thread(target=self.work, args=(self.queues[provider],))
+                    thread.daemon = True
+                    thread.start()
+                    self.threads[provider].append(thread)
+            return self.queues[provider]
+
+    def get_breaker(self, provider):
+        with self.lock:
+            if provider not in self.breakers:
+                self.breakers[provider] = CircuitBreaker(provider)
+            return self.breakers[provider]
+
+    def throttle(self, provider):
+        """Wait for the rate limit of provider; called by the lookup right before each request."""
+        self.get_queue(provider)
+        waited = self.buckets[provider].acquire()
+        if waited > 0:
+            logger.debug('Waited %.1f s for %s' % (waited, provider))
+        pending = getattr(self.local, 'pending', None)
+        if pending is not None:
+            pending.started = time.time()
+        return waited
+
+    def submit(self, provider, func, *args, **kwargs):
+        """Run func(*args) on a thread of provider. done_queue and key are passed to the
+        PendingLookup."""
+        pending = PendingLookup(provider, func, args, kwargs.get('done_queue'), kwargs.get('key'))
+        self.get_queue(provider).put(pending)
+        return pending
+
+    def work(self, queue):
+        while True:
+            pending = queue.get()
+            if pending is None:
+                break
+            self.local.pending = pending
+            try:
+                pending.run()
+            finally:
+                self.local.pending = None
+
+    def close(self):
+        with self.lock:
+            for provider in self.queues:
+                for thread in self.threads[provider]:
+                    self.queues[provider].put(None)
+        for provider in self.threads:
+            for thread in self.threads[provider]:
+                thread.join()
+
+
+class HedgedLookup:
+    """Looks up several keys on an ordered list of providers, on a LookupScheduler.
+
+    Each key is sent to the first provider. It is sent to the next provider when the answer is
+    not accepted (an empty one by default), or as a hedge when no answer has come delay seconds
+    after the request went out; the time spent waiting for the rate limit of the scheduler does
+    not count, as it says nothing of the provider. iter_answers() yields the PendingLookup of
+    every answer as it completes, up to the first accepted answer of each key; the answers
+    coming after it are dropped. Closing the generator cancels the lookups which have not
+    started yet.
+
+    func(key, provider) runs on the scheduler. cached(key, provider) runs at once and returns an
+    answer or None.
+    """
+    START_POLL = 1  # seconds between two looks at a lookup still waiting for the rate limit
+
+    def __init__(self, scheduler, providers, func, delay, accept=bool, cached=None):
+        self.scheduler = scheduler
+        self.providers = providers
+        self.func = func
+        self.delay = delay
+        self.accept = accept
+        self.cached = cached
+        self.done_queue = Queue.Queue()
+        self.keys = []
+        self.tries = {}
+        self.sent = {}  # the last PendingLookup of each key
+        self.pendings = {}
+
+    def send(self, key):
+        """Send key to its next provider and return False when no provider is left."""
+        while self.tries[key] < len(self.providers):
+            provider = self.providers[self.tries[key]]
+            self.tries[key] += 1
+            answer = self.cached(key, provider) if self.cached is not None else None
+            if answer is not None:
+                pending = PendingLookup(provider, None, (), self.done_queue, key)
+                pending.result = answer
+            else:
+                pending = self.scheduler.submit(provider, self.func, key, provider, done_queue=self.done_queue,
+                                                key=key)
+            self.pendings[key].append(pending)
+            self.sent[key] = pending
+            if answer is not None:
+                pending.set_done()
+            return True
+        return False
+
+    def remaining(self):
+        """Number of keys which may still get an accepted answer."""
+        return len(self.pendings)
+
+    def hedge(self):
+        """Send the overdue keys to their next provider and return the seconds until the next
+        key is overdue, None if no key can be hedged."""
+        now = time.time()
+        timeout = None
+        for key in self.keys:
+            if key not in self.pendings or self.tries[key] >= len(self.providers):
+                continue
+            started = self.sent[key].started
+            if started is None:
+                # not sent to the provider yet
+                wait = self.START_POLL
+            else:
+                wait = started + self.delay - now
+            if wait <= 0:
+                logger.debug('No answer for ' + key + ' after ' + str(self.delay) + ' s, asking ' +
+                             self.providers[self.tries[key]])
+                self.send(key)
+                wait = self.START_POLL
+            if timeout is None or wait < timeout:
+                timeout = wait
+        return timeout
+
+    def iter_answers(self, keys):
+        for key in keys:
+            if key not in self.pendings:
+                self.keys.append(key)
+                self.tries[key] = 0
+                self.pendings[key] = []
+                self.send(key)
+        try:
+            while len(self.pendings) > 0:
+                timeout = self.hedge()
+                try:
+                    if timeout is None:
+                        pending = self.done_queue.get()
+                    else:
+                        pending = self.done_queue.get(True, max(timeout, 0.01))
+                except Queue.Empty:
+                    continue
+                if pending.key not in self.pendings:
+                    continue
+                self.pendings[pending.key].remove(pending)
+                try:
+                    accepted = self.accept(pending.wait())
+                except Exception:
+                    accepted = False
+                if accepted:
+                    for other in self.pendings.pop(pending.key):
+                        other.cancel()
+                elif len(self.pendings[pending.key]) == 0 and not self.send(pending.key):
+                    del self.pendings[pending.key]
+                yield pending
+        finally:
+            for key in self.pendings:
+                for pending in self.pendings[key]:
+                    pending.cancel()
+
+
+class RetryQueue:
+    """Books whose lookups were deferred by an open circuit breaker.
+
+    drain() retries the books of the providers whose breaker is no longer open and keeps the
+    others. finish() waits for the breakers at the end of the run; only there is a book renamed
+    for good (BookMeta.rename(final=True)), once it has been retried MAX_ATTEMPTS times.
+    """
+    MAX_ATTEMPTS = 4
+
+    def __init__(self, scheduler, max_attempts=MAX_ATTEMPTS):
+        self.scheduler = scheduler
+        self.max_attempts = max_attempts
+        self.books = []
+
+    def add(self, bookmeta):
+        logger.debug('Deferred "' + bookmeta.filename + '"')
+        self.books.append([bookmeta, 0])
+
+    def retry_in(self, bookmeta):
+        """Seconds until none of the providers of the book is open."""
+        return max(self.scheduler.get_breaker(provider).retry_in() for provider in bookmeta.providers)
+
+    def is_open(self, bookmeta):
+        return self.retry_in(bookmeta) > 0
+
+    def drain(self, final=False):
+        """Retry the books whose provider can be asked again, without waiting."""
+        pending = []
+        while self.books:
+            entry = self.books.pop(0)
+            if self.is_open(entry[0]):
+                pending.append(entry)
+                continue
+            entry[1] += 1
+            logger.debug('Retry ' + str(entry[1]) + ' of "' + entry[0].filename + '"')
+            if not entry[0].rename(final=final and entry[1] >= self.max_attempts):
+                pending.append(entry)
+        self.books = pending
+
+    def finish(self):
+        """Wait for the breakers and retry until every book is renamed."""
+        while self.books:
+            wait = min(self.retry_in(bookmeta) for (bookmeta, attempts) in self.books)
+            if wait > 0:
+                logger.debug(str(len(self.books)) + ' deferred books, next retry in %.0f s' % wait)
+                time.sleep(wait)
+            self.drain(final=True)
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Manifest:
+    """SQLite record of the books already processed: path, size, mtime and SHA-1 of the content,
+    with the state found by BookMeta.detect, the merged metadata, the prefix the book was renamed
+    with and the rename pattern.
+
+    A book whose path, size and mtime are unchanged is known without opening it. A book moved or
+    renamed by hand is found again by its hash.
+    """
+    RESULT_RENAMED = 'EMANER'
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS books (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, '
+                          'hash TEXT, state TEXT, meta TEXT, result TEXT, pattern TEXT, time REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS books_hash ON books (hash)')
+        self.conn.commit()
+
+    def get_digest(self, filename):
+        sha1 = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            while True:
+                data = f.read(self.CHUNK_SIZE)
+                if not data:
+                    break
+                sha1.update(data)
+        return sha1.hexdigest()
+
+    def make_entry(self, row):
+        (path, size, mtime, digest, state, meta, result, pattern) = row
+        return {'path': path, 'size': size, 'mtime': mtime, 'hash': digest, 'state': json.loads(state),
+                'meta': json.loads(meta), 'result': result, 'pattern': pattern}
+
+    def get_unchanged(self, filename):
+        """Return the entry of filename if its size and mtime have not changed, or None."""
+        with self.lock:
+            row = self.conn.execute('SELECT path, size, mtime, hash, state, meta, result, pattern FROM books '
+                                    'WHERE path = ?', (filename,)).fetchone()
+        if row is None:
+            return None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        if st.st_size != row[1] or st.st_mtime != row[2]:
+            return None
+        return self.make_entry(row)
+
+    def find(self, digest):
+        """Return an entry of the same content, or None."""
+        with self.lock:
+            row = self.conn.execute('SELECT path, size, mtime, hash, state, meta, result, pattern FROM books '
+                                    'WHERE hash = ? ORDER BY time DESC', (digest,)).fetchone()
+        if row is None:
+            return None
+        return self.make_entry(row)
+
+    def is_done(self, entry, pattern):
+        """Whether the book of an unchanged entry needs nothing more: it was not renamed, or was
+        renamed with the same pattern."""
+        return entry['result'] != self.RESULT_RENAMED or entry['pattern'] == pattern
+
+    def put(self, filename, digest, state, meta, result, pattern, old_filename=None):
+        st = os.stat(filename)
+        with self.lock:
+            if old_filename is not None and old_filename != filename:
+                self.conn.execute('DELETE FROM books WHERE path = ?', (old_filename,))
+            self.conn.execute('INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                              (filename, st.st_size, st.st_mtime, digest, json.dumps(state), json.dumps(meta or {}),
+                               result, pattern, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+import isbnlib
+
+logger = logging.getLogger(__name__)
+
+
+class MetaCache:
+    """SQLite cache of the answers of isbnlib.meta, keyed by (ISBN-13, provider).
+
+    Found metadata, "not found" answers and HTTP/URL errors are all stored, each kind with its
+    own time to live in seconds. The times are those of clock, time.time by default.
+    """
+    OUTCOME_HIT = 'hit'
+    OUTCOME_NOTFOUND = 'notfound'
+    OUTCOME_ERROR = 'error'
+    OUTCOMES = [OUTCOME_HIT, OUTCOME_NOTFOUND, OUTCOME_ERROR]
+    TTL = {OUTCOME_HIT: 180 * 24 * 3600, OUTCOME_NOTFOUND: 7 * 24 * 3600, OUTCOME_ERROR: 3600}
+
+    def __init__(self, path, ttl=None, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.ttl = dict(self.TTL)
+        if ttl is not None:
+            self.ttl.update(ttl)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (isbn TEXT, provider TEXT, outcome TEXT, meta TEXT, '
+                          'time REAL, PRIMARY KEY (isbn, provider))')
+        self.conn.commit()
+
+    def get_key(self, isbn):
+        return isbnlib.to_isbn13(isbn) or isbnlib.canonical(isbn)
+
+    def is_expired(self, outcome, stored, now=None):
+        if now is None:
+            now = self.clock()
+        return now - stored > self.ttl.get(outcome, 0)
+
+    def get(self, isbn, provider):
+        """Return (outcome, meta) of a fresh entry or None."""
+        with self.lock:
+            row = self.conn.execute('SELECT outcome, meta, time FROM meta WHERE isbn = ? AND provider = ?',
+                                    (self.get_key(isbn), provider)).fetchone()
+        if row is None or self.is_expired(row[0], row[2]):
+            return None
+        return row[0], json.loads(row[1])
+
+    def put(self, isbn, provider, outcome, meta=None):
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?)',
+                              (self.get_key(isbn), provider, outcome, json.dumps(meta or {}), self.clock()))
+            self.conn.commit()
+
+    def purge(self, outcome=None, expired_only=True):
+        """Delete the entries of one outcome (or of all outcomes), only the expired ones by default.
+        Return the number of deleted entries."""
+        outcomes = self.OUTCOMES if outcome is None else [outcome]
+        now = self.clock()
+        count = 0
+        with self.lock:
+            for name in outcomes:
+                if expired_only:
+                    cursor = self.conn.execute('DELETE FROM meta WHERE outcome = ? AND time < ?',
+                                               (name, now - self.ttl.get(name, 0)))
+                else:
+                    cursor = self.conn.execute('DELETE FROM meta WHERE outcome = ?', (name,))
+                count += cursor.rowcount
+            self.conn.commit()
+        return count
+
+    def stats(self):
+        """Return (provider, outcome, entries, expired entries) rows."""
+        now = self.clock()
+        rows = []
+        with self.lock:
+            for (provider, outcome, stored) in self.conn.execute('SELECT provider, outcome, time FROM meta'):
+                rows.append((provider, outcome, self.is_expired(outcome, stored, now)))
+        counts = {}
+        for (provider, outcome, expired) in rows:
+            (entries, expired_entries) = counts.get((provider, outcome), (0, 0))
+            counts[(provider, outcome)] = (entries + 1, expired_entries + (1 if expired else 0))
+        return [key + counts[key] for key in sorted(counts)]
+
+    def entries(self, isbn):
+        """Return (provider, outcome, meta, stored time) rows of one ISBN, expired or not."""
+        with self.lock:
+            rows = self.conn.execute('SELECT provider, outcome, meta, time FROM meta WHERE isbn = ? ORDER BY provider',
+                                     (self.get_key(isbn),)).fetchall()
+        return [(provider, outcome, json.loads(meta), stored) for (provider, outcome, meta, stored) in rows]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import logging
+import time
+
+import isbnlib
+
+from lookup import HedgedLookup
+from metacache import MetaCache
+from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+
+def get_providers(value):
+    """'goob, openl' -> ['goob', 'openl'], an ordered list of isbnlib providers; ValueError when
+    it is empty"""
+    providers = [provider.strip() for provider in value.split(',') if len(provider.strip()) > 0]
+    if len(providers) == 0:
+        raise ValueError('no metadata provider in "' + value + '"')
+    return providers
+
+
+class MetaLookup:
+    """Looks up the metadata of ISBNs on an ordered list of providers through the cache and,
+    with a scheduler, within its rate limits and circuit breakers. It holds no state of a book:
+    the outcomes are returned, and the time and counters are recorded under filename. BookMeta
+    uses one per book, IsbnResolver one for the whole list.
+    """
+    MAX_HTTP_RETRY = 2
+    LONG_SLEEP = 300
+    OUTCOME_DEFERRED = 'deferred'  # the circuit breaker of the provider is open, never cached
+    # when the answers of one ISBN differ between providers, the best one counts
+    OUTCOME_RANK = [MetaCache.OUTCOME_HIT, OUTCOME_DEFERRED, MetaCache.OUTCOME_ERROR, MetaCache.OUTCOME_NOTFOUND]
+    HEDGE_DELAY = 10  # ask the next provider when the first has not answered after this many seconds
+
+    def __init__(self, providers, cache=None, scheduler=None, metrics=None, filename=None):
+        self.providers = providers
+        self.cache = cache
+        self.scheduler = scheduler
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.filename = filename
+
+    def print_metadata(self, meta):
+        for matadata in meta.items():
+            logger.debug(matadata[0] + ' : ' + ' '.join(matadata[1]))
+        logger.debug('')
+
+    def get_best_outcome(self, outcomes):
+        return min(outcomes, key=self.OUTCOME_RANK.index)
+
+    def get_cached_meta(self, isbn, provider=None):
+        """Return the cached (meta, outcome) of isbn on provider, or None."""
+        if provider is None:
+            provider = self.providers[0]
+        cached = self.cache.get(isbn, provider) if self.cache is not None else None
+        if cached is not None and cached[0] == MetaCache.OUTCOME_ERROR and self.scheduler is not None:
+            # an error is transient: the book waits while the breaker of the provider is open,
+            # otherwise the provider is asked again
+            if self.scheduler.get_breaker(provider).retry_in() > 0:
+                logger.debug('Cached error of ' + isbn + ' on ' + provider + ', lookup deferred')
+                return {}, self.OUTCOME_DEFERRED
+            cached = None
+        if self.cache is not None:
+            self.metrics.count(self.filename, 'cache_hits' if cached is not None else 'cache_misses')
+        if cached is None:
+            return None
+        (outcome, meta) = cached
+        logger.debug('Cached ' + outcome + ' of ' + isbn + ' on ' + provider)
+        if outcome == MetaCache.OUTCOME_HIT:
+            self.print_metadata(meta)
+        return meta, outcome
+
+    def fetch_isbnlin_meta(self, isbn, scheduler=None, provider=None):
+        """Query the ISBN database with retries and cache the outcome. It does not change the
+        state of the book, so it can run on a LookupScheduler thread. Return (meta, outcome).
+
+        With a scheduler, requests wait for its rate limit and HTTP/URL errors go to the circuit
+        breaker of the provider instead of sleeping; while the breaker is open the outcome is
+        OUTCOME_DEFERRED."""
+        if provider is None:
+            provider = self.providers[0]
+        started = time.time()
+        meta = {}
+        logger.debug('Searching ' + isbn + ' on ' + provider)
+        count = 0
+        outcome = MetaCache.OUTCOME_NOTFOUND
+        breaker = scheduler.get_breaker(provider) if scheduler is not None else None
+        while count <= self.MAX_HTTP_RETRY:
+            if breaker is not None:
+                if not breaker.allow():
+                    logger.debug('Lookup of ' + isbn + ' deferred, ' + provider + ' is not available')
+                    self.metrics.count(self.filename, 'deferred')
+                    self.metrics.add_time(self.filename, 'fetch_isbnlin_meta', time.time() - started)
+                    return {}, self.OUTCOME_DEFERRED
+                with self.metrics.timer(self.filename, 'throttle'):
+                    scheduler.throttle(provider)
+            self.metrics.count(self.filename, 'requests')
+            try:
+                meta = isbnlib.meta(isbn,  provider)
+            except Exception as ex:
+                if ex.message.startswith('an HTTP error has ocurred'):
+                    logger.debug('HTTP error ... ...')
+                    self.metrics.count(self.filename, 'http_errors')
+                    count += 1
+                    if breaker is not None:
+                        breaker.record_failure()
+                        continue
+                    logger.debug('Sleep Start : %s' % time.ctime())
+                    with self.metrics.timer(self.filename, 'sleep'):
+                        time.sleep(self.LONG_SLEEP * count)
+                    logger.debug('Sleep End : %s' % time.ctime())
+                    logger.debug('End of Try ' + str(count))
+                elif ex.message.startswith('an URL error has ocurred'):
+                    logger.debug('URL error ... ...')
+                    self.metrics.count(self.filename, 'url_errors')
+                    count += 1
+                    if breaker is not None:
+                        breaker.record_failure()
+                else:
+                    if breaker is not None:
+                        breaker.record_success()
+                    logger.debug('Exception: ' + ex.message)
+                    logger.debug('Metadata of ISBN ' + isbn + ' Not Found')
+                    logger.debug('')
+                    break
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                if meta:
+                    outcome = MetaCache.OUTCOME_HIT
+                    self.print_metadata(meta)
+                else:
+                    meta = {}
+                break
+        if count > self.MAX_HTTP_RETRY:
+            outcome = MetaCache.OUTCOME_ERROR
+        if self.cache is not None:
+            self.cache.put(isbn, provider, outcome, meta)
+        self.metrics.add_time(self.filename, 'fetch_isbnlin_meta', time.time() - started)
+        return meta, outcome
+
+    def fetch_scheduled(self, isbn, provider):
+        return self.fetch_isbnlin_meta(isbn, self.scheduler, provider)
+
+    def get_hedged_lookup(self):
+        """A HedgedLookup of the providers on the scheduler; cached answers come at once."""
+        return HedgedLookup(self.scheduler, self.providers, self.fetch_scheduled, self.HEDGE_DELAY,
+                            lambda answer: len(answer[0]) > 0, self.get_cached_meta)
+
+    def normalize_meta(self, meta):
+        # just need the first Author; copy first, isbnlib may hand out the dict of its own cache
+        # and a deferred book is looked up again
+        meta = dict(meta)
+        if 'Authors' in meta:
+            authors = meta.pop('Authors')
+            meta['Author'] = authors[0] if len(authors) > 0 else ''
+        return meta
@@ -15,27 +15,48 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
 import HTMLParser
 import logging
 from random import randint
 import re
 import os
+import posixpath
 import subprocess
 import time
 import zipfile
 
 import isbnlib
 
+from budget import FileLimits, LimitExceeded
+from epubopf import EpubPackage
+from isbnscan import ISBNScanner
+from manifest import Manifest
+from metacache import MetaCache
+from metalookup import MetaLookup, get_providers
+from metrics import Metrics
+from pdftext import PdfDocument
+from tikaserver import TikaError, iter_blocks
+
 logger = logging.getLogger(__name__)
 
 class EpubParser(HTMLParser.HTMLParser):
-    def __init__(self, filename):
+    FIRST_PARTS = 3
+    LAST_PARTS = 3
+    PRIORITY_PART = re.compile(r'copy|colophon|imprint|legal|title|isbn', re.I)
+    PRIORITY_GUIDE = ['copyright-page', 'title-page', 'colophon', 'imprint']
+    CHUNK_SIZE = 65536
+
+    def __init__(self, filename, zf=None, package=None, budget=None):
         HTMLParser.HTMLParser.__init__(self)
         self.filename = filename
-        self.content = ""
+        self.zf = zf
+        self.package = package
+        self.budget = budget  # a FileBudget counting the decompressed bytes
+        self.pieces = []
 
     def handle_data(self, data):
-        self.content += data
+        self.pieces.append(data)
 
     def get_htmls(self, zf):
         htmls = []
@@ -54,20 +75,84 @@ class EpubParser(HTMLParser.HTMLParser):
         aux.sort()
         return [info for _, info in aux]
 
-    def run(self):
+    def get_parts(self, zf):
+        """Return the names of the html parts in scanning order.
+
+        With a spine, the copyright/title pages named by the guide or by their file names come
+        first, then the first and the last FIRST_PARTS/LAST_PARTS items, then the rest of the
+        spine and finally the html files the spine does not list. Without a spine, the html files
+        are scanned in natural order of their names.
+        """
+        htmls = [info.filename for info in self.sort_numbers(self.get_htmls(zf))]
+        names = set(zf.namelist())
+        spine = []
+        if self.package is not None:
+            spine = [href for href in self.package.spine if href in names]
+        if len(spine) == 0:
+            return htmls
+        candidates = [href for (kind, href) in self.package.guide if kind in self.PRIORITY_GUIDE and href in names]
+        candidates += [href for href in spine if self.PRIORITY_PART.search(posixpath.basename(href))]
+        candidates += spine[:self.FIRST_PARTS] + spine[-self.LAST_PARTS:] + spine + htmls
+        parts = []
+        seen = set()
+        for href in candidates:
+            if href not in seen:
+                seen.add(href)
+                parts.append(href)
+        return parts
+
+    def iter_part_texts(self, zf, name):
+        # the member is decompressed and parsed CHUNK_SIZE bytes at a time and its texts are
+        # yielded in blocks of whole lines
+        self.reset()
+        self.pieces = []
         try:
-            zf = zipfile.ZipFile(self.filename, 'r')
-            htmls = self.get_htmls(zf)
-            htmls = self.sort_numbers(htmls)
-            for html in htmls:
+            member = zf.open(name)
+        except:
+            logging.debug('Exception in ZipFile')
+            return
+        try:
+            rest = ''
+            while True:
                 try:
-                    self.feed(zf.read(html))
+                    data = member.read(self.CHUNK_SIZE)
+                    if data:
+                        self.feed(data)
+                    else:
+                        self.close()
                 except:
                     logging.debug('Exception in EpubParser')
-                    pass
-        except:
-            logging.debug('Exception in ZipFile')
-            pass
+                    data = ''
+                if self.budget is not None:
+                    self.budget.add_zip_bytes(len(data))
+                texts = rest + ''.join(self.pieces)
+                self.pieces = []
+                end = texts.rfind('\n') + 1 if data else len(texts)
+                rest = texts[end:]
+                if end > 0:
+                    yield texts[:end]
+                if not data:
+                    break
+        finally:
+            member.close()
+
+    def iter_texts(self):
+        """Yield the texts of the html parts in blocks of whole lines. Nothing more is
+        decompressed once the generator is closed."""
+        zf = self.zf
+        if zf is None:
+            try:
+                zf = zipfile.ZipFile(self.filename, 'r')
+            except:
+                logging.debug('Exception in ZipFile')
+                return
+        try:
+            for name in self.get_parts(zf):
+                for texts in self.iter_part_texts(zf, name):
+                    yield texts
+        finally:
+            if self.zf is None:
+                zf.close()
 
 
 class BookMeta:
@@ -79,37 +164,67 @@ class BookMeta:
     ISBN13_PATTERN_1 = re.compile(r'97[89][-0-9 ]{14}(?:\s|$)')
     ISBN13_PATTERN_2 = re.compile(r'ISBN[\x20\w\t\(\)]{0,40}97[89]\d{10}(?:\s|$)')
     ISBN_PATTERN = [ISBN13_PATTERN_1, ISBN10_PATTERN_1, ISBN13_PATTERN_2, ISBN10_PATTERN_2]
-    MAX_HTTP_RETRY = 2
+    SCANNER = ISBNScanner(ISBN_PATTERN, SPECIAL_ISBN)
     MAX_ISBN_COUNT = 5
-    LONG_SLEEP = 300
+    PDF_FIRST_PAGES = 10  # pages read without Tika at the start of a PDF, where the copyright page is
+    PDF_LAST_PAGES = 5  # and at its end, for the colophon
     SHORT_SLEEP = 5
     STATUS_OK = 0
     STATUS_HTTPERROR = 1
     STATUS_NOTFOUND = 2
     STATUS_TOOMANYISBN = 3
+    STATUS_DEFERRED = 4
+    RESULT_LIMITED = 'TIMIL'  # a FileLimits limit was exceeded before any ISBN was found
+    OUTCOME_DEFERRED = MetaLookup.OUTCOME_DEFERRED
+    COMPLETE_FIELDS = ['Title', 'Authors', 'Year', 'Publisher']
+    DETECTED_STATE = ['isbns', 'meta_epub', 'isbnfound', 'texts_lines', 'limited']  # what detect() finds
 
-    def __init__(self, filename, recorder, isbndb='goob', pattern='default'):
+    def __init__(self, filename, recorder, isbndb='goob', pattern='default', tika=None, cache=None, scheduler=None,
+                 manifest=None, metrics=None, journal=None, limits=None):
         self.filename = filename
         self.recorder = recorder
-        self.isbndb = isbndb
+        # an ordered list of providers, e.g. 'goob,openl'
+        self.providers = get_providers(isbndb)
+        self.isbndb = self.providers[0]
+        self.tika = tika
+        self.cache = cache
+        self.scheduler = scheduler
+        self.cache_hit = False
         self.pattern = self.check_pattern(pattern)
         self.isbnfound = False
+        self.texts_lines = 0
         self.status = self.STATUS_OK
+        self.detected = False
+        self.isbns = []
+        self.meta_epub = {}
+        self.manifest = manifest
+        self.digest = None
+        self.known_meta = None
+        self.result = None
+        self.new_filename = None
+        self.copies = []  # byte-identical copies of the book, renamed after it with the same metadata
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.lookup = MetaLookup(self.providers, cache, scheduler, self.metrics, filename)
+        self.journal = journal  # a ResultJournal planning the renames instead of doing them
+        self.limits = limits if limits is not None else FileLimits()
+        self.budget = self.limits.start(filename)
+        self.limited = None  # the limit exceeded by the book
 
-    def check_pattern(self, patt):
+    @staticmethod
+    def check_pattern(patt):
         fields = []
         vaild = False
         if ':' in patt:
             patt = re.sub(r'\s+', '', patt)
             fields = patt.split(':')
             for field in fields:
-                if field in self.PATTERN_FIELD:
+                if field in BookMeta.PATTERN_FIELD:
                     vaild = True
                 else:
                     vaild = False
                     break
         if not vaild:
-            fields = self.DEFAULT_PATTERN
+            fields = BookMeta.DEFAULT_PATTERN
         return fields
 
     def get_canonical_isbn(self, line):
@@ -157,24 +272,58 @@ class BookMeta:
                         isbns.append(isbn)
         return isbns
 
+    def count_lines(self, texts):
+        count = texts.count('\n')
+        if len(texts) > 0 and not texts.endswith('\n'):
+            count += 1
+        return count
+
     def get_isbns(self, texts):
+        # texts may be a string or an iterable of strings holding whole lines, which is closed as
+        # soon as scanning stops. Only the lines ISBNScanner finds a candidate in are looked at.
         # logger.debug('[ ' + texts + ' ]')
-        lines = texts.splitlines()
+        started = time.time()
+        if isinstance(texts, basestring):
+            blocks = [texts]
+        else:
+            blocks = texts
         countdown = 100  # for finding other ISBNs
         found = False
         isbns = []
-        for line in lines:
-            candidates = self.get_canonical_isbn(line)
-            # candidates = self.get_canonical_isbn2(line)
-            for isbn in candidates:
-                if isbn not in self.SPECIAL_ISBN and not any(isbn in s for s in isbns):
-                    isbns.append(isbn)
-                    found = True
-            if found:
-                countdown -= 1
-            if countdown < 1:
-                break
+        seen = set()
+        count = 0
+        last = 0
+        try:
+            for block in blocks:
+                self.budget.add_text_bytes(len(block))
+                for (lineno, line) in self.SCANNER.iter_lines(block):
+                    if found and count + lineno >= last:
+                        break
+                    candidates = self.SCANNER.scan_line(line)
+                    # candidates = self.get_canonical_isbn2(line)
+                    for isbn in candidates:
+                        if isbn not in self.SPECIAL_ISBN and self.SCANNER.is_new(isbn, isbns, seen):
+                            seen.add(isbn)
+                            isbns.append(isbn)
+                            if not found:
+                                found = True
+                                last = count + lineno + countdown
+                lines = self.count_lines(block)
+                count += lines
+                if found and count >= last:
+                    break
+                self.budget.add_text_lines(lines)
+        except LimitExceeded as ex:
+            # the ISBNs found so far still count
+            self.set_limited(ex)
+        finally:
+            if hasattr(blocks, 'close'):
+                blocks.close()
+        self.texts_lines = count
         self.isbnfound = found
+        # including the extraction the blocks are read from
+        self.metrics.add_time(self.filename, 'get_isbns', time.time() - started)
+        self.metrics.count(self.filename, 'isbns', len(isbns))
         if len(isbns) < 1:
             logger.debug('Not Found ISBN in ' + self.filename)
         else:
@@ -183,24 +332,102 @@ class BookMeta:
         logger.debug('')
         return isbns
 
+    def set_limited(self, ex):
+        logger.error('!!!!!! [Limit Exceeded]: "' + self.filename + '" ' + str(ex) + ' !!!!!!')
+        self.limited = ex.limit
+        self.metrics.count(self.filename, 'limited')
+
     def extract_texts(self, args):
-        cmd = 'java -jar tika-app-1.8.jar -t -eUTF-8 ' + args + ' "' + self.filename + '"'
-        # cmd = 'java -jar pdfbox-app-1.8.9.jar ExtractText -sort -console "' + self.filename + '"'
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-        (output, err) = process.communicate()
-        # logger.debug(err)
+        """Return all the texts extracted by Tika, within the budget of the book."""
+        with self.metrics.timer(self.filename, 'extract_texts'):
+            blocks = self.iter_texts(args)
+            texts = []
+            try:
+                for block in blocks:
+                    self.budget.add_text_bytes(len(block))
+                    texts.append(block)
+            finally:
+                blocks.close()
+            output = ''.join(texts)
+        self.metrics.add_bytes(self.filename, 'extract_texts', len(output))
         return output
 
-    def extract_epub_texts(self):
-        parser = EpubParser(self.filename)
-        parser.run()
-        return parser.content
+    def iter_texts(self, args):
+        """Yield the texts extracted by Tika in blocks of whole lines. The java process is killed
+        when the generator is closed before the end of the texts, or when the time of the book is
+        over. When the Tika server fails on the book, all its texts are extracted again by a
+        one-off java process, so some blocks may come twice."""
+        if self.tika is not None:
+            blocks = self.tika.iter_texts(self.filename, args, self.budget.deadline)
+            if blocks is not None:
+                try:
+                    for texts in blocks:
+                        yield texts
+                    return
+                except TikaError:
+                    # a server past the deadline is not worth a retry
+                    self.budget.check()
+                    logger.error('Extracting "' + self.filename + '" with "java -jar" instead')
+                finally:
+                    blocks.close()
+        cmd = ['java', '-jar', 'tika-app-1.8.jar', '-t', '-eUTF-8'] + args.split() + [self.filename]
+        devnull = open(os.devnull, 'w')
+        try:
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=devnull)
+        except OSError:
+            logger.error('Can not run Tika')
+            return
+        finally:
+            devnull.close()
+        try:
+            fd = process.stdout.fileno()
+            for texts in iter_blocks(lambda size: self.budget.read(fd, size)):
+                yield texts
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+    def iter_pdf_texts(self):
+        """Yield the texts of the first and the last pages of the PDF, read without Tika."""
+        document = PdfDocument(self.filename)
+        try:
+            for (index, texts) in document.iter_page_texts(self.PDF_FIRST_PAGES, self.PDF_LAST_PAGES):
+                yield texts + '\n'
+        finally:
+            document.close()
+
+    def get_pdf_isbns(self):
+        # Tika extracts the whole document, only when the front and back matter have no ISBN
+        try:
+            blocks = self.metrics.iter_timed(self.filename, 'extract_pdf_texts', self.iter_pdf_texts())
+            isbns = self.get_isbns(blocks)
+            if len(isbns) > 0 or self.limited is not None:
+                return isbns
+            logger.debug('No ISBN in the first and last pages of "' + self.filename + '"')
+        except Exception as ex:
+            logger.debug('Can not read "' + self.filename + '" without Tika: ' + str(ex))
+        blocks = self.metrics.iter_timed(self.filename, 'extract_texts', self.iter_texts('-T -t'))
+        return self.get_isbns(blocks)
+
+    def extract_epub_texts(self, zf=None, package=None):
+        parser = EpubParser(self.filename, zf, package, self.budget)
+        return self.metrics.iter_timed(self.filename, 'extract_epub_texts', parser.iter_texts())
 
     def print_metadata(self, meta):
         for matadata in meta.items():
             logger.debug(matadata[0] + ' : ' + ' '.join(matadata[1]))
         logger.debug('')
 
+    def check_epub_meta(self, meta):
+        if ('meta:author' in meta or 'Author' in meta) and ('dc:title' in meta or 'title' in meta):
+            logger.debug('HAVE METADATA in epub')
+        else:
+            logger.debug('HAVE NOT METADATA in epub')
+            meta = {}
+        return meta
+
     def get_epub_meata(self):
         texts = self.extract_texts('-m')
         if len(texts) == 0:
@@ -213,55 +440,137 @@ class BookMeta:
                 (key, value) = line.split(': ', 1)
                 if len(key) > 1 and len(value) > 1:
                     meta[key] = value
-        if ('meta:author' in meta or 'Author' in meta) and ('dc:title' in meta or 'title' in meta):
-            logger.debug('HAVE METADATA in epub')
-        else:
-            logger.debug('HAVE NOT METADATA in epub')
-            meta = {}
-        return meta
+        return self.check_epub_meta(meta)
 
-    def call_isbnlin_meta(self, isbn):
+    def get_epub_isbns(self):
+        """Read the metadata from the OPF package document, falling back to Tika when there is none,
+        and scan the html parts only when no valid ISBN is given by dc:identifier."""
+        try:
+            zf = zipfile.ZipFile(self.filename, 'r')
+        except:
+            logger.error('Can not open "' + self.filename + '"')
+            return {}, []
+        try:
+            package = EpubPackage(zf, self.budget)
+            if package.parse():
+                meta_epub = self.check_epub_meta(package.get_meta())
+            else:
+                meta_epub = self.get_epub_meata()
+            isbns = package.get_isbns()
+            if len(isbns) > 0:
+                logger.debug(self.filename + ' has ' + str(len(isbns)) + ' ISBN in ' + package.opf_path)
+                logger.debug(isbns)
+                self.isbnfound = True
+            else:
+                isbns = self.get_isbns(self.extract_epub_texts(zf, package))
+        finally:
+            zf.close()
+        return meta_epub, isbns
 
+    def set_outcome_status(self, outcome):
+        if outcome == MetaCache.OUTCOME_ERROR:
+            self.status = self.STATUS_HTTPERROR
+        elif outcome == self.OUTCOME_DEFERRED:
+            if self.status != self.STATUS_HTTPERROR:
+                self.status = self.STATUS_DEFERRED
+        elif outcome == MetaCache.OUTCOME_NOTFOUND:
+            if self.status not in (self.STATUS_HTTPERROR, self.STATUS_DEFERRED):
+                self.status = self.STATUS_NOTFOUND
+
+    def call_isbnlin_meta(self, isbn):
+        # the providers are asked in turn until one has the metadata
+        started = time.time()
+        self.cache_hit = True
         meta = {}
-        logger.debug('Searching ' + isbn + ' on ' + self.isbndb)
-        count = 0
-        while count <= self.MAX_HTTP_RETRY:
-            try:
-                meta = isbnlib.meta(isbn,  self.isbndb)
-            except Exception as ex:
-                if ex.message.startswith('an HTTP error has ocurred'):
-                    logger.debug('HTTP error ... ...')
-                    logger.debug('Sleep Start : %s' % time.ctime())
-                    count += 1
-                    time.sleep(self.LONG_SLEEP * count)
-                    logger.debug('Sleep End : %s' % time.ctime())
-                    logger.debug('End of Try ' + str(count))
-                elif ex.message.startswith('an URL error has ocurred'):
-                    logger.debug('URL error ... ...')
-                    count += 1
-                else:
-                    logger.debug('Exception: ' + ex.message)
-                    logger.debug('Metadata of ISBN ' + isbn + ' Not Found')
-                    logger.debug('')
-                    if self.status != self.STATUS_HTTPERROR:
-                        self.status = self.STATUS_NOTFOUND
-                    break
-            else:
-                self.print_metadata(meta)
+        outcomes = []
+        for provider in self.providers:
+            answer = self.lookup.get_cached_meta(isbn, provider)
+            if answer is None:
+                self.cache_hit = False
+                answer = self.lookup.fetch_isbnlin_meta(isbn, provider=provider)
+            (meta, outcome) = answer
+            outcomes.append(outcome)
+            if len(meta) > 0:
                 break
-        if count > self.MAX_HTTP_RETRY:
-            self.status = self.STATUS_HTTPERROR
+        self.set_outcome_status(self.lookup.get_best_outcome(outcomes))
+        self.metrics.add_time(self.filename, 'call_isbnlin_meta', time.time() - started)
         return meta
 
-    def get_meta_from_isbnlin(self, isbns):
+    def is_complete(self, meta):
+        for field in self.COMPLETE_FIELDS:
+            if len(meta.get(field) or '') == 0:
+                return False
+        return True
+
+    def is_settled(self, meta_array, remaining):
+        """Whether the ISBNs still to be answered can no longer change the result: the latest
+        metadata is complete, or the leading title of the vote can not be caught up."""
+        if len(meta_array) == 0:
+            return False
+        if self.is_complete(meta_array[-1]):
+            logger.debug('Complete metadata of ' + meta_array[-1].get('ISBN-13', '') + ', stop searching')
+            return True
+        title_count = {}
+        for meta in meta_array:
+            title_count[meta.get('Title')] = title_count.get(meta.get('Title'), 0) + 1
+        counts = sorted(title_count.values(), reverse=True) + [0]
+        if remaining > 0 and counts[0] > counts[1] + remaining:
+            logger.debug('Title vote settled with ' + str(remaining) + ' ISBNs left, stop searching')
+            return True
+        return False
+
+    def lookup_serially(self, isbns, early_stop=True):
         meta_array = []
-        for isbn in isbns:
+        for (i, isbn) in enumerate(isbns):
             meta = self.call_isbnlin_meta(isbn)
             if self.status == self.STATUS_HTTPERROR:
                 break
             if len(meta) > 0:
                 meta_array.append(meta)
-            time.sleep(self.SHORT_SLEEP)  # avoid http 403 error
+                if early_stop and self.is_settled(meta_array, len(isbns) - i - 1):
+                    break
+            if not self.cache_hit:
+                with self.metrics.timer(self.filename, 'sleep'):
+                    time.sleep(self.SHORT_SLEEP)  # avoid http 403 error
+        # complete metadata stops the search and wins the vote alone
+        if early_stop and len(meta_array) > 0 and self.is_complete(meta_array[-1]):
+            return meta_array[-1:]
+        return meta_array
+
+    def lookup_concurrently(self, isbns, early_stop=True):
+        # the ISBNs are looked up together on the scheduler, whose rate limit replaces SHORT_SLEEP;
+        # a slow or empty answer is hedged on the next provider, cached answers come at once
+        hedged = self.lookup.get_hedged_lookup()
+        metas = {}
+        meta_array = []
+        outcomes = {}
+        answers = hedged.iter_answers(isbns)
+        try:
+            for pending in answers:
+                try:
+                    (meta, outcome) = pending.wait()
+                except Exception:
+                    (meta, outcome) = ({}, MetaCache.OUTCOME_ERROR)
+                outcomes.setdefault(pending.key, []).append(outcome)
+                if len(meta) > 0:
+                    metas[pending.key] = meta
+                    meta_array.append(meta)
+                    if early_stop and self.is_settled(meta_array, hedged.remaining()):
+                        break
+        finally:
+            answers.close()
+            for isbn in outcomes:
+                self.set_outcome_status(self.lookup.get_best_outcome(outcomes[isbn]))
+        if early_stop and len(meta_array) > 0 and self.is_complete(meta_array[-1]):
+            return meta_array[-1:]
+        return [metas[isbn] for isbn in isbns if isbn in metas]
+
+    def get_meta_from_isbnlin(self, isbns):
+        with self.metrics.timer(self.filename, 'get_meta_from_isbnlin'):
+            if self.scheduler is None:
+                meta_array = self.lookup_serially(isbns)
+            else:
+                meta_array = self.lookup_concurrently(isbns)
         result = {}
         if len(meta_array) > 0:
             if len(meta_array) == 1:
@@ -281,14 +590,10 @@ class BookMeta:
                         if meta['Title'] == sorted_title[0]:
                             result = meta
                             break
-        # just need the first Author
-        if 'Authors' in result:
-            authors = result['Authors']
-            result.pop('Authors')
-            result['Author'] = authors[0]
-        return result
-
-    def merge_meta(self, meta_isbnlin, meta_epub):
+        return self.lookup.normalize_meta(result)
+
+    @staticmethod
+    def merge_meta(meta_isbnlin, meta_epub):
         meta_merged = {}
         if len(meta_isbnlin) == 0:
             if 'Author' in meta_epub and len(meta_epub['Author']) > 1:
@@ -349,23 +654,77 @@ class BookMeta:
                     meta_merged.pop('Publisher')
         return meta_merged
 
+    def detect(self):
+        """Extract the texts and find the ISBNs of the book, once; a deferred book is looked up
+        again without reading the file again."""
+        if self.detected:
+            return
+        try:
+            self.metrics.count(self.filename, 'file_bytes', os.path.getsize(self.filename))
+        except OSError:
+            pass
+        if self.manifest is not None and self.restore():
+            self.metrics.count(self.filename, 'manifest_restored')
+            return
+        self.budget = self.limits.start(self.filename)
+        try:
+            if self.filename.endswith('.epub'):
+                (self.meta_epub, self.isbns) = self.get_epub_isbns()
+            elif self.filename.endswith('.pdf'):
+                self.isbns = self.get_pdf_isbns()
+                if self.texts_lines == 0 and self.limited is None:
+                    logger.error('Can not open "' + self.filename + '"')
+        except LimitExceeded as ex:
+            self.set_limited(ex)
+        self.detected = True
+
+    def get_detected_state(self):
+        return dict((name, getattr(self, name)) for name in self.DETECTED_STATE)
+
+    def set_detected_state(self, state):
+        for name in self.DETECTED_STATE:
+            # older manifests lack the newer names
+            if name in state:
+                setattr(self, name, state[name])
+        self.detected = True
+
+    def restore(self):
+        """Take the detected state, and the metadata of a renamed book, from the manifest entry
+        of the same path or of the same content. Return False for an unknown book."""
+        entry = self.manifest.get_unchanged(self.filename)
+        if entry is not None:
+            self.digest = entry['hash']
+        if self.digest is None:
+            # the hash is recorded again when the book is put into the manifest
+            try:
+                self.digest = self.manifest.get_digest(self.filename)
+            except IOError:
+                return False
+            if entry is None:
+                entry = self.manifest.find(self.digest)
+        if entry is None or entry['state'].get('limited') is not None:
+            # a book which exceeded a limit is read again, with the limits of this run
+            return False
+        logger.debug('"' + self.filename + '" is known as "' + entry['path'] + '"')
+        self.set_detected_state(entry['state'])
+        if entry['result'] == Manifest.RESULT_RENAMED and len(entry['meta']) > 0:
+            self.known_meta = entry['meta']
+        return True
+
     def get_mata(self):
-        texts = ''
-        meta_epub = {}
+        self.detect()
+        if self.known_meta is not None:
+            logger.debug('Metadata of the manifest')
+            self.print_metadata(self.known_meta)
+            return self.known_meta
+        self.status = self.STATUS_OK
         meta_isbnlin = []
-        if self.filename.endswith('.epub'):
-            meta_epub = self.get_epub_meata()
-            texts = self.extract_epub_texts()
-        elif self.filename.endswith('.pdf'):
-            texts = self.extract_texts('-T -t')
-            if len(texts) == 0:
-                logger.error('Can not open "' + self.filename + '"')
-        isbns = self.get_isbns(texts)
-        if len(isbns) > self.MAX_ISBN_COUNT:
+        if len(self.isbns) > self.MAX_ISBN_COUNT:
             self.status = self.STATUS_TOOMANYISBN
         else:
-            meta_isbnlin = self.get_meta_from_isbnlin(isbns)
-        meta_merged = self.merge_meta(meta_isbnlin, meta_epub)
+            meta_isbnlin = self.get_meta_from_isbnlin(self.isbns)
+        with self.metrics.timer(self.filename, 'merge_meta'):
+            meta_merged = self.merge_meta(meta_isbnlin, self.meta_epub)
         if len(meta_merged) > 0:
             logger.debug('Merged Metadata')
             self.print_metadata(meta_merged)
@@ -376,11 +735,38 @@ class BookMeta:
         str = re.sub(r'\s+', '.', str)
         return str
 
-    def rename(self):
-        meta = self.get_mata()
+    def rename(self, final=True):
+        """Rename the book after its metadata and return True. When the lookups were deferred or
+        failed and final is False, leave the book as it is and return False, so that it can be
+        retried later."""
+        return self.rename_with(self.get_mata(), final)
+
+    def rename_with(self, meta, final=True):
+        """The renaming part of rename(), for metadata looked up on another thread."""
+        if not final and self.status in (self.STATUS_DEFERRED, self.STATUS_HTTPERROR):
+            logger.debug('Lookups of "' + self.filename + '" deferred')
+            return False
+        with self.metrics.timer(self.filename, 'rename'):
+            self.rename_to(meta)
+        self.metrics.finish(self.filename, self.result)
+        for filename in self.copies:
+            self.rename_copy(filename, meta)
+        return True
+
+    def rename_copy(self, filename, meta):
+        logger.debug('"' + filename + '" is a copy of "' + self.filename + '"')
+        copy = BookMeta(filename, self.recorder, ','.join(self.providers), manifest=self.manifest,
+                        metrics=self.metrics, journal=self.journal)
+        copy.set_detected_state(self.get_detected_state())
+        (copy.pattern, copy.digest, copy.status) = (self.pattern, self.digest, self.status)
+        copy.metrics.count(filename, 'copies')
+        copy.rename_with(meta)
+
+    def get_new_filename(self, meta):
+        """Return the result prefix of the book and the path it is renamed to."""
         dirname = os.path.dirname(self.filename)
         if len(meta) > 0:
-            new_filename = 'EMANER'
+            new_filename = Manifest.RESULT_RENAMED
             for field in self.pattern:
                 if field in meta:
                     if field == 'Year' or field == 'ISBN-13':
@@ -393,10 +779,48 @@ class BookMeta:
                     new_filename += '_NONE'
             (name, extension) = os.path.splitext(self.filename)
             new_filename += extension
-            new_filename = os.path.join(dirname, new_filename)
-            log = 'Rename "' + self.filename + '" to "' + new_filename + '"'
+            return Manifest.RESULT_RENAMED, os.path.join(dirname, new_filename)
+        if self.limited is not None and not self.isbnfound:
+            result = self.RESULT_LIMITED
+        elif self.isbnfound:
+            if self.status in (self.STATUS_HTTPERROR, self.STATUS_DEFERRED):
+                result = 'RORREPTTH'
+            elif self.status == self.STATUS_TOOMANYISBN:
+                result = 'YNAMOOT'
+            else:
+                result = 'NRAW'
+        else:
+            result = 'DELIAF'
+        basename = os.path.basename(self.filename)
+        if basename.startswith(self.RESULT_LIMITED + '_'):
+            # retried with other limits
+            basename = basename[len(self.RESULT_LIMITED) + 1:]
+        return result, os.path.join(dirname, result + '_' + basename)
+
+    def is_taken(self, new_filename):
+        # os.rename would replace an existing file without a word on POSIX
+        return new_filename != self.filename and os.path.lexists(new_filename)
+
+    def get_journal_entry(self, meta, result, new_filename):
+        return {'file': self.filename, 'new_name': new_filename, 'result': result, 'isbns': self.isbns,
+                'meta': meta, 'state': self.get_detected_state(), 'hash': self.digest,
+                'pattern': ':'.join(self.pattern)}
+
+    def rename_to(self, meta):
+        (result, new_filename) = self.get_new_filename(meta)
+        if self.journal is not None:
+            # the renaming is left to the merge of the journals
+            self.journal.write(self.get_journal_entry(meta, result, new_filename))
+            (self.result, self.new_filename) = (result, new_filename)
+            return
+        dirname = os.path.dirname(self.filename)
+        log = 'Rename "' + self.filename + '" to "' + new_filename + '"'
+        if result == Manifest.RESULT_RENAMED:
             try:
+                if self.is_taken(new_filename):
+                    raise OSError(errno.EEXIST, 'File exists')
                 os.rename(self.filename, new_filename)
+                (self.result, self.new_filename) = (Manifest.RESULT_RENAMED, new_filename)
                 logger.debug(log)
                 logger.debug('')
                 self.recorder.write(log + '\r\n')
@@ -405,23 +829,21 @@ class BookMeta:
                 exfilename = os.path.join(dirname, exfilename)
                 exlog = 'Rename "' + self.filename + '" to "' + exfilename + '"'
                 try:
+                    if self.is_taken(exfilename):
+                        raise OSError(errno.EEXIST, 'File exists')
                     os.rename(self.filename, exfilename)
+                    (self.result, self.new_filename) = ('TSIXE-NUM', exfilename)
                     logger.error('!!!!!! [Existed File]: ' + new_filename + ' !!!!!!')
                 except:
                     logger.error('!!!!!! [Renaming Fail]: ' + exlog + ' !!!!!!')
         else:
-            if self.isbnfound:
-                if self.status == self.STATUS_HTTPERROR:
-                    new_filename = 'RORREPTTH_' + os.path.basename(self.filename)
-                elif self.status == self.STATUS_TOOMANYISBN:
-                    new_filename = 'YNAMOOT_' + os.path.basename(self.filename)
-                else:
-                    new_filename = 'NRAW_' + os.path.basename(self.filename)
-            else:
-                new_filename = 'DELIAF_' + os.path.basename(self.filename)
-            new_filename = os.path.join(dirname, new_filename)
-            log = 'Rename "' + self.filename + '" to "' + new_filename + '"'
             try:
+                if self.is_taken(new_filename):
+                    raise OSError(errno.EEXIST, 'File exists')
                 os.rename(self.filename, new_filename)
+                (self.result, self.new_filename) = (result, new_filename)
             except:
-                logger.error('!!!!!! [Renaming Fail]: ' + log + ' !!!!!!')
\ No newline at end of file
+                logger.error('!!!!!! [Renaming Fail]: ' + log + ' !!!!!!')
+        if self.manifest is not None and self.result is not None:
+            self.manifest.put(self.new_filename, self.digest, self.get_detected_state(), meta, self.result,
+                              ':'.join(self.pattern), self.filename)
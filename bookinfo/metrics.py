@@ -0,0 +1,293 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import contextlib
+import csv
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Time spent, bytes extracted and counters of each book, by stage.
+
+    Everything is recorded per file while the book is processed, so that the record of a book
+    detected in another process can be merged with merge(). When the book is finished, its
+    record is added to the totals and the histograms of the stages, written as a row of the CSV
+    report if there is one, and dropped. The percentiles are taken from at most MAX_SAMPLES
+    values of each stage, a uniform sample of all the books.
+    """
+    # upper bounds in seconds of the histogram buckets
+    BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300]
+    PERCENTILES = [50, 90, 99]
+    MAX_SAMPLES = 100000
+    STAGES = ['extract_texts', 'extract_pdf_texts', 'extract_epub_texts', 'get_isbns', 'get_meta_from_isbnlin',
+              'call_isbnlin_meta', 'fetch_isbnlin_meta', 'throttle', 'sleep', 'merge_meta', 'rename']
+    COUNTERS = ['file_bytes', 'isbns', 'cache_hits', 'cache_misses', 'requests', 'http_errors', 'url_errors',
+                'deferred', 'manifest_restored', 'copies', 'limited']
+
+    def __init__(self, csv_filename=None):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.records = {}  # of the books not finished yet
+        self.finished = 0
+        self.totals = self.new_totals()
+        self.random = random.Random(0)
+        self.csv_file = None
+        self.csv_writer = None
+        if csv_filename is not None:
+            self.csv_file = open(csv_filename, 'wb')
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(['filename', 'result'] + self.COUNTERS + ['bytes_extracted'] + self.STAGES)
+            self.csv_file.flush()
+
+    def new_totals(self):
+        return {'stages': {}, 'bytes': {}, 'counters': {}, 'results': {}}
+
+    def get_record_locked(self, filename):
+        record = self.records.get(filename)
+        if record is None:
+            record = {'stages': {}, 'bytes': {}, 'counters': {}, 'result': None}
+            self.records[filename] = record
+        return record
+
+    def add_time(self, filename, stage, seconds, calls=1):
+        with self.lock:
+            stages = self.get_record_locked(filename)['stages']
+            (count, total) = stages.get(stage, (0, 0.0))
+            stages[stage] = (count + calls, total + seconds)
+
+    def add_bytes(self, filename, stage, size):
+        with self.lock:
+            extracted = self.get_record_locked(filename)['bytes']
+            extracted[stage] = extracted.get(stage, 0) + size
+
+    def count(self, filename, name, value=1):
+        with self.lock:
+            counters = self.get_record_locked(filename)['counters']
+            counters[name] = counters.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def timer(self, filename, stage):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(filename, stage, time.time() - started)
+
+    def iter_timed(self, filename, stage, blocks):
+        """Yield the blocks of texts, recording the time spent producing them and their size.
+        The time the consumer spends on a block is not counted."""
+        try:
+            iterator = iter(blocks)
+            while True:
+                started = time.time()
+                try:
+                    block = next(iterator)
+                except StopIteration:
+                    self.add_time(filename, stage, time.time() - started)
+                    return
+                self.add_time(filename, stage, time.time() - started, 0)
+                self.add_bytes(filename, stage, len(block))
+                yield block
+        finally:
+            if hasattr(blocks, 'close'):
+                blocks.close()
+
+    def finish(self, filename, result):
+        """Record the outcome of a book, the prefix it was renamed with or None, and drop its
+        record."""
+        with self.lock:
+            record = self.get_record_locked(filename)
+            del self.records[filename]
+            record['result'] = result
+            self.add_record(self.totals, record)
+            self.finished += 1
+            self.write_row_locked(filename, record)
+
+    def get_record(self, filename):
+        with self.lock:
+            return json.loads(json.dumps(self.get_record_locked(filename)))
+
+    def merge(self, filename, record):
+        with self.lock:
+            mine = self.get_record_locked(filename)
+            for (stage, (count, total)) in record['stages'].items():
+                (mine_count, mine_total) = mine['stages'].get(stage, (0, 0.0))
+                mine['stages'][stage] = (mine_count + count, mine_total + total)
+            for (kind, values) in [('bytes', record['bytes']), ('counters', record['counters'])]:
+                for (name, value) in values.items():
+                    mine[kind][name] = mine[kind].get(name, 0) + value
+
+    def get_progress(self):
+        with self.lock:
+            return self.finished, time.time() - self.started
+
+    def get_bucket(self, value):
+        for (i, bound) in enumerate(self.BUCKETS):
+            if value <= bound:
+                return i
+        return len(self.BUCKETS)
+
+    def add_record(self, totals, record):
+        for (stage, (count, total)) in record['stages'].items():
+            stats = totals['stages'].get(stage)
+            if stats is None:
+                stats = {'files': 0, 'calls': 0, 'total': 0.0, 'min': total, 'max': total,
+                         'histogram': [0] * (len(self.BUCKETS) + 1), 'samples': array.array('d')}
+                totals['stages'][stage] = stats
+            stats['files'] += 1
+            stats['calls'] += count
+            stats['total'] += total
+            stats['min'] = min(stats['min'], total)
+            stats['max'] = max(stats['max'], total)
+            stats['histogram'][self.get_bucket(total)] += 1
+            # reservoir sampling
+            if len(stats['samples']) < self.MAX_SAMPLES:
+                stats['samples'].append(total)
+            else:
+                i = self.random.randint(0, stats['files'] - 1)
+                if i < self.MAX_SAMPLES:
+                    stats['samples'][i] = total
+        for (kind, values) in [('bytes', record['bytes']), ('counters', record['counters'])]:
+            for (name, value) in values.items():
+                totals[kind][name] = totals[kind].get(name, 0) + value
+        if record['result'] is not None:
+            totals['results'][record['result']] = totals['results'].get(record['result'], 0) + 1
+
+    def copy_totals_locked(self):
+        totals = self.new_totals()
+        for (stage, stats) in self.totals['stages'].items():
+            totals['stages'][stage] = dict(stats, histogram=list(stats['histogram']),
+                                           samples=array.array('d', stats['samples']))
+        for kind in ['bytes', 'counters', 'results']:
+            totals[kind] = dict(self.totals[kind])
+        return totals
+
+    def get_stage_summary(self, stats):
+        values = sorted(stats['samples'])
+        # [upper bound, count] in the order of the buckets, the last bound is None
+        histogram = [list(pair) for pair in zip(self.BUCKETS + [None], stats['histogram'])]
+        summary = {'files': stats['files'], 'calls': stats['calls'], 'total': stats['total'],
+                   'mean': stats['total'] / stats['files'], 'min': stats['min'], 'max': stats['max'],
+                   'histogram': histogram}
+        for percentile in self.PERCENTILES:
+            # nearest rank
+            rank = max(int(len(values) * percentile / 100.0 + 0.999999) - 1, 0)
+            summary['p' + str(percentile)] = values[rank]
+        return summary
+
+    def report(self):
+        """The totals of the finished books and of those still in progress."""
+        with self.lock:
+            totals = self.copy_totals_locked()
+            for record in self.records.values():
+                self.add_record(totals, record)
+            elapsed = time.time() - self.started
+        counters = totals['counters']
+        finished = sum(totals['results'].values())
+        lookups = counters.get('cache_hits', 0) + counters.get('cache_misses', 0)
+        return {
+            'started': datetime.datetime.fromtimestamp(self.started).strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed': elapsed,
+            'files': finished,
+            'files_per_second': finished / elapsed if elapsed > 0 else 0.0,
+            'bytes_read': counters.get('file_bytes', 0),
+            'bytes_extracted': totals['bytes'],
+            'results': totals['results'],
+            'cache_hit_rate': float(counters.get('cache_hits', 0)) / lookups if lookups > 0 else None,
+            'counters': counters,
+            'stages': dict((stage, self.get_stage_summary(stats)) for (stage, stats) in totals['stages'].items()),
+        }
+
+    def write_row_locked(self, filename, record):
+        """One row per book: the result, the counters, the bytes extracted and the seconds spent
+        in each stage."""
+        if self.csv_writer is None:
+            return
+        row = [filename, record['result'] or '']
+        row += [record['counters'].get(name, 0) for name in self.COUNTERS]
+        row.append(sum(record['bytes'].values()))
+        row += ['%.3f' % record['stages'][stage][1] if stage in record['stages'] else '' for stage in self.STAGES]
+        self.csv_writer.writerow([unicode(value).encode('utf-8') for value in row])
+        self.csv_file.flush()
+
+    def close(self):
+        """Write the rows of the books not finished, without a result, and close the CSV report."""
+        with self.lock:
+            if self.csv_file is None:
+                return
+            for filename in sorted(self.records):
+                self.write_row_locked(filename, self.records[filename])
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+    def write_json(self, filename, report=None):
+        report = report if report is not None else self.report()
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    def log_summary(self, report=None):
+        report = report if report is not None else self.report()
+        logger.info('%d files in %.1f s, %.2f files/s' % (report['files'], report['elapsed'],
+                                                          report['files_per_second']))
+        for (result, count) in sorted(report['results'].items()):
+            logger.info('%-10s %6d' % (result, count))
+        for stage in self.STAGES:
+            if stage in report['stages']:
+                summary = report['stages'][stage]
+                logger.info('%-22s total %9.2f s  mean %7.3f s  p50 %7.3f s  p99 %7.3f s' % (
+                    stage, summary['total'], summary['mean'], summary['p50'], summary['p99']))
+
+
+class Progress:
+    """Logs the books done, the throughput and the ETA every interval seconds, on a thread."""
+    def __init__(self, metrics, total, interval):
+        self.metrics = metrics
+        self.total = total
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def log(self):
+        (done, elapsed) = self.metrics.get_progress()
+        rate = done / elapsed if elapsed > 0 else 0.0
+        message = 'Progress: %d/%d files, %.2f files/s' % (done, self.total, rate)
+        if rate > 0:
+            eta = int((self.total - done) / rate)
+            message += ', ETA ' + str(datetime.timedelta(seconds=max(eta, 0)))
+        logger.info(message)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.log()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
@@ -0,0 +1,764 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import binascii
+import logging
+import mmap
+import re
+import struct
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SPACE = '\x00\t\n\x0c\r '
+DELIMITER = '()<>[]{}/%'
+RE_SPACE = re.compile(r'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*')
+RE_NUMBER = re.compile(r'[+-]?(?:\d+\.?\d*|\.\d+)')
+RE_REF = re.compile(r'[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])')
+RE_REGULAR = re.compile(r'[^\x00\t\n\x0c\r ()<>\[\]{}/%]*')
+RE_LITERAL = re.compile(r'[^()\\]*')
+RE_OCTAL = re.compile(r'[0-7]{1,3}')
+RE_HEX = re.compile(r'[^>]*')
+RE_NAME_ESCAPE = re.compile(r'#([0-9A-Fa-f]{2})')
+RE_OBJ = re.compile(r'(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj')
+RE_STREAM = re.compile(r'[\x00\t\n\x0c\r ]*stream(?:\r\n|\n|\r)')
+RE_XREF_ENTRY = re.compile(r'(\d{10}) (\d{5}) ([nf])')
+RE_INLINE_END = re.compile(r'[\x00\t\n\x0c\r ]EI(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])')
+RE_BFCHAR = re.compile(r'beginbfchar(.*?)endbfchar', re.S)
+RE_BFRANGE = re.compile(r'beginbfrange(.*?)endbfrange', re.S)
+RE_CMAP_TOKEN = re.compile(r'<([0-9A-Fa-f\s]*)>|\[|\]')
+ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', 'b': '\b', 'f': '\x0c', '(': '(', ')': ')', '\\': '\\'}
+# glyph names of the Differences of simple fonts, enough for ISBNs
+GLYPHS = {'zero': '0', 'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6',
+          'seven': '7', 'eight': '8', 'nine': '9', 'hyphen': '-', 'space': ' ', 'period': '.', 'colon': ':',
+          'comma': ',', 'parenleft': '(', 'parenright': ')', 'endash': '-', 'minus': '-'}
+
+
+class PdfError(Exception):
+    """The PDF uses something PdfDocument does not read; Tika should be used instead."""
+    pass
+
+
+class PdfName(str):
+    pass
+
+
+class PdfOperator(str):
+    pass
+
+
+class PdfRef:
+    def __init__(self, num, gen):
+        self.num = num
+        self.gen = gen
+
+
+class PdfStream:
+    def __init__(self, attrs, data):
+        self.attrs = attrs
+        self.data = data
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+
+def parse_object(buf, pos, depth=0):
+    """Parse the object at pos of buf (a string or a mmap) and return (object, end). Names are
+    PdfName, strings are str and keywords other than true/false/null are PdfOperator."""
+    if depth > 64:
+        raise PdfError('objects nested too deep')
+    pos = RE_SPACE.match(buf, pos).end()
+    if pos >= len(buf):
+        raise PdfError('unexpected end of data')
+    c = buf[pos]
+    if c == '/':
+        end = RE_REGULAR.match(buf, pos + 1).end()
+        name = buf[pos + 1:end]
+        if '#' in name:
+            name = RE_NAME_ESCAPE.sub(lambda m: chr(int(m.group(1), 16)), name)
+        return PdfName(name), end
+    if c == '(':
+        return parse_literal(buf, pos + 1)
+    if c == '<':
+        if buf[pos + 1:pos + 2] == '<':
+            return parse_dict(buf, pos + 2, depth)
+        end = RE_HEX.match(buf, pos + 1).end()
+        digits = re.sub(r'[^0-9A-Fa-f]', '', buf[pos + 1:end])
+        if len(digits) % 2 == 1:
+            digits += '0'
+        return binascii.unhexlify(digits), end + 1
+    if c == '[':
+        array = []
+        pos += 1
+        while True:
+            pos = RE_SPACE.match(buf, pos).end()
+            if pos >= len(buf):
+                raise PdfError('unterminated array')
+            if buf[pos] == ']':
+                return array, pos + 1
+            (obj, pos) = parse_object(buf, pos, depth + 1)
+            array.append(obj)
+    match = RE_NUMBER.match(buf, pos)
+    if match:
+        token = match.group()
+        if '.' in token:
+            return float(token), match.end()
+        ref = RE_REF.match(buf, match.end())
+        if ref and token.isdigit():
+            return PdfRef(int(token), int(ref.group(1))), ref.end()
+        return int(token), match.end()
+    end = RE_REGULAR.match(buf, pos).end()
+    if end == pos:
+        # a stray delimiter
+        return PdfOperator(c), pos + 1
+    keyword = buf[pos:end]
+    if keyword == 'true':
+        return True, end
+    if keyword == 'false':
+        return False, end
+    if keyword == 'null':
+        return None, end
+    return PdfOperator(keyword), end
+
+
+def parse_literal(buf, pos):
+    out = []
+    depth = 1
+    while True:
+        match = RE_LITERAL.match(buf, pos)
+        out.append(match.group())
+        pos = match.end()
+        if pos >= len(buf):
+            break
+        c = buf[pos]
+        if c == '\\':
+            n = buf[pos + 1:pos + 2]
+            if n in ESCAPES:
+                out.append(ESCAPES[n])
+                pos += 2
+            elif n != '' and n in '01234567':
+                octal = RE_OCTAL.match(buf, pos + 1)
+                out.append(chr(int(octal.group(), 8) & 255))
+                pos = octal.end()
+            elif n == '\r':
+                pos += 3 if buf[pos + 2:pos + 3] == '\n' else 2
+            else:
+                out.append(n)
+                pos += 2
+        elif c == '(':
+            depth += 1
+            out.append(c)
+            pos += 1
+        else:
+            depth -= 1
+            pos += 1
+            if depth == 0:
+                break
+            out.append(c)
+    return ''.join(out), pos
+
+
+def parse_dict(buf, pos, depth):
+    attrs = {}
+    while True:
+        pos = RE_SPACE.match(buf, pos).end()
+        if pos >= len(buf):
+            raise PdfError('unterminated dictionary')
+        if buf[pos:pos + 2] == '>>':
+            return attrs, pos + 2
+        (key, pos) = parse_object(buf, pos, depth + 1)
+        (value, pos) = parse_object(buf, pos, depth + 1)
+        if isinstance(key, PdfName):
+            attrs[str(key)] = value
+
+
+class CMap:
+    """The ToUnicode CMap of a font: character codes to unicode."""
+
+    def __init__(self, data):
+        self.codes = {}
+        self.sizes = set()
+        for block in RE_BFCHAR.findall(data):
+            tokens = [t for t in RE_CMAP_TOKEN.findall(block)]
+            for i in range(0, len(tokens) - 1, 2):
+                self.add(tokens[i], tokens[i + 1])
+        for block in RE_BFRANGE.findall(data):
+            self.add_ranges(block)
+
+    def hex_bytes(self, token):
+        return binascii.unhexlify(re.sub(r'\s', '', token))
+
+    def to_unicode(self, token):
+        return self.hex_bytes(token).decode('utf-16-be', 'replace')
+
+    def add(self, src, dst):
+        code = self.hex_bytes(src)
+        if len(code) > 0:
+            self.codes[code] = self.to_unicode(dst)
+            self.sizes.add(len(code))
+
+    def add_ranges(self, block):
+        tokens = []
+        array = None
+        for match in RE_CMAP_TOKEN.finditer(block):
+            token = match.group()
+            if token == '[':
+                array = []
+            elif token == ']':
+                tokens.append(array)
+                array = None
+            elif array is not None:
+                array.append(match.group(1))
+            else:
+                tokens.append(match.group(1))
+        for i in range(0, len(tokens) - 2, 3):
+            (lo, hi, dst) = tokens[i:i + 3]
+            if isinstance(lo, list) or isinstance(hi, list):
+                continue
+            lo = self.hex_bytes(lo)
+            hi = self.hex_bytes(hi)
+            if len(lo) == 0 or len(lo) != len(hi):
+                continue
+            size = len(lo)
+            first = int(binascii.hexlify(lo), 16)
+            last = int(binascii.hexlify(hi), 16)
+            if last - first > 65535:
+                continue
+            self.sizes.add(size)
+            if isinstance(dst, list):
+                for (j, item) in enumerate(dst[:last - first + 1]):
+                    self.codes[self.pack(first + j, size)] = self.to_unicode(item)
+            else:
+                base = self.hex_bytes(dst)
+                if len(base) == 0:
+                    continue
+                value = int(binascii.hexlify(base), 16)
+                for j in range(last - first + 1):
+                    self.codes[self.pack(first + j, size)] = self.pack(value + j, len(base)).decode('utf-16-be',
+                                                                                                 'replace')
+
+    def pack(self, value, size):
+        return binascii.unhexlify('%0*x' % (size * 2, value % (256 ** size)))
+
+    def decode(self, data):
+        sizes = sorted(self.sizes, reverse=True) or [1]
+        out = []
+        pos = 0
+        while pos < len(data):
+            for size in sizes:
+                code = data[pos:pos + size]
+                if code in self.codes:
+                    out.append(self.codes[code])
+                    pos += size
+                    break
+            else:
+                out.append(u'�')
+                pos += sizes[-1]
+        return u''.join(out)
+
+
+class PdfFont:
+    """Turns the strings shown with one font into unicode."""
+
+    def __init__(self, document, attrs):
+        self.cmap = None
+        self.differences = {}
+        self.composite = attrs.get('Subtype') == 'Type0'
+        tounicode = document.resolve(attrs.get('ToUnicode'))
+        if isinstance(tounicode, PdfStream):
+            try:
+                self.cmap = CMap(document.decode_stream(tounicode))
+            except (PdfError, zlib.error, ValueError, TypeError):
+                self.cmap = None
+        encoding = document.resolve(attrs.get('Encoding'))
+        if isinstance(encoding, dict):
+            code = 0
+            for item in document.resolve(encoding.get('Differences')) or []:
+                if isinstance(item, int):
+                    code = item
+                elif isinstance(item, PdfName):
+                    name = str(item)
+                    self.differences[chr(code % 256)] = GLYPHS.get(name, name if len(name) == 1 else u'�')
+                    code += 1
+
+    def decode(self, data):
+        if self.composite:
+            # two-byte codes without a ToUnicode CMap can not be read
+            return self.cmap.decode(data) if self.cmap is not None else u''
+        if self.cmap is None and not self.differences:
+            return data.decode('latin-1')
+        # one byte per code; the codes the CMap does not map keep the encoding of the font
+        out = []
+        for c in data:
+            if self.cmap is not None and c in self.cmap.codes:
+                out.append(self.cmap.codes[c])
+            else:
+                out.append(self.differences.get(c, c.decode('latin-1')))
+        return u''.join(out)
+
+
+class PdfDocument:
+    """Reads the text of some pages of a PDF without Tika.
+
+    The file is memory-mapped; only the cross-reference data, the page tree and the content
+    streams of the requested pages are parsed. Encrypted files and filters other than Flate,
+    ASCIIHex and ASCII85 raise PdfError. The text is good enough to find ISBNs, not for reading:
+    lines follow the text positioning operators.
+    """
+    MAX_STREAM_SIZE = 64 * 1024 * 1024  # of a decoded stream
+    MAX_XOBJECT_DEPTH = 3
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'rb')
+        try:
+            self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error, EnvironmentError) as ex:
+            self.file.close()
+            raise PdfError('can not map the file: ' + str(ex))
+        self.offsets = {}  # object number -> offset, or (object stream number, index)
+        self.objects = {}
+        self.object_streams = {}
+        self.fonts = {}
+        self.trailer = {}
+        try:
+            self.read_xref()
+        except (PdfError, IndexError, ValueError, TypeError, zlib.error) as ex:
+            logger.debug('Broken cross-reference of "' + filename + '": ' + str(ex))
+            self.rebuild_xref()
+        if 'Encrypt' in self.trailer:
+            self.close()
+            raise PdfError('encrypted')
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+    def read_xref(self):
+        start = self.buf.rfind('startxref', max(0, len(self.buf) - 4096))
+        if start < 0:
+            raise PdfError('no startxref')
+        (offset, end) = parse_object(self.buf, start + len('startxref'))
+        seen = set()
+        while isinstance(offset, int) and offset not in seen:
+            seen.add(offset)
+            pos = RE_SPACE.match(self.buf, offset).end()
+            if self.buf[pos:pos + 4] == 'xref':
+                trailer = self.read_xref_table(pos + 4)
+                if isinstance(trailer.get('XRefStm'), int):
+                    self.read_xref_stream(trailer['XRefStm'])
+            else:
+                trailer = self.read_xref_stream(offset)
+            for key in trailer:
+                self.trailer.setdefault(key, trailer[key])
+            offset = trailer.get('Prev')
+        if 'Root' not in self.trailer:
+            raise PdfError('no Root')
+
+    def read_xref_table(self, pos):
+        while True:
+            pos = RE_SPACE.match(self.buf, pos).end()
+            if self.buf[pos:pos + 7] == 'trailer':
+                return parse_object(self.buf, pos + 7)[0]
+            (first, pos) = parse_object(self.buf, pos)
+            (count, pos) = parse_object(self.buf, pos)
+            if not isinstance(first, int) or not isinstance(count, int):
+                raise PdfError('bad xref subsection')
+            for num in range(first, first + count):
+                pos = RE_SPACE.match(self.buf, pos).end()
+                entry = RE_XREF_ENTRY.match(self.buf, pos)
+                if not entry:
+                    raise PdfError('bad xref entry')
+                pos = entry.end()
+                if entry.group(3) == 'n' and num not in self.offsets:
+                    self.offsets[num] = int(entry.group(1))
+
+    def read_xref_stream(self, offset):
+        stream = self.parse_indirect(offset)
+        if not isinstance(stream, PdfStream) or stream.get('Type') != 'XRef':
+            raise PdfError('bad xref stream')
+        data = self.decode_stream(stream)
+        widths = stream.get('W')
+        size = stream.get('Size', 0)
+        index = stream.get('Index') or [0, size]
+        if not isinstance(widths, list) or len(widths) != 3:
+            raise PdfError('bad xref stream widths')
+        row = sum(widths)
+        pos = 0
+        for i in range(0, len(index) - 1, 2):
+            for num in range(index[i], index[i] + index[i + 1]):
+                if pos + row > len(data):
+                    break
+                fields = []
+                for width in widths:
+                    value = 0
+                    for c in data[pos:pos + width]:
+                        value = value * 256 + ord(c)
+                    fields.append(value)
+                    pos += width
+                kind = fields[0] if widths[0] > 0 else 1
+                if num in self.offsets:
+                    continue
+                if kind == 1:
+                    self.offsets[num] = fields[1]
+                elif kind == 2:
+                    self.offsets[num] = (fields[1], fields[2])
+        return stream.attrs
+
+    def rebuild_xref(self):
+        # scan the whole file for "n g obj"; the later definitions win as in an update
+        self.offsets = {}
+        for match in RE_OBJ.finditer(self.buf):
+            self.offsets[int(match.group(1))] = match.start()
+        for (num, offset) in list(self.offsets.items()):
+            if self.buf.find('/ObjStm', offset, offset + 256) >= 0:
+                try:
+                    self.register_object_stream(num)
+                except (PdfError, IndexError, ValueError, TypeError, zlib.error):
+                    pass
+        trailer = {}
+        pos = self.buf.find('trailer')
+        while pos >= 0:
+            try:
+                trailer.update(parse_object(self.buf, pos + 7)[0])
+            except (PdfError, IndexError, ValueError):
+                pass
+            pos = self.buf.find('trailer', pos + 7)
+        if 'Root' not in trailer:
+            for num in sorted(self.offsets):
+                try:
+                    obj = self.get_object(num)
+                except (PdfError, IndexError, ValueError, zlib.error):
+                    continue
+                attrs = obj.attrs if isinstance(obj, PdfStream) else obj
+                if isinstance(attrs, dict) and attrs.get('Type') == 'XRef' and 'Root' in attrs:
+                    trailer.update(attrs)
+                elif isinstance(attrs, dict) and attrs.get('Type') == 'Catalog':
+                    trailer['Root'] = PdfRef(num, 0)
+                if 'Root' in trailer:
+                    break
+        if 'Root' not in trailer:
+            raise PdfError('no Root')
+        self.trailer = trailer
+
+    def parse_indirect(self, offset):
+        match = RE_OBJ.match(self.buf, RE_SPACE.match(self.buf, offset).end())
+        if not match:
+            raise PdfError('no object at ' + str(offset))
+        (obj, pos) = parse_object(self.buf, match.end())
+        if isinstance(obj, dict):
+            stream = RE_STREAM.match(self.buf, pos)
+            if stream:
+                return PdfStream(obj, self.read_stream_data(obj, stream.end()))
+        return obj
+
+    def read_stream_data(self, attrs, start):
+        length = attrs.get('Length')
+        if isinstance(length, PdfRef):
+            try:
+                length = self.resolve(length)
+            except (PdfError, IndexError, ValueError):
+                length = None
+        if isinstance(length, int) and 0 <= length and self.buf[start + length:start + length + 20].lstrip(
+                SPACE).startswith('endstream'):
+            return self.buf[start:start + length]
+        end = self.buf.find('endstream', start)
+        if end < 0:
+            raise PdfError('unterminated stream')
+        data = self.buf[start:end]
+        if data.endswith('\r\n'):
+            return data[:-2]
+        return data.rstrip('\r\n')
+
+    def get_object(self, num):
+        if num in self.objects:
+            return self.objects[num]
+        location = self.offsets.get(num)
+        self.objects[num] = None  # a reference to itself resolves to null
+        if location is None:
+            obj = None
+        elif isinstance(location, tuple):
+            obj = self.get_compressed_object(num, location[0], location[1])
+        else:
+            obj = self.parse_indirect(location)
+        self.objects[num] = obj
+        return obj
+
+    def load_object_stream(self, stream_num):
+        if stream_num not in self.object_streams:
+            stream = self.get_object(stream_num)
+            if not isinstance(stream, PdfStream):
+                raise PdfError('bad object stream')
+            data = self.decode_stream(stream)
+            first = stream.get('First', 0)
+            pos = 0
+            numbers = []
+            for i in range(stream.get('N', 0)):
+                (n, pos) = parse_object(data, pos)
+                (offset, pos) = parse_object(data, pos)
+                numbers.append((n, first + offset))
+            self.object_streams[stream_num] = (data, numbers)
+        return self.object_streams[stream_num]
+
+    def register_object_stream(self, stream_num):
+        # the objects of a stream found by rebuild_xref, unless defined outside of it
+        (data, numbers) = self.load_object_stream(stream_num)
+        for (index, (num, offset)) in enumerate(numbers):
+            self.offsets.setdefault(num, (stream_num, index))
+
+    def get_compressed_object(self, num, stream_num, index):
+        (data, numbers) = self.load_object_stream(stream_num)
+        for (n, offset) in numbers:
+            if n == num:
+                return parse_object(data, offset)[0]
+        if index < len(numbers):
+            return parse_object(data, numbers[index][1])[0]
+        return None
+
+    def resolve(self, obj):
+        count = 0
+        while isinstance(obj, PdfRef):
+            obj = self.get_object(obj.num)
+            count += 1
+            if count > 32:
+                raise PdfError('reference loop')
+        return obj
+
+    def decode_stream(self, stream):
+        data = stream.data
+        filters = self.resolve(stream.get('Filter'))
+        params = self.resolve(stream.get('DecodeParms'))
+        if not isinstance(filters, list):
+            filters = [filters] if filters is not None else []
+        if not isinstance(params, list):
+            params = [params] * len(filters)
+        for (i, name) in enumerate(filters):
+            param = self.resolve(params[i]) if i < len(params) else None
+            if name in ('FlateDecode', 'Fl'):
+                data = self.inflate(data)
+                if isinstance(param, dict) and param.get('Predictor', 1) >= 10:
+                    data = self.unpredict(data, param.get('Columns', 1), param.get('Colors', 1),
+                                          param.get('BitsPerComponent', 8))
+            elif name in ('ASCIIHexDecode', 'AHx'):
+                digits = re.sub(r'[^0-9A-Fa-f]', '', data.split('>')[0])
+                data = binascii.unhexlify(digits + ('0' if len(digits) % 2 else ''))
+            elif name in ('ASCII85Decode', 'A85'):
+                data = self.ascii85(data)
+            else:
+                raise PdfError('filter ' + str(name))
+        return data
+
+    def inflate(self, data):
+        decompressor = zlib.decompressobj()
+        try:
+            out = decompressor.decompress(data, self.MAX_STREAM_SIZE)
+        except zlib.error:
+            # a truncated or damaged stream, keep what can be inflated
+            decompressor = zlib.decompressobj()
+            out = []
+            for i in range(0, len(data), 1024):
+                try:
+                    out.append(decompressor.decompress(data[i:i + 1024]))
+                except zlib.error:
+                    break
+            out = ''.join(out)
+        return out[:self.MAX_STREAM_SIZE]
+
+    def unpredict(self, data, columns, colors, bits):
+        # PNG predictors, row by row
+        width = max(1, colors * bits // 8)
+        row = (columns * colors * bits + 7) // 8
+        out = []
+        previous = [0] * row
+        for pos in range(0, len(data) - row, row + 1):
+            kind = ord(data[pos])
+            current = [ord(c) for c in data[pos + 1:pos + 1 + row]]
+            for i in range(len(current)):
+                left = current[i - width] if i >= width else 0
+                up = previous[i]
+                if kind == 1:
+                    current[i] = (current[i] + left) % 256
+                elif kind == 2:
+                    current[i] = (current[i] + up) % 256
+                elif kind == 3:
+                    current[i] = (current[i] + (left + up) // 2) % 256
+                elif kind == 4:
+                    upleft = previous[i - width] if i >= width else 0
+                    p = left + up - upleft
+                    (pa, pb, pc) = (abs(p - left), abs(p - up), abs(p - upleft))
+                    predictor = left if pa <= pb and pa <= pc else (up if pb <= pc else upleft)
+                    current[i] = (current[i] + predictor) % 256
+            out.append(struct.pack('%dB' % len(current), *current))
+            previous = current
+        return ''.join(out)
+
+    def ascii85(self, data):
+        data = re.sub(r'\s', '', data)
+        if data.startswith('<~'):
+            data = data[2:]
+        data = data.split('~>')[0]
+        out = []
+        group = []
+        for c in data:
+            if c == 'z' and len(group) == 0:
+                out.append('\x00' * 4)
+                continue
+            group.append(ord(c) - 33)
+            if len(group) == 5:
+                value = 0
+                for digit in group:
+                    value = value * 85 + digit
+                out.append(struct.pack('>I', value & 0xffffffff))
+                group = []
+        if len(group) > 1:
+            count = len(group) - 1
+            group += [84] * (5 - len(group))
+            value = 0
+            for digit in group:
+                value = value * 85 + digit
+            out.append(struct.pack('>I', value & 0xffffffff)[:count])
+        return ''.join(out)
+
+    def get_pages(self, wanted=None):
+        """Return [(page index, page dict, resources)] of the wanted page indexes, all pages if
+        wanted is None. Subtrees with a /Count outside the wanted pages are not visited."""
+        root = self.resolve(self.trailer.get('Root'))
+        if not isinstance(root, dict):
+            raise PdfError('bad Root')
+        pages = []
+        self.collect_pages(self.resolve(root.get('Pages')), 0, wanted, None, pages, set())
+        return pages
+
+    def collect_pages(self, node, start, wanted, resources, pages, seen):
+        # return the number of pages under node
+        if not isinstance(node, dict) or id(node) in seen or len(seen) > 100000:
+            return 0
+        seen.add(id(node))
+        if 'Resources' in node:
+            resources = self.resolve(node['Resources'])
+        kids = self.resolve(node.get('Kids'))
+        if not isinstance(kids, list) or node.get('Type') == 'Page':
+            if wanted is None or start in wanted:
+                pages.append((start, node, resources))
+            return 1
+        count = node.get('Count')
+        if wanted is not None and isinstance(count, int) and count >= 0:
+            if not any(start <= i < start + count for i in wanted):
+                return count
+        total = 0
+        for kid in kids:
+            total += self.collect_pages(self.resolve(kid), start + total, wanted, resources, pages, seen)
+        return total
+
+    def get_page_count(self):
+        root = self.resolve(self.trailer.get('Root'))
+        pages = self.resolve(root.get('Pages')) if isinstance(root, dict) else None
+        count = pages.get('Count') if isinstance(pages, dict) else None
+        if isinstance(count, int) and count >= 0:
+            return count
+        return len(self.get_pages())
+
+    def iter_page_texts(self, first, last):
+        """Yield (page index, text) of the first and the last pages, in page order."""
+        count = self.get_page_count()
+        wanted = set(range(min(first, count))) | set(range(max(0, count - last), count))
+        for (index, page, resources) in self.get_pages(wanted):
+            try:
+                yield index, self.get_page_text(page, resources)
+            except (PdfError, IndexError, ValueError, TypeError, zlib.error) as ex:
+                logger.debug('Can not read page ' + str(index + 1) + ' of "' + self.filename + '": ' + str(ex))
+
+    def get_contents(self, page):
+        contents = self.resolve(page.get('Contents'))
+        if not isinstance(contents, list):
+            contents = [contents]
+        data = []
+        for stream in contents:
+            stream = self.resolve(stream)
+            if isinstance(stream, PdfStream):
+                data.append(self.decode_stream(stream))
+        return '\n'.join(data)
+
+    def get_font(self, fonts, name):
+        ref = fonts.get(name) if isinstance(fonts, dict) else None
+        key = ref.num if isinstance(ref, PdfRef) else id(ref)
+        if key not in self.fonts:
+            attrs = self.resolve(ref)
+            self.fonts[key] = PdfFont(self, attrs) if isinstance(attrs, dict) else None
+        return self.fonts[key]
+
+    def get_page_text(self, page, resources):
+        out = []
+        self.show_contents(self.get_contents(page), self.resolve(page.get('Resources', resources)), out, 0)
+        text = u''.join(out)
+        return re.sub(r'[ \t]*\n[\n \t]*', '\n', text).encode('utf-8')
+
+    def show_contents(self, data, resources, out, depth):
+        resources = resources if isinstance(resources, dict) else {}
+        fonts = self.resolve(resources.get('Font'))
+        font = None
+        operands = []
+        last_y = None
+        pos = 0
+        while True:
+            pos = RE_SPACE.match(data, pos).end()
+            if pos >= len(data):
+                break
+            (obj, pos) = parse_object(data, pos)
+            if not isinstance(obj, PdfOperator):
+                operands.append(obj)
+                continue
+            if obj == 'Tf' and len(operands) >= 2:
+                font = self.get_font(fonts, operands[-2])
+            elif obj in ('Tj', "'", '"') and len(operands) > 0:
+                if obj != 'Tj':
+                    out.append(u'\n')
+                out.append(self.show_string(font, operands[-1]))
+            elif obj == 'TJ' and len(operands) > 0 and isinstance(operands[-1], list):
+                for item in operands[-1]:
+                    if isinstance(item, (int, float)):
+                        if item < -200:
+                            out.append(u' ')
+                    else:
+                        out.append(self.show_string(font, item))
+            elif obj in ('Td', 'TD') and len(operands) >= 2:
+                out.append(u'\n' if operands[-1] != 0 else u' ')
+            elif obj == 'Tm' and len(operands) >= 6:
+                out.append(u'\n' if operands[-1] != last_y else u' ')
+                last_y = operands[-1]
+            elif obj in ('T*', 'ET'):
+                out.append(u'\n')
+            elif obj == 'BI':
+                # skip the data of an inline image
+                start = data.find('ID', pos)
+                end = RE_INLINE_END.search(data, start + 2) if start >= 0 else None
+                pos = end.end() if end else len(data)
+            elif obj == 'Do' and len(operands) > 0 and depth < self.MAX_XOBJECT_DEPTH:
+                xobjects = self.resolve(resources.get('XObject'))
+                xobject = self.resolve(xobjects.get(operands[-1])) if isinstance(xobjects, dict) else None
+                if isinstance(xobject, PdfStream) and xobject.get('Subtype') == 'Form':
+                    out.append(u'\n')
+                    self.show_contents(self.decode_stream(xobject),
+                                       self.resolve(xobject.get('Resources', resources)), out, depth + 1)
+            operands = []
+
+    def show_string(self, font, data):
+        if not isinstance(data, str) or isinstance(data, PdfName):
+            return u''
+        if font is None:
+            return data.decode('latin-1')
+        return font.decode(data)
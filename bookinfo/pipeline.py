@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
+
+from lookup import RetryQueue
+from manifest import Manifest
+from metasearch import BookMeta
+from metrics import Metrics
+from tikaserver import Tika
+
+logger = logging.getLogger(__name__)
+
+# the Tika and the manifest connection of the current worker process, see init_worker
+worker_tika = None
+worker_manifest = None
+
+
+def init_worker(manifest_path=None):
+    global worker_tika, worker_manifest
+    worker_tika = Tika()
+    # pool workers leave through os._exit, so atexit would not stop the Tika servers
+    multiprocessing.util.Finalize(worker_tika, worker_tika.close, exitpriority=10)
+    if manifest_path is not None:
+        worker_manifest = Manifest(manifest_path)
+        multiprocessing.util.Finalize(worker_manifest, worker_manifest.close, exitpriority=10)
+
+
+def detect_book(filename, limits=None):
+    """Extract the texts of a book and find its ISBNs in a worker process. Return the state
+    set by BookMeta.detect, with the hash and the metadata known by the manifest, and the
+    metrics recorded meanwhile."""
+    metrics = Metrics()
+    bookmeta = BookMeta(filename, None, tika=worker_tika, manifest=worker_manifest, metrics=metrics, limits=limits)
+    bookmeta.detect()
+    return (bookmeta.get_detected_state(), bookmeta.digest, bookmeta.known_meta,
+            metrics.get_record(filename))
+
+
+class PendingBook:
+    def __init__(self, bookmeta, detecting):
+        self.bookmeta = bookmeta
+        self.detecting = detecting
+        self.looking_up = None
+
+
+class RenamePipeline:
+    """Renames books in three stages.
+
+    Extraction and ISBN detection run in a pool of jobs processes, each with its own Tika. The
+    metadata lookups of several books run on lookup_threads threads, which share the rate limits
+    of the LookupScheduler. The calling thread alone renames the books and writes the recorder,
+    in the order the books were given, so that log lines and TSIXE-NUM collisions do not depend
+    on timing. At most MAX_PENDING_PER_JOB books per job (plus one per lookup thread) are in
+    flight at once.
+    """
+    MAX_PENDING_PER_JOB = 4
+    LOOKUP_THREADS = 8
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, jobs, recorder, isbndb='goob', pattern='default', cache=None, scheduler=None,
+                 manifest=None, lookup_threads=LOOKUP_THREADS, metrics=None, journal=None, limits=None):
+        self.jobs = jobs
+        self.recorder = recorder
+        self.isbndb = isbndb
+        self.pattern = pattern
+        self.cache = cache
+        self.scheduler = scheduler
+        self.manifest = manifest
+        self.metrics = metrics
+        self.journal = journal
+        self.limits = limits
+        self.max_pending = jobs * self.MAX_PENDING_PER_JOB + lookup_threads
+        self.pool = multiprocessing.Pool(jobs, init_worker, (manifest.path if manifest is not None else None,))
+        self.lookup_pool = multiprocessing.pool.ThreadPool(lookup_threads)
+        self.retry_queue = RetryQueue(scheduler)
+        self.pending = collections.deque()
+
+    def start_lookups(self):
+        # hand the books whose detection is done over to the lookup threads
+        for book in self.pending:
+            if book.looking_up is None and book.detecting.ready():
+                self.start_lookup(book)
+
+    def start_lookup(self, book):
+        try:
+            (state, book.bookmeta.digest, book.bookmeta.known_meta, record) = book.detecting.get()
+        except Exception:
+            logger.exception('Can not process "' + book.bookmeta.filename + '"')
+            book.looking_up = False
+            book.bookmeta.metrics.finish(book.bookmeta.filename, None)
+            return
+        book.bookmeta.metrics.merge(book.bookmeta.filename, record)
+        book.bookmeta.set_detected_state(state)
+        book.looking_up = self.lookup_pool.apply_async(book.bookmeta.get_mata)
+
+    def wait_for(self, result):
+        # keep the lookup threads busy while the oldest book is not done
+        while not result.ready():
+            self.start_lookups()
+            result.wait(self.POLL_INTERVAL)
+
+    def finish_oldest(self):
+        book = self.pending[0]
+        self.wait_for(book.detecting)
+        if book.looking_up is None:
+            self.start_lookup(book)
+        if book.looking_up is not False:
+            self.wait_for(book.looking_up)
+        self.pending.popleft()
+        if book.looking_up is False:
+            return
+        try:
+            meta = book.looking_up.get()
+        except Exception:
+            logger.exception('Can not look up "' + book.bookmeta.filename + '"')
+            book.bookmeta.metrics.finish(book.bookmeta.filename, None)
+            return
+        if not book.bookmeta.rename_with(meta, final=False):
+            self.retry_queue.add(book.bookmeta)
+        self.retry_queue.drain()
+
+    def run(self, filenames, copies=None):
+        for filename in filenames:
+            while len(self.pending) >= self.max_pending:
+                self.finish_oldest()
+            logger.debug('Processing ' + filename)
+            bookmeta = BookMeta(filename, self.recorder, self.isbndb, self.pattern, cache=self.cache,
+                                scheduler=self.scheduler, manifest=self.manifest, metrics=self.metrics,
+                                journal=self.journal, limits=self.limits)
+            if copies is not None:
+                bookmeta.copies = copies.get(filename, [])
+            self.pending.append(PendingBook(bookmeta, self.pool.apply_async(detect_book, (filename, self.limits))))
+            self.start_lookups()
+        while len(self.pending) > 0:
+            self.finish_oldest()
+        self.retry_queue.finish()
+
+    def close(self):
+        if len(self.pending) > 0:
+            # the run was interrupted, the queued books are dropped
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+        self.lookup_pool.close()
+        self.lookup_pool.join()
@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+
+import isbnlib
+
+from metacache import MetaCache
+from metalookup import MetaLookup, get_providers
+from metasearch import BookMeta
+
+logger = logging.getLogger(__name__)
+
+
+def iter_isbns(lines):
+    """Yield (line, isbn) for each non-empty line, isbn being the canonical ISBN or None when
+    the line holds no valid ISBN. An ISBN seen before, in either form, is skipped."""
+    seen = set()
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        isbn = isbnlib.get_canonical_isbn(line)
+        if not isbn:
+            yield line, None
+            continue
+        isbn13 = isbnlib.to_isbn13(isbn)
+        if isbn13 in seen:
+            continue
+        seen.add(isbn13)
+        yield line, isbn
+
+
+class IsbnResolver:
+    """Looks up the metadata of a stream of ISBNs, without any book file.
+
+    The ISBNs are looked up BATCH_SIZE at a time on the LookupScheduler, within its rate limits,
+    each on the providers in turn through the MetaLookup and the cache BookMeta uses.
+    The metadata is normalised as for renaming. An ISBN deferred by an open circuit breaker is
+    looked up again at the end, up to MAX_ATTEMPTS times.
+    """
+    BATCH_SIZE = 100
+    MAX_ATTEMPTS = 4
+    OUTCOME_INVALID = 'invalid'  # the line holds no valid ISBN
+
+    def __init__(self, scheduler, providers='goob', cache=None, batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+        self.scheduler = scheduler
+        self.lookup = MetaLookup(get_providers(providers), cache, scheduler)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+
+    def resolve_batch(self, isbns):
+        """Return {isbn: (meta, outcome, provider)} of a list of distinct ISBNs."""
+        hedged = self.lookup.get_hedged_lookup()
+        outcomes = {}
+        answers = {}
+        for pending in hedged.iter_answers(isbns):
+            try:
+                (meta, outcome) = pending.wait()
+            except Exception:
+                (meta, outcome) = ({}, MetaCache.OUTCOME_ERROR)
+            outcomes.setdefault(pending.key, []).append(outcome)
+            if len(meta) > 0:
+                answers[pending.key] = (meta, pending.provider)
+        results = {}
+        for isbn in isbns:
+            if isbn in answers:
+                (meta, provider) = answers[isbn]
+                results[isbn] = (meta, MetaCache.OUTCOME_HIT, provider)
+            else:
+                outcome = self.lookup.get_best_outcome(outcomes.get(isbn, [MetaCache.OUTCOME_ERROR]))
+                results[isbn] = ({}, outcome, None)
+        return results
+
+    def make_record(self, line, isbn, meta, outcome, provider):
+        record = {'input': line, 'isbn': isbn, 'outcome': outcome}
+        if isbn is not None:
+            record['isbn13'] = isbnlib.to_isbn13(isbn)
+        if len(meta) > 0:
+            record['provider'] = provider
+            record['meta'] = BookMeta.merge_meta(self.lookup.normalize_meta(meta), {})
+            record['authors'] = meta.get('Authors', [])
+        return record
+
+    def iter_batch_records(self, batch, deferred):
+        results = self.resolve_batch([isbn for (line, isbn) in batch])
+        for (line, isbn) in batch:
+            (meta, outcome, provider) = results[isbn]
+            if outcome == MetaLookup.OUTCOME_DEFERRED:
+                deferred.append((line, isbn))
+            else:
+                yield self.make_record(line, isbn, meta, outcome, provider)
+
+    def wait_for_providers(self):
+        wait = max(self.scheduler.get_breaker(provider).retry_in() for provider in self.lookup.providers)
+        if wait > 0:
+            logger.debug('Providers not available, next lookups in %.0f s' % wait)
+            time.sleep(wait)
+
+    def iter_records(self, lines):
+        """Yield a dict for each line: the input line, the canonical ISBN and its ISBN-13, the
+        outcome, and on a hit the provider, the normalised metadata and all the authors. The
+        records of a batch come in the order of the lines; deferred ISBNs come last."""
+        batch = []
+        deferred = []
+        for (line, isbn) in iter_isbns(lines):
+            if isbn is None:
+                yield {'input': line, 'isbn': None, 'outcome': self.OUTCOME_INVALID}
+                continue
+            batch.append((line, isbn))
+            if len(batch) >= self.batch_size:
+                for record in self.iter_batch_records(batch, deferred):
+                    yield record
+                batch = []
+        if len(batch) > 0:
+            for record in self.iter_batch_records(batch, deferred):
+                yield record
+        for attempt in range(self.max_attempts):
+            if len(deferred) == 0:
+                break
+            self.wait_for_providers()
+            retries = deferred
+            deferred = []
+            for start in range(0, len(retries), self.batch_size):
+                for record in self.iter_batch_records(retries[start:start + self.batch_size], deferred):
+                    yield record
+        for (line, isbn) in deferred:
+            yield self.make_record(line, isbn, {}, MetaLookup.OUTCOME_DEFERRED, None)
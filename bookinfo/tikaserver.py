@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import socket
+import subprocess
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_BLOCK_SIZE = 1024 * 1024
+
+
+class TikaError(Exception):
+    pass
+
+
+def iter_blocks(read, size=65536):
+    """Yield the data returned by read(size), cut after the last line break so that every block
+    holds whole lines. A block without any line break is cut anyway at MAX_BLOCK_SIZE."""
+    rest = ''
+    while True:
+        data = read(size)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind('\n') + 1
+        if end == 0:
+            if len(data) < MAX_BLOCK_SIZE:
+                rest = data
+                continue
+            end = len(data)
+        rest = data[end:]
+        yield data[:end]
+    if rest:
+        yield rest
+
+
+class TikaServer:
+    """A long-lived tika-app process started with "--server" for one set of output options.
+
+    Every connection is one document: the file is written to the socket, the write side is
+    shut down and Tika answers with the extracted texts before closing the connection.
+    """
+    HOST = '127.0.0.1'
+    START_TIMEOUT = 60
+    READ_TIMEOUT = 120
+    BUFFER_SIZE = 65536
+
+    def __init__(self, args, jar, java='java'):
+        self.args = args
+        self.jar = jar
+        self.java = java
+        self.port = None
+        self.process = None
+
+    def get_free_port(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.bind((self.HOST, 0))
+            return sock.getsockname()[1]
+        finally:
+            sock.close()
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        port = self.get_free_port()
+        cmd = [self.java, '-jar', self.jar, '-eUTF-8'] + self.args.split() + ['--server', str(port)]
+        logger.debug('Starting Tika server: ' + ' '.join(cmd))
+        devnull = open(os.devnull, 'r+')
+        try:
+            self.process = subprocess.Popen(cmd, stdin=devnull, stdout=devnull, stderr=devnull)
+        except OSError:
+            logger.error('Can not start Tika server')
+            return False
+        finally:
+            devnull.close()
+        deadline = time.time() + self.START_TIMEOUT
+        while time.time() < deadline:
+            if not self.is_alive():
+                break
+            try:
+                socket.create_connection((self.HOST, port), 1).close()
+            except socket.error:
+                time.sleep(0.2)
+            else:
+                self.port = port
+                logger.debug('Tika server is listening on port ' + str(port))
+                return True
+        logger.error('Tika server did not start on port ' + str(port))
+        self.stop()
+        return False
+
+    def stop(self):
+        if self.is_alive():
+            try:
+                self.process.kill()
+                self.process.wait()
+            except OSError:
+                pass
+        self.process = None
+        self.port = None
+
+    def connect(self, filename):
+        sock = socket.create_connection((self.HOST, self.port), self.READ_TIMEOUT)
+        try:
+            f = open(filename, 'rb')
+            try:
+                while True:
+                    data = f.read(self.BUFFER_SIZE)
+                    if not data:
+                        break
+                    sock.sendall(data)
+            finally:
+                f.close()
+            sock.shutdown(socket.SHUT_WR)
+        except:
+            sock.close()
+            raise
+        return sock
+
+
+class Tika:
+    """Keeps one TikaServer per option set alive for a whole run.
+
+    iter_texts() returns None whenever the server mode can not be used, and its generator
+    raises TikaError when the server fails in the middle of a file, so that the caller can fall
+    back to a one-off "java -jar" call. A server which crashes or hangs is killed and
+    started again for the next file; after MAX_START_FAILURE failed starts in a row the
+    server mode is given up for that option set.
+    """
+    MAX_START_FAILURE = 3
+
+    def __init__(self, jar='tika-app-1.8.jar', java='java'):
+        self.jar = jar
+        self.java = java
+        self.servers = {}
+        self.start_failures = {}
+
+    def get_server(self, args):
+        server = self.servers.get(args)
+        if server is not None and server.is_alive():
+            return server
+        if server is not None:
+            logger.error('Tika server for "' + args + '" has died, restarting it')
+            server.stop()
+        if self.start_failures.get(args, 0) >= self.MAX_START_FAILURE:
+            return None
+        server = TikaServer(args, self.jar, self.java)
+        if server.start():
+            self.servers[args] = server
+            self.start_failures[args] = 0
+            return server
+        self.servers.pop(args, None)
+        self.start_failures[args] = self.start_failures.get(args, 0) + 1
+        return None
+
+    def discard_server(self, args):
+        server = self.servers.pop(args, None)
+        if server is not None:
+            server.stop()
+
+    def iter_texts(self, filename, args, deadline=None):
+        """Return a generator over the texts Tika writes for filename in blocks of whole lines,
+        or None when the server mode can not be used. Past the deadline, the server is treated
+        as hanging."""
+        server = self.get_server(args)
+        if server is None:
+            return None
+        try:
+            sock = server.connect(filename)
+        except socket.error:
+            logger.error('Tika server failed on "' + filename + '", restarting it')
+            self.discard_server(args)
+            return None
+        except IOError:
+            logger.error('Can not read "' + filename + '"')
+            return None
+        return self.read_texts(sock, server, filename, args, deadline)
+
+    def recv(self, sock, size, deadline=None):
+        if deadline is not None:
+            sock.settimeout(max(min(TikaServer.READ_TIMEOUT, deadline - time.time()), 0.01))
+        return sock.recv(size)
+
+    def read_texts(self, sock, server, filename, args, deadline=None):
+        # closing the generator early just drops the connection, the server keeps running
+        try:
+            for block in iter_blocks(lambda size: self.recv(sock, size, deadline), TikaServer.BUFFER_SIZE):
+                yield block
+        except socket.timeout:
+            self.fail(args, 'Tika server hangs on "' + filename + '"')
+        except socket.error:
+            self.fail(args, 'Tika server failed on "' + filename + '"')
+        finally:
+            sock.close()
+        if not server.is_alive():
+            # the texts may stop anywhere
+            self.fail(args, 'Tika server died on "' + filename + '"')
+
+    def fail(self, args, message):
+        logger.error(message + ', restarting it')
+        self.discard_server(args)
+        raise TikaError(message)
+
+    def close(self):
+        for args in list(self.servers):
+            self.discard_server(args)
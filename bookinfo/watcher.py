@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Inotify:
+    """Linux inotify through ctypes, watching a directory tree."""
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF
+    EVENT = struct.Struct('iIII')
+    BUFFER_SIZE = 64 * 1024
+
+    def __init__(self):
+        # raise OSError where there is no inotify, e.g. not on Linux
+        name = ctypes.util.find_library('c')
+        try:
+            self.libc = ctypes.CDLL(name, use_errno=True)
+            self.libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self.dirs = {}
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8') if isinstance(path, unicode) else path,
+                                         self.MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code) + ': ' + path)
+        self.dirs[wd] = path
+
+    def add_tree(self, path):
+        """Watch path and its subdirectories and return the files found in them."""
+        files = []
+        for root, dirs, names in os.walk(path):
+            try:
+                self.add_watch(root)
+            except OSError as ex:
+                logger.error('Can not watch "' + root + '": ' + str(ex))
+            files.extend(os.path.join(root, name) for name in names)
+        return files
+
+    def read_events(self, timeout):
+        """Return the (path, mask) of the events of the next timeout seconds."""
+        (readable, writable, errors) = select.select([self.fd], [], [], timeout)
+        if len(readable) == 0:
+            return []
+        try:
+            data = os.read(self.fd, self.BUFFER_SIZE)
+        except OSError as ex:
+            if ex.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        pos = 0
+        while pos + self.EVENT.size <= len(data):
+            (wd, mask, cookie, length) = self.EVENT.unpack_from(data, pos)
+            pos += self.EVENT.size
+            name = data[pos:pos + length].rstrip('\0')
+            pos += length
+            if mask & self.IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None and not mask & self.IN_Q_OVERFLOW:
+                continue
+            if isinstance(directory, unicode):
+                name = name.decode('utf-8', 'replace')
+            events.append((os.path.join(directory, name) if directory is not None else None, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DropFolderWatcher:
+    """Reports the new or modified files of a directory tree once they are no longer written.
+
+    Events come from inotify, or from a poll of the tree every poll_interval seconds where it is
+    not available. A file is ready when it had no event for debounce seconds and its size and
+    mtime did not change meanwhile. accept(filename) tells the files to watch, so that the files
+    renamed by the program itself are not reported again.
+    """
+    DEBOUNCE = 5
+    POLL_INTERVAL = 30
+    TICK = 1
+
+    def __init__(self, path, accept, debounce=DEBOUNCE, poll_interval=POLL_INTERVAL, use_inotify=True):
+        self.path = path
+        self.accept = accept
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.pending = {}
+        self.inotify = None
+        self.snapshot = None
+        self.next_poll = 0
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError as ex:
+                logger.error('Can not use inotify, polling "' + path + '" every ' + str(poll_interval) + ' s: ' +
+                             str(ex))
+        if self.inotify is not None:
+            self.inotify.add_tree(path)
+        else:
+            self.snapshot = self.take_snapshot()
+            self.next_poll = time.time() + poll_interval
+
+    def stat(self, filename):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime
+
+    def touch(self, filename):
+        if self.accept(filename):
+            self.pending[filename] = (time.time(), self.stat(filename))
+
+    def take_snapshot(self):
+        snapshot = {}
+        for root, dirs, names in os.walk(self.path):
+            for name in names:
+                filename = os.path.join(root, name)
+                if self.accept(filename):
+                    snapshot[filename] = self.stat(filename)
+        return snapshot
+
+    def poll(self):
+        snapshot = self.take_snapshot()
+        for (filename, stat) in snapshot.items():
+            if self.snapshot.get(filename) != stat:
+                self.touch(filename)
+        self.snapshot = snapshot
+
+    def handle(self, filename, mask):
+        if mask & Inotify.IN_Q_OVERFLOW:
+            # events were lost, every file may be new
+            logger.error('inotify queue overflow, rescanning "' + self.path + '"')
+            for root, dirs, names in os.walk(self.path):
+                for name in names:
+                    self.touch(os.path.join(root, name))
+        elif mask & Inotify.IN_ISDIR:
+            if mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO):
+                # files may be written into the directory before it is watched
+                for name in self.inotify.add_tree(filename):
+                    self.touch(name)
+        elif mask & (Inotify.IN_MODIFY | Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_CREATE):
+            self.touch(filename)
+
+    def wait_events(self, timeout):
+        if self.inotify is not None:
+            for (filename, mask) in self.inotify.read_events(timeout):
+                self.handle(filename, mask)
+        else:
+            time.sleep(max(min(timeout, self.next_poll - time.time()), 0))
+            if time.time() >= self.next_poll:
+                self.poll()
+                self.next_poll = time.time() + self.poll_interval
+
+    def get_ready(self):
+        """Return the files settled for debounce seconds, in the order of their names."""
+        now = time.time()
+        ready = []
+        for (filename, (seen, stat)) in list(self.pending.items()):
+            if now - seen < self.debounce:
+                continue
+            current = self.stat(filename)
+            if current is None:
+                # deleted or moved away, a move is reported under the new name
+                del self.pending[filename]
+            elif current != stat:
+                self.pending[filename] = (now, current)
+            else:
+                del self.pending[filename]
+                ready.append(filename)
+        return sorted(ready)
+
+    def iter_batches(self):
+        """Yield the lists of ready files, an empty list at least every TICK seconds."""
+        while True:
+            self.wait_events(self.TICK)
+            yield self.get_ready()
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import random
+
+import budget
+from budget import FileLimits
+from corpus import make_pdf
+from metasearch import BookMeta
+
+
+def test_memory_kept_by_a_book_does_not_fail_the_next_one(tmpdir, monkeypatch):
+    # the resident memory grows by 200 bytes while the first book is read and is never given back
+    values = [1000, 1000, 1200]
+    monkeypatch.setattr(budget, 'get_rss', lambda: values.pop(0) if len(values) > 1 else values[0])
+    limits = FileLimits(rss=100)
+    bookmetas = []
+    for name in ('first.pdf', 'second.pdf'):
+        filename = str(tmpdir.join(name))
+        make_pdf(filename, random.Random(1), '9780306406157', 'front', 8, 0)
+        bookmeta = BookMeta(filename, None, limits=limits)
+        bookmeta.detect()
+        bookmetas.append(bookmeta)
+    assert bookmetas[0].limited == 'rss'
+    assert bookmetas[0].get_new_filename({})[0] == BookMeta.RESULT_LIMITED
+    assert bookmetas[1].limited is None
+    assert bookmetas[1].isbns == ['9780306406157']
+
+
+def test_line_budget():
+    # blocks of whole lines, the ISBN in the second one
+    blocks = [''.join('line %d\n' % i for i in range(6)), 'line 6\nISBN 978-0-306-40615-7\n']
+    bookmeta = BookMeta('book.pdf', None, limits=FileLimits(text_lines=5))
+    assert bookmeta.get_isbns(list(blocks)) == []
+    assert bookmeta.limited == 'text_lines'
+    assert bookmeta.get_new_filename({})[0] == BookMeta.RESULT_LIMITED
+    bookmeta = BookMeta('book.pdf', None, limits=FileLimits(text_lines=20))
+    assert bookmeta.get_isbns(list(blocks)) == ['9780306406157']
+    assert bookmeta.limited is None
@@ -0,0 +1,35 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+
+from isbnscan_bench import legacy_get_isbns, make_texts
+from metasearch import BookMeta
+
+
+def test_isbn10_inside_isbn13_is_dropped():
+    bookmeta = BookMeta('test.pdf', None)
+    assert bookmeta.get_isbns('978 6 950 74728 8\n') == ['9786950747288']
+    assert bookmeta.SCANNER.scan('978 6 950 74728 8\n') == ['9786950747288']
+
+
+def test_same_isbns_as_legacy_on_dense_texts():
+    # the isbn-dense case of isbnscan_bench, on seeds where ISBN-10s are cut out of ISBN-13s
+    bookmeta = BookMeta('test.pdf', None)
+    for seed in range(8):
+        texts = make_texts(random.Random(seed), bookmeta.SCANNER, 5000, set(range(0, 5000, 7)))
+        assert bookmeta.get_isbns(texts) == legacy_get_isbns(bookmeta, texts)
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+
+from journal import JournalMerge
+
+
+def make_entry(directory, name, new_name, result='EMANER'):
+    filename = str(directory.join(name))
+    if not os.path.exists(filename):
+        directory.join(name).write(name)
+    return {'file': filename, 'new_name': str(directory.join(new_name)), 'result': result, 'hash': None,
+            'state': {}, 'meta': {}, 'pattern': 'title'}
+
+
+def get_names(plan):
+    return [(os.path.basename(entry['file']), os.path.basename(new_filename), result)
+            for (entry, new_filename, result) in plan]
+
+
+def test_collisions_get_existed_names(tmpdir):
+    tmpdir.join('kept.pdf').write('kept')
+    entries = [make_entry(tmpdir, 'b.pdf', 'same.pdf'), make_entry(tmpdir, 'a.pdf', 'same.pdf'),
+               make_entry(tmpdir, 'c.pdf', 'kept.pdf')]
+    tmpdir.join('TSIXE-NUM1_c.pdf').write('taken')
+    merge = JournalMerge(entries)
+    # the first source path keeps the name, the plan stays in the order of the journals
+    assert get_names(merge.make_plan()) == [('b.pdf', 'TSIXE-NUM1_b.pdf', 'TSIXE-NUM'), ('a.pdf', 'same.pdf', None),
+                                            ('c.pdf', 'TSIXE-NUM2_c.pdf', 'TSIXE-NUM')]
+    assert [os.path.basename(new_filename) for (entry, new_filename) in merge.collisions] == ['kept.pdf', 'same.pdf']
+
+
+def test_chains_and_cycles(tmpdir):
+    entries = [make_entry(tmpdir, 'a.pdf', 'b.pdf'), make_entry(tmpdir, 'b.pdf', 'c.pdf'),
+               make_entry(tmpdir, 'x.pdf', 'y.pdf'), make_entry(tmpdir, 'y.pdf', 'x.pdf')]
+    merge = JournalMerge(entries)
+    # b.pdf moves out of the way first; in the cycle, y.pdf gives up x.pdf
+    assert get_names(merge.make_plan()) == [('b.pdf', 'c.pdf', None), ('a.pdf', 'b.pdf', None),
+                                            ('y.pdf', 'TSIXE-NUM1_y.pdf', 'TSIXE-NUM'), ('x.pdf', 'y.pdf', None)]
+
+    class Recorder:
+        def __init__(self):
+            self.lines = []
+
+        def write(self, line):
+            self.lines.append(line)
+
+    recorder = Recorder()
+    assert merge.apply(recorder) == 4
+    assert sorted(os.listdir(str(tmpdir))) == ['TSIXE-NUM1_y.pdf', 'b.pdf', 'c.pdf', 'y.pdf']
+    assert tmpdir.join('c.pdf').read() == 'b.pdf' and tmpdir.join('y.pdf').read() == 'x.pdf'
+    # the collision is not a rename after the metadata
+    assert len(recorder.lines) == 3
+
+
+def test_missing_files_are_left_out(tmpdir):
+    entries = [make_entry(tmpdir, 'a.pdf', 'b.pdf')]
+    os.remove(entries[0]['file'])
+    merge = JournalMerge(entries)
+    assert merge.make_plan() == []
+    assert merge.missing == entries
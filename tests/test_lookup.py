@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from lookup import CircuitBreaker, RetryQueue
+
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker('test', threshold=2, reset_timeout=10)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.get_state() == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.get_state() == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_in() <= 10
+
+
+def test_breaker_half_open_lets_one_trial():
+    breaker = CircuitBreaker('test', threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    breaker.opened -= 10
+    assert breaker.get_state() == CircuitBreaker.HALF_OPEN
+    assert breaker.retry_in() == 0
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.get_state() == CircuitBreaker.CLOSED
+    assert breaker.timeout == 10
+    assert breaker.allow()
+
+
+def test_breaker_backoff_of_failed_trials():
+    breaker = CircuitBreaker('test', threshold=1, reset_timeout=1000)
+    breaker.record_failure()
+    timeouts = []
+    for _ in range(4):
+        breaker.opened -= breaker.timeout
+        assert breaker.allow()
+        breaker.record_failure()
+        assert breaker.get_state() == CircuitBreaker.OPEN
+        timeouts.append(breaker.timeout)
+    assert timeouts == [2000, CircuitBreaker.MAX_RESET_TIMEOUT, CircuitBreaker.MAX_RESET_TIMEOUT,
+                        CircuitBreaker.MAX_RESET_TIMEOUT]
+    breaker.opened -= breaker.timeout
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.timeout == 1000
+
+
+class FakeScheduler:
+    def __init__(self):
+        self.breakers = {}
+
+    def get_breaker(self, provider):
+        return self.breakers.setdefault(provider, CircuitBreaker(provider, threshold=1, reset_timeout=10))
+
+
+class FakeBook:
+    def __init__(self, filename, providers, renamed):
+        self.filename = filename
+        self.providers = providers
+        self.renamed = renamed  # what rename returns when not final
+        self.finals = []
+
+    def rename(self, final=False):
+        self.finals.append(final)
+        return final or self.renamed
+
+
+def test_retry_queue_keeps_books_of_open_breakers():
+    scheduler = FakeScheduler()
+    scheduler.get_breaker('slow').record_failure()
+    queue = RetryQueue(scheduler, max_attempts=2)
+    (waiting, renamed, failing) = (FakeBook('a', ['slow'], True), FakeBook('b', ['fast'], True),
+                                   FakeBook('c', ['fast'], False))
+    for bookmeta in (waiting, renamed, failing):
+        queue.add(bookmeta)
+    queue.drain()
+    assert waiting.finals == [] and renamed.finals == [False] and failing.finals == [False]
+    assert [bookmeta for (bookmeta, attempts) in queue.books] == [waiting, failing]
+    # renamed for good only at the end of the run, after max_attempts
+    scheduler.get_breaker('slow').opened -= 10
+    queue.drain(final=True)
+    assert waiting.finals == [False] and failing.finals == [False, True]
+    assert queue.books == []
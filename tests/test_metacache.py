@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from isbnlib.dev._exceptions import DataNotFoundAtServiceError
+from isbnlib.registry import add_service, set_cache
+
+from lookup import LookupScheduler
+from metacache import MetaCache
+from metalookup import MetaLookup
+from metasearch import BookMeta
+
+KNOWN = '9780306406157'
+UNKNOWN = '9781408842447'
+DAY = 24 * 3600
+
+
+class StubProvider:
+    NAME = 'stub'
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, isbn):
+        self.requests.append(isbn)
+        if isbn != KNOWN:
+            raise DataNotFoundAtServiceError(isbn)
+        return {'ISBN-13': isbn, 'Title': u'Title', 'Authors': [u'Author'], 'Publisher': u'Press', 'Year': u'2015'}
+
+    def register(self):
+        set_cache(None)
+        add_service(self.NAME, self)
+        return self
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(tmpdir):
+    clock = Clock()
+    return MetaCache(str(tmpdir.join('cache.sqlite')), {MetaCache.OUTCOME_NOTFOUND: DAY}, clock), clock
+
+
+def test_hits_and_not_found_expire_after_their_ttl(tmpdir):
+    provider = StubProvider().register()
+    (cache, clock) = make_cache(tmpdir)
+    lookup = MetaLookup([StubProvider.NAME], cache)
+    for isbn in [KNOWN, UNKNOWN]:
+        assert lookup.get_cached_meta(isbn) is None
+        lookup.fetch_isbnlin_meta(isbn)
+    assert lookup.get_cached_meta(KNOWN)[1] == MetaCache.OUTCOME_HIT
+    assert lookup.get_cached_meta(UNKNOWN) == ({}, MetaCache.OUTCOME_NOTFOUND)
+    # the negative entry lives one day, the metadata 180 days
+    clock.now += DAY + 1
+    assert lookup.get_cached_meta(UNKNOWN) is None
+    assert lookup.get_cached_meta(KNOWN)[1] == MetaCache.OUTCOME_HIT
+    clock.now += MetaCache.TTL[MetaCache.OUTCOME_HIT]
+    assert lookup.get_cached_meta(KNOWN) is None
+    assert provider.requests == [KNOWN, UNKNOWN]
+    cache.close()
+
+
+def test_cached_error_is_not_a_failure(tmpdir):
+    provider = StubProvider().register()
+    (cache, clock) = make_cache(tmpdir)
+    cache.put(KNOWN, StubProvider.NAME, MetaCache.OUTCOME_ERROR)
+    scheduler = LookupScheduler(100, 4, {})
+    try:
+        # the provider is asked again while its breaker is closed
+        bookmeta = BookMeta('book.pdf', None, StubProvider.NAME, cache=cache, scheduler=scheduler)
+        assert bookmeta.call_isbnlin_meta(KNOWN)['Title'] == u'Title'
+        assert bookmeta.status == BookMeta.STATUS_OK
+        assert provider.requests == [KNOWN]
+        # and the book waits while it is open
+        cache.put(KNOWN, StubProvider.NAME, MetaCache.OUTCOME_ERROR)
+        breaker = scheduler.get_breaker(StubProvider.NAME)
+        for _ in range(breaker.threshold):
+            breaker.record_failure()
+        bookmeta = BookMeta('book.pdf', None, StubProvider.NAME, cache=cache, scheduler=scheduler)
+        assert bookmeta.call_isbnlin_meta(KNOWN) == {}
+        assert bookmeta.status == BookMeta.STATUS_DEFERRED
+        assert provider.requests == [KNOWN]
+    finally:
+        scheduler.close()
+        cache.close()
+
+
+def test_purge(tmpdir):
+    (cache, clock) = make_cache(tmpdir)
+    cache.put(KNOWN, 'a', MetaCache.OUTCOME_HIT, {'Title': 'Title'})
+    cache.put(UNKNOWN, 'a', MetaCache.OUTCOME_NOTFOUND)
+    clock.now += DAY + 1
+    cache.put(UNKNOWN, 'b', MetaCache.OUTCOME_NOTFOUND)
+    # only the expired entries by default
+    assert cache.purge() == 1
+    assert cache.get(UNKNOWN, 'b') == (MetaCache.OUTCOME_NOTFOUND, {})
+    assert cache.purge(MetaCache.OUTCOME_NOTFOUND, expired_only=False) == 1
+    assert cache.entries(UNKNOWN) == []
+    assert [row[:3] for row in cache.stats()] == [('a', MetaCache.OUTCOME_HIT, 1)]
+    cache.close()
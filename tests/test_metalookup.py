@@ -0,0 +1,34 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+
+from metalookup import get_providers
+from metasearch import BookMeta
+
+
+def test_providers_in_order():
+    assert get_providers(' goob, openl ,,') == ['goob', 'openl']
+
+
+def test_no_provider_is_an_error():
+    for value in ['', ' , ,']:
+        with pytest.raises(ValueError):
+            get_providers(value)
+    with pytest.raises(ValueError):
+        BookMeta('book.pdf', None, ',')
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import csv
+
+from metrics import Metrics
+
+
+def read_rows(filename):
+    with open(filename, 'rb') as f:
+        return list(csv.reader(f))
+
+
+def test_finished_books_are_aggregated_and_dropped(tmpdir):
+    filename = str(tmpdir.join('report.csv'))
+    metrics = Metrics(filename)
+    for i in range(10):
+        book = 'book%d.pdf' % i
+        metrics.add_time(book, 'extract_texts', 0.1 * (i + 1))
+        metrics.add_bytes(book, 'extract_texts', 100)
+        metrics.count(book, 'isbns', 2)
+        metrics.finish(book, 'EMANER' if i < 8 else 'DELIAF')
+    metrics.add_time('pending.pdf', 'extract_texts', 2.0)
+    assert list(metrics.records) == ['pending.pdf']
+    # the rows of the finished books are written as they finish
+    rows = read_rows(filename)
+    assert len(rows) == 11
+    assert rows[1][:2] == ['book0.pdf', 'EMANER']
+    report = metrics.report()
+    assert report['files'] == 10
+    assert report['results'] == {'EMANER': 8, 'DELIAF': 2}
+    assert report['counters']['isbns'] == 20
+    assert report['bytes_extracted'] == {'extract_texts': 1000}
+    summary = report['stages']['extract_texts']
+    # the book in progress counts in the stages
+    assert summary['files'] == 11
+    assert abs(summary['total'] - 7.5) < 1e-9
+    assert (summary['min'], summary['max']) == (0.1, 2.0)
+    assert abs(summary['p50'] - 0.6) < 1e-9 and summary['p99'] == 2.0
+    assert sum(count for (bound, count) in summary['histogram']) == 11
+    # the report does not change the totals
+    assert metrics.report()['stages']['extract_texts']['files'] == 11
+    metrics.close()
+    rows = read_rows(filename)
+    assert rows[-1][:2] == ['pending.pdf', '']
+
+
+def test_percentiles_of_a_bounded_sample():
+    metrics = Metrics()
+    metrics.MAX_SAMPLES = 100
+    for i in range(1000):
+        metrics.add_time('book%d.pdf' % i, 'rename', i / 1000.0)
+        metrics.finish('book%d.pdf' % i, 'EMANER')
+    stats = metrics.totals['stages']['rename']
+    assert len(stats['samples']) == 100
+    summary = metrics.report()['stages']['rename']
+    assert summary['files'] == 1000 and (summary['min'], summary['max']) == (0.0, 0.999)
+    assert 0.3 < summary['p50'] < 0.7
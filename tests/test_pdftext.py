@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import struct
+import zlib
+
+from pdftext import PdfDocument
+
+
+def make_objects(pages):
+    # a catalog, a page tree of one level, a Helvetica font and a Flate content stream per page
+    objects = {1: '<< /Type /Catalog /Pages 2 0 R >>', 3: '<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>'}
+    kids = []
+    for (i, lines) in enumerate(pages):
+        (page, contents) = (4 + 2 * i, 5 + 2 * i)
+        kids.append(page)
+        data = zlib.compress('BT /F1 10 Tf 72 760 Td\n' + '\n'.join(
+            '(' + line + ') Tj 0 -18 Td' for line in lines) + '\nET')
+        objects[contents] = '<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(data), data)
+        objects[page] = '<< /Type /Page /Parent 2 0 R /Contents %d 0 R >>' % contents
+    objects[2] = '<< /Type /Pages /Kids [%s] /Count %d /Resources << /Font << /F1 3 0 R >> >> >>' % (
+        ' '.join('%d 0 R' % kid for kid in kids), len(kids))
+    return objects
+
+
+def write_pdf(filename, pages, objstm=False, broken_xref=False):
+    """Write a PDF of the pages, lists of lines. With objstm, the objects other than streams are
+    in an object stream and the cross-reference is a stream with a PNG predictor; with broken_xref,
+    startxref points to the wrong place."""
+    objects = make_objects(pages)
+    out = ['%PDF-1.5\n%\xe2\xe3\xcf\xd3\n']
+    offsets = {}
+    inside = [num for num in sorted(objects) if objstm and 'stream' not in objects[num]]
+    for num in sorted(objects):
+        if num not in inside:
+            offsets[num] = sum(len(part) for part in out)
+            out.append('%d 0 obj\n%s\nendobj\n' % (num, objects[num]))
+    if objstm:
+        (stream, xref) = (max(objects) + 1, max(objects) + 2)
+        header = []
+        body = ''
+        for num in inside:
+            header.append('%d %d' % (num, len(body)))
+            body += objects[num] + '\n'
+        header = ' '.join(header) + '\n'
+        data = zlib.compress(header + body)
+        offsets[stream] = sum(len(part) for part in out)
+        out.append('%d 0 obj\n<< /Type /ObjStm /N %d /First %d /Length %d /Filter /FlateDecode >>\nstream\n%s\n'
+                   'endstream\nendobj\n' % (stream, len(inside), len(header), len(data), data))
+        start = sum(len(part) for part in out)
+        rows = [struct.pack('>BIH', 0, 0, 0)]
+        for num in range(1, xref + 1):
+            if num in inside:
+                rows.append(struct.pack('>BIH', 2, stream, inside.index(num)))
+            else:
+                rows.append(struct.pack('>BIH', 1, offsets.get(num, start), 0))
+        # the PNG up predictor
+        raw = []
+        previous = '\x00' * 7
+        for row in rows:
+            raw.append('\x02' + ''.join(chr((ord(c) - ord(p)) % 256) for (c, p) in zip(row, previous)))
+            previous = row
+        data = zlib.compress(''.join(raw))
+        out.append('%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Length %d /Filter /FlateDecode '
+                   '/DecodeParms << /Predictor 12 /Columns 7 >> >>\nstream\n%s\nendstream\nendobj\n' % (
+                       xref, xref + 1, len(data), data))
+    else:
+        start = sum(len(part) for part in out)
+        out.append('xref\n0 %d\n0000000000 65535 f \n' % (max(objects) + 1))
+        out.extend('%010d 00000 n \n' % offsets[num] for num in range(1, max(objects) + 1))
+        out.append('trailer\n<< /Size %d /Root 1 0 R >>\n' % (max(objects) + 1))
+    out.append('startxref\n%d\n%%%%EOF\n' % (start + 7 if broken_xref else start))
+    with open(filename, 'wb') as f:
+        f.write(''.join(out))
+
+
+PAGES = [['Page %d line %d' % (page, line) for line in range(5)] for page in range(6)]
+PAGES[1][3] = 'ISBN 978-0-306-40615-7'
+
+
+def read_texts(filename, first, last):
+    document = PdfDocument(filename)
+    try:
+        return list(document.iter_page_texts(first, last))
+    finally:
+        document.close()
+
+
+def test_classic_xref_and_flate_page(tmpdir):
+    filename = str(tmpdir.join('classic.pdf'))
+    write_pdf(filename, PAGES)
+    texts = read_texts(filename, 2, 1)
+    assert [index for (index, text) in texts] == [0, 1, 5]
+    assert 'ISBN 978-0-306-40615-7' in texts[1][1]
+    assert 'Page 5 line 4' in texts[2][1]
+
+
+def test_xref_stream_and_object_stream(tmpdir):
+    filename = str(tmpdir.join('objstm.pdf'))
+    write_pdf(filename, PAGES, objstm=True)
+    document = PdfDocument(filename)
+    try:
+        # the page dicts are compressed objects, found through the xref stream
+        assert isinstance(document.offsets[4], tuple)
+        assert document.get_page_count() == 6
+        texts = list(document.iter_page_texts(2, 0))
+    finally:
+        document.close()
+    assert [index for (index, text) in texts] == [0, 1]
+    assert 'ISBN 978-0-306-40615-7' in texts[1][1]
+
+
+def test_broken_xref_is_rebuilt(tmpdir):
+    for objstm in (False, True):
+        filename = str(tmpdir.join('broken%d.pdf' % objstm))
+        write_pdf(filename, PAGES, objstm=objstm, broken_xref=True)
+        document = PdfDocument(filename)
+        try:
+            # the objects of the object stream are found again by the scan
+            assert isinstance(document.offsets[4], tuple) == objstm
+            texts = list(document.iter_page_texts(2, 0))
+        finally:
+            document.close()
+        assert 'ISBN 978-0-306-40615-7' in texts[1][1]
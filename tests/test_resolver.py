@@ -0,0 +1,42 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from fakeprovider import FakeProvider
+from lookup import LookupScheduler
+from metasearch import BookMeta
+from resolver import IsbnResolver
+
+
+def test_resolve_without_book_files():
+    FakeProvider(latency=0).register()
+    scheduler = LookupScheduler(100, 4, {})
+    try:
+        resolver = IsbnResolver(scheduler, FakeProvider.NAME)
+        records = list(resolver.iter_records(['9780306406157', 'junk', '0306406152']))
+    finally:
+        scheduler.close()
+    # the ISBN-10 of an ISBN already seen is skipped
+    assert [(record['input'], record['outcome']) for record in records] == [
+        ('junk', IsbnResolver.OUTCOME_INVALID), ('9780306406157', 'hit')]
+    assert records[1]['meta']['Author'] == 'Author 6157'
+    assert records[1]['provider'] == FakeProvider.NAME
+
+
+def test_check_pattern_needs_no_book():
+    assert BookMeta.check_pattern('Title : Year') == ['Title', 'Year']
+    assert BookMeta.check_pattern('Title:Nothing') == BookMeta.DEFAULT_PATTERN
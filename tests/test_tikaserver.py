@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# coding=utf-8
+
+# Copyright 2015 Eugene Su
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import stat
+import sys
+
+from metasearch import BookMeta
+from tikaserver import Tika
+
+# "java -jar JAR -eUTF-8 ARGS... (--server PORT | FILE)": the first line of JAR is the mode of the
+# server, every start is appended to JAR.log
+FAKE_JAVA = '''#!%s
+import os, socket, sys
+jar = sys.argv[2]
+if '--server' not in sys.argv:
+    sys.stdout.write('java: ' + open(sys.argv[-1]).read())
+    sys.exit(0)
+mode = open(jar).read().strip()
+open(jar + '.log', 'a').write('start\\n')
+if mode == 'broken':
+    sys.exit(1)
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(('127.0.0.1', int(sys.argv[-1])))
+server.listen(5)
+while True:
+    (conn, address) = server.accept()
+    data = ''
+    while True:
+        block = conn.recv(65536)
+        if not block:
+            break
+        data += block
+    if mode == 'reset':
+        # drop the connection in the middle of the texts
+        conn.sendall('server: ')
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, '\\x01\\x00\\x00\\x00\\x00\\x00\\x00\\x00')
+        conn.close()
+        os._exit(1)
+    conn.sendall('server: ' + data)
+    conn.close()
+'''
+
+
+def make_tika(tmpdir, mode):
+    java = tmpdir.join('bin', 'java')
+    java.write(FAKE_JAVA % sys.executable, ensure=True)
+    os.chmod(str(java), os.stat(str(java)).st_mode | stat.S_IEXEC)
+    jar = tmpdir.join('tika-app-1.8.jar')
+    jar.write(mode + '\n')
+    book = tmpdir.join('book.txt')
+    book.write('ISBN 978-0-306-40615-7\n')
+    return Tika(str(jar), str(java)), str(book)
+
+
+def get_starts(tika):
+    return len(open(tika.jar + '.log').readlines())
+
+
+def test_server_is_reused_and_restarted(tmpdir):
+    (tika, book) = make_tika(tmpdir, 'echo')
+    try:
+        for _ in range(2):
+            assert ''.join(tika.iter_texts(book, '-T -t')) == 'server: ISBN 978-0-306-40615-7\n'
+        assert get_starts(tika) == 1
+        tika.servers['-T -t'].process.kill()
+        tika.servers['-T -t'].process.wait()
+        assert ''.join(tika.iter_texts(book, '-T -t')) == 'server: ISBN 978-0-306-40615-7\n'
+        assert get_starts(tika) == 2
+    finally:
+        tika.close()
+
+
+def test_server_mode_is_given_up_after_failed_starts(tmpdir):
+    (tika, book) = make_tika(tmpdir, 'broken')
+    for _ in range(Tika.MAX_START_FAILURE + 2):
+        assert tika.iter_texts(book, '-T -t') is None
+    assert get_starts(tika) == Tika.MAX_START_FAILURE
+
+
+def test_failed_server_falls_back_to_java(tmpdir, monkeypatch):
+    (tika, book) = make_tika(tmpdir, 'reset')
+    # the one-off call runs "java -jar tika-app-1.8.jar" from the PATH and the working directory
+    monkeypatch.setenv('PATH', str(tmpdir.join('bin')) + os.pathsep + os.environ['PATH'])
+    monkeypatch.chdir(tmpdir)
+    try:
+        bookmeta = BookMeta(book, None, tika=tika)
+        texts = ''.join(bookmeta.iter_texts('-T -t'))
+        assert texts.endswith('java: ISBN 978-0-306-40615-7\n')
+        assert get_starts(tika) == 1
+        assert '-T -t' not in tika.servers
+    finally:
+        tika.close()